@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the batch of queries run by the `query-batch` command. Queries are
+read as NDJSON, one JSON object for each line with the name of a datasource
+saved in the Store and the fields of the query, for example:
+
+    {"datasource": "graphite", "target": "servers.web1.cpu", "since": "-1d"}
+    {"datasource": "cw", "id": "db", "namespace": "AWS/RDS", ...}
+
+The queries are grouped by datasource, each datasource splits its queries into
+batches fetched by one request when its backend supports it, i.e Graphite
+fetches many targets at once, and the batches run concurrently. The results
+are written as NDJSON in completion order, one record for each query:
+
+    {"id": 1, "datasource": "graphite", "series": [{"target": .., "datapoints": [[value, ts], ..]}]}
+    {"id": "db", "datasource": "cw", "error": "..."}
+
+The id of each query is the one given by its line, otherwise its line number.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import json
+
+from time import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from gramola import log
+from gramola.utils import DateTimeInvalidValue
+from gramola.cache import fetch_series
+from gramola.shards import shard_queries
+from gramola.datasources.base import DataSource, DataSourceError, InvalidMetricQuery
+
+# batches fetched at once
+MAX_WORKERS = 8
+
+
+def read_queries(lines, store, now=None):
+    """ Read the queries and group them by datasource, all of them resolved
+    using the same current time. Returns a tuple (groups, errors) where groups
+    is an ordered dict datasource name -> (datasource, [(id, query), ..]) and
+    errors the records of the lines that are not valid queries.
+
+    :param lines: iterable of str, one JSON object for each line.
+    :param store: :class:gramola.store.Store
+    :rtype: tuple
+    """
+    now = now or time()
+    groups = OrderedDict()
+    errors = []
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        try:
+            params = json.loads(line)
+            if not isinstance(params, dict):
+                raise ValueError("Expected a JSON object")
+        except ValueError, e:
+            errors.append({'id': lineno, 'error': "Invalid JSON: {}".format(e)})
+            continue
+
+        id_ = params.pop('id', lineno)
+        name = params.pop('datasource', None)
+        if not name:
+            errors.append({'id': id_, 'error': "Datasource missing"})
+            continue
+
+        if name not in groups:
+            configs = store.datasources(name=name)
+            if not configs:
+                errors.append({'id': id_, 'datasource': name, 'error': "Datasource not found"})
+                continue
+            datasource = DataSource.find(configs[0].type)(configs[0])
+            datasource.use_store(store)
+            groups[name] = (datasource, [])
+
+        datasource, queries = groups[name]
+        try:
+            query = datasource.METRIC_QUERY_CLS(**{str(k): v for k, v in params.items()})
+        except InvalidMetricQuery, e:
+            errors.append({'id': id_, 'datasource': name,
+                           'error': "Invalid query {}".format(e.errors)})
+            continue
+
+        try:
+            query = query.resolve(now=now)
+        except DateTimeInvalidValue:
+            errors.append({'id': id_, 'datasource': name,
+                           'error': "Invalid time range {} - {}".format(query.since, query.until)})
+            continue
+
+        queries.append((id_, query))
+
+    return groups, errors
+
+
+def run_batch(groups, max_workers=MAX_WORKERS):
+    """ Fetch the queries of all groups concurrently, returns a generator of the
+    records of each query in completion order.
+
+    :param groups: ordered dict returned by `read_queries`.
+    :param max_workers: int, batches fetched at once.
+    """
+    jobs = []
+    for name, (datasource, queries) in groups.iteritems():
+        # the batches are built with the same query objects
+        ids = {id(query): id_ for id_, query in queries}
+        for batch in datasource.batches([query for _, query in queries]):
+            jobs.append((name, datasource, [(ids[id(query)], query) for query in batch]))
+
+    if not jobs:
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs))))
+    try:
+        futures = {executor.submit(_fetch, datasource, [query for _, query in batch]):
+                   (name, batch) for name, datasource, batch in jobs}
+        for future in as_completed(futures):
+            name, batch = futures[future]
+            try:
+                results = future.result()
+            except Exception, e:
+                log.debug("Batch of datasource `{}` failed: {}".format(name, e))
+                error = str(e) or e.__class__.__name__
+                for id_, _ in batch:
+                    yield {'id': id_, 'datasource': name, 'error': error}
+                continue
+
+            for (id_, _), series in zip(batch, results):
+                yield {'id': id_, 'datasource': name,
+                       'series': [{'target': target, 'datapoints': datapoints}
+                                  for target, datapoints in series]}
+
+        # all batches finished, the idle workers are released at once
+        executor.shutdown(wait=True)
+    finally:
+        # the records are not consumed anymore, do not wait for the pending batches
+        executor.shutdown(wait=False)
+
+
+def _fetch(datasource, queries):
+    # a long time range of a query fetched alone is split into shards
+    if len(queries) == 1 and shard_queries(datasource, queries[0]):
+        return [[(s.name, s.datapoints()) for s in fetch_series(datasource, queries[0])]]
+
+    results = datasource.fetch_batch(queries)
+    if len(results) != len(queries):
+        raise DataSourceError("Unexpected number of results")
+    return results
+
+
+def write_records(records, stream):
+    """ Write the records as NDJSON, flushing each one """
+    for record in records:
+        stream.write(json.dumps(record))
+        stream.write("\n")
+        stream.flush()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the circuit breaker and the retries used by the datasources that
+fetch the datapoints from a remote backend. When the backend is struggling the
+refresh mode should not keep adding load to it, therefore:
+
+    retries         : Failed requests are retried a bounded number of times,
+                      waiting a random time between 0 and an exponential
+                      backoff (full jitter) and never beyond the deadline.
+    circuit breaker : After a number of consecutive failures the circuit is
+                      opened and the requests are skipped. Once the reset
+                      time is over one request is allowed as a probe, if it
+                      fails the circuit is opened again doubling the reset time.
+
+The circuit breaker of a datasource is shared by the threads that fetch the
+shards and the batches, its state is changed holding a lock.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import random
+import threading
+
+from time import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# consecutive failures that open the circuit
+DEFAULT_FAILURES = 3
+
+# seconds that the circuit is kept open before the first probe
+DEFAULT_RESET_TIMEOUT = 10
+
+# maxium seconds that the circuit is kept open between probes
+MAX_RESET_TIMEOUT = 300
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, failures=DEFAULT_FAILURES, reset_timeout=DEFAULT_RESET_TIMEOUT,
+                 max_reset_timeout=MAX_RESET_TIMEOUT):
+        """
+        :param failures: int, consecutive failures that open the circuit.
+        :param reset_timeout: int, seconds before the first probe.
+        :param max_reset_timeout: int, maxium seconds between probes.
+        """
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._timeout = reset_timeout
+        self._lock = threading.Lock()
+
+    def allow(self, now=None):
+        """ Returns True if a request can be sent, when the circuit is open
+        only one probe is allowed once the reset time is over.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            elif self.state == HALF_OPEN:
+                # the probe has not finished yet
+                return False
+
+            now = now or time()
+            if now - self._opened_at >= self._timeout:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+            self._timeout = self.reset_timeout
+
+    def failure(self, now=None):
+        now = now or time()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # the probe failed, wait longer before the next one
+                self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+                self._open(now)
+                return
+
+            self._failures += 1
+            if self._failures >= self.failures:
+                self._open(now)
+
+    def _open(self, now):
+        # called holding the lock
+        self.state = OPEN
+        self._opened_at = now
+
+
+def backoff(attempt, base=0.1, cap=2.0, rnd=random):
+    """ Returns the seconds to wait before the retry attempt given, starting
+    at 0, using the full jitter strategy.
+    """
+    return rnd.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the cache of the raw series returned by the datasources. The cache is
+saved under the Store directory, one file for each entry, and it is keyed by the
+configuration of the datasource, the query without its transform, the resolved
+time range and the maxdatapoints. Therefore running again the same query with
+another transform does not fetch the datapoints again.
+
+Entries whose time range finished before they were fetched, minus the TTL, hold
+datapoints that are not going to change and they are kept until they are evicted.
+The other ones are considered fresh only during the TTL.
+
+Queries split into shards, see :mod:gramola.shards, cache each shard on its own,
+so the shards of the closed history are not fetched again.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import os
+import json
+import hashlib
+
+from time import time
+
+from gramola import log
+from gramola.transforms import Series
+from gramola.shards import shard_queries, fetch_shards, stitch
+
+DEFAULT_TTL = 60
+CACHE_DIRNAME = "cache"
+
+# maxium number of entries kept, the oldest ones are evicted
+MAX_ENTRIES = 256
+
+
+def query_key(configuration, query, maxdatapoints=None):
+    """ Returns the key of the raw series of a resolved query.
+
+    :param configuration: :class:gramola.datasources.base.DataSourceConfig
+    :param query: :class:gramola.datasources.base.MetricQuery
+    :param maxdatapoints: int
+    :rtype: str
+    """
+    params = query.dict()
+    params.pop('transform', None)
+    key = json.dumps([configuration.dict(), params, list(query.time_range()), maxdatapoints],
+                     sort_keys=True)
+    return hashlib.sha1(key).hexdigest()
+
+
+class SeriesCache(object):
+
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES):
+        """
+        :param directory: str, directory used to save the entries.
+        :param ttl: int, seconds that the entries of recent time ranges are fresh.
+        :param max_entries: int, maxium number of entries kept.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @classmethod
+    def from_store(cls, store, ttl=DEFAULT_TTL):
+        """ Returns the cache saved under the store directory """
+        return cls(store.directory(CACHE_DIRNAME), ttl=ttl)
+
+    def _filepath(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key, now=None):
+        """ Returns the list of :class:gramola.transforms.Series saved with the key,
+        or None if it is not found or it is not fresh anymore.
+        """
+        now = now or time()
+        try:
+            with open(self._filepath(key)) as fd:
+                entry = json.load(fd)
+        except (IOError, ValueError):
+            return None
+
+        if entry['until'] + self.ttl > entry['fetched'] and entry['fetched'] + self.ttl <= now:
+            return None
+
+        return [Series.from_datapoints(name, zip(values, timestamps))
+                for name, values, timestamps in entry['series']]
+
+    def put(self, key, until, series, now=None):
+        """ Save the list of :class:gramola.transforms.Series with the key.
+
+        :param until: int, the end of the time range of the series.
+        """
+        entry = {
+            'fetched': now or time(),
+            'until': until,
+            'series': [[s.name, [v if v == v else None for v in s.values], list(s.timestamps)]
+                       for s in series]
+        }
+
+        tmp = self._filepath(key) + ".tmp"
+        try:
+            with open(tmp, "w") as fd:
+                json.dump(entry, fd)
+            os.rename(tmp, self._filepath(key))
+        except IOError, e:
+            log.warning("Series can not be cached: {}".format(e))
+            return
+
+        self._evict()
+
+    def _evict(self):
+        entries = [os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                   if f.endswith(".json")]
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort(key=os.path.getmtime)
+        for filepath in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+
+
+def fetch_series(datasource, query, maxdatapoints=None, cache=None, now=None):
+    """ Returns the list of raw :class:gramola.transforms.Series of a resolved
+    query, they are read from the cache when it is given and the entry is fresh,
+    otherwise they are fetched from the datasource and saved into the cache.
+
+    Long time ranges are split into shards fetched concurrently, each shard is
+    cached on its own.
+    """
+    shards = shard_queries(datasource, query, maxdatapoints=maxdatapoints)
+    if shards:
+        return stitch(fetch_shards(
+            lambda shard, shard_maxdatapoints: _fetch_series(
+                datasource, shard, shard_maxdatapoints, cache, now),
+            shards))
+
+    return _fetch_series(datasource, query, maxdatapoints, cache, now)
+
+
+def _fetch_series(datasource, query, maxdatapoints, cache, now):
+    key = None
+    if cache is not None:
+        key = query_key(datasource.configuration, query, maxdatapoints=maxdatapoints)
+        series = cache.get(key, now=now)
+        if series is not None:
+            return series
+
+    series = [Series.from_datapoints(name, datapoints) for name, datapoints in
+              datasource.iter_series(query, maxdatapoints=maxdatapoints)]
+
+    # empty results are usually errors, they are not cached
+    if cache is not None and series:
+        cache.put(key, query.time_range().until, series, now=now)
+    return series
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Implements a local catalogue of the metrics published by CloudWatch through the
+`list_metrics` call. The catalogue is saved under the Store directory as a
+SQLite file, one for each profile and region, indexed by namespace, metric name
+and dimension to answer questions like "which metrics have the dimension
+InstanceId=i-61cefbec" without crawling CloudWatch.
+
+The catalogue is refreshed by namespace, only those namespaces older than the
+TTL given are saved again. CloudWatch does not list the namespaces alone, so the
+refresh lists all metrics to find the new namespaces as well, skipping the ones
+of the fresh namespaces. Metrics are saved as the pages arrive, so a refresh
+running in the background never hides the metrics already known.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import os
+import time
+import sqlite3
+import threading
+
+from gramola import log
+
+DEFAULT_TTL = 24 * 3600
+INDEX_DIRNAME = "indexes"
+
+# number of metrics returned by each list_metrics call
+PAGE_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS namespaces (
+    namespace TEXT PRIMARY KEY,
+    refreshed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    metricname TEXT NOT NULL,
+    dimensions TEXT NOT NULL,
+    refreshed REAL NOT NULL,
+    UNIQUE (namespace, metricname, dimensions)
+);
+CREATE INDEX IF NOT EXISTS metrics_metricname ON metrics (metricname);
+CREATE TABLE IF NOT EXISTS dimensions (
+    metric_id INTEGER NOT NULL REFERENCES metrics (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dimensions_name_value ON dimensions (name, value);
+CREATE INDEX IF NOT EXISTS dimensions_metric_id ON dimensions (metric_id);
+"""
+
+
+def _dumps_dimensions(dimensions):
+    # canonical representation used to identify a metric
+    return ",".join("{}={}".format(d['Name'], d['Value'])
+                    for d in sorted(dimensions, key=lambda d: d['Name']))
+
+
+def _loads_dimensions(dimensions):
+    return [tuple(d.split("=", 1)) for d in dimensions.split(",")] if dimensions else []
+
+
+class CWCatalogue(object):
+    """ Catalogue of the metrics of one CloudWatch profile and region. The
+    datasource given is only used to refresh the catalogue, searches only use
+    the local file.
+    """
+    def __init__(self, filepath, datasource=None, region=None, ttl=DEFAULT_TTL):
+        """
+        :param filepath: str, SQLite file used to save the catalogue.
+        :param datasource: :class:gramola.datasources.cloudwatch.CWDataSource
+        :param region: str, region crawled instead of the datasource one.
+        :param ttl: int, seconds that the metrics of a namespace are considered fresh.
+        """
+        self.filepath = filepath
+        self.datasource = datasource
+        self.region = region
+        self.ttl = ttl
+        self._connection = self._connect()
+
+    @classmethod
+    def from_store(cls, store, profile=None, region=None, datasource=None, ttl=DEFAULT_TTL):
+        """ Returns the catalogue of a profile and region saved under the store directory """
+        filename = "cw-{}-{}.db".format(profile or "default", region or "default")
+        return cls(os.path.join(store.directory(INDEX_DIRNAME), filename),
+                   datasource=datasource, region=region, ttl=ttl)
+
+    def _connect(self):
+        # the connection waits for the locks taken by other threads
+        # or processes refreshing the same catalogue.
+        connection = sqlite3.connect(self.filepath, timeout=30)
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.executescript(_SCHEMA)
+        return connection
+
+    def empty(self):
+        """ Returns True if the catalogue was never refreshed """
+        return self._connection.execute("SELECT COUNT(*) FROM namespaces").fetchone()[0] == 0
+
+    def expired(self, now=None):
+        """ Returns the list of namespaces older than the TTL """
+        now = now or time.time()
+        return [row[0] for row in self._connection.execute(
+            "SELECT namespace FROM namespaces WHERE refreshed + ? <= ? ORDER BY namespace",
+            (self.ttl, now))]
+
+    def search(self, namespace=None, prefix=None, dimension=None):
+        """ Returns the sorted list of metrics that match with all filters given, each
+        metric is returned as a tuple (namespace, metricname, [(name, value), ...]).
+
+        :param namespace: str, only the metrics of this namespace.
+        :param prefix: str, only the metrics whose name starts with the prefix.
+        :param dimension: tuple (name, value), only the metrics with this dimension,
+                          the value can be None to match any value.
+        :rtype: list
+        """
+        sql = "SELECT m.namespace, m.metricname, m.dimensions FROM metrics m"
+        where = []
+        params = []
+        if dimension:
+            sql += " JOIN dimensions d ON d.metric_id = m.id"
+            where.append("d.name = ?")
+            params.append(dimension[0])
+            if dimension[1] is not None:
+                where.append("d.value = ?")
+                params.append(dimension[1])
+
+        if namespace:
+            where.append("m.namespace = ?")
+            params.append(namespace)
+
+        if prefix:
+            # a range uses the index of the metricname
+            where.append("m.metricname >= ? AND m.metricname < ?")
+            params.extend([prefix, prefix + u"\uffff"])
+
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY m.namespace, m.metricname, m.dimensions"
+
+        return [(namespace, metricname, _loads_dimensions(dimensions))
+                for namespace, metricname, dimensions in self._connection.execute(sql, params)]
+
+    def refresh(self, namespaces=None, expired=False, now=None):
+        """ Crawl the metrics of the namespaces given, or all metrics if None. Metrics
+        are saved page by page, once the crawl of a namespace finishes those of its
+        metrics that were not seen are removed.
+
+        :param namespaces: list of str.
+        :param expired: boolean, crawl all metrics but only save the ones of the
+                        namespaces older than the TTL and the new namespaces.
+        """
+        # sqlite connections can not be shared between threads
+        connection = self._connect()
+        try:
+            if expired:
+                now = now or time.time()
+                fresh = frozenset(row[0] for row in connection.execute(
+                    "SELECT namespace FROM namespaces WHERE refreshed + ? > ?", (self.ttl, now)))
+                self._crawl(connection, None, fresh=fresh)
+                return
+
+            for namespace in (namespaces or [None]):
+                self._crawl(connection, namespace)
+        finally:
+            connection.close()
+
+    def refresh_in_background(self, namespaces=None, expired=False):
+        """ Run the refresh using a daemon thread, returns the thread started. The
+        caller has to join it, otherwise the refresh is stopped when the process
+        exits and it starts over the next time.
+        """
+        def refresh():
+            try:
+                self.refresh(namespaces=namespaces, expired=expired)
+            except Exception, e:
+                log.error("Catalogue refresh failed: {}".format(e))
+
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _crawl(self, connection, namespace, fresh=frozenset()):
+        started = time.time()
+        seen = set()
+        count = 0
+        for metric in self.datasource.list_metrics(namespace=namespace, region=self.region):
+            if metric['Namespace'] in fresh:
+                continue
+            self._upsert(connection, metric, started)
+            seen.add(metric['Namespace'])
+            count += 1
+            if count % PAGE_SIZE == 0:
+                # one transaction for each page, readers see the progress
+                connection.commit()
+
+        crawled = [namespace] if namespace else list(seen)
+        if namespace is None:
+            # a full crawl also forgets the namespaces that do not exist anymore
+            crawled += [row[0] for row in connection.execute("SELECT namespace FROM namespaces")
+                        if row[0] not in seen and row[0] not in fresh]
+
+        for ns in crawled:
+            connection.execute(
+                "DELETE FROM metrics WHERE namespace = ? AND refreshed < ?", (ns, started))
+            if ns in seen or ns == namespace:
+                connection.execute(
+                    "INSERT OR REPLACE INTO namespaces (namespace, refreshed) VALUES (?, ?)",
+                    (ns, started))
+            else:
+                connection.execute("DELETE FROM namespaces WHERE namespace = ?", (ns,))
+        connection.commit()
+        log.debug("Catalogue refreshed {} metrics of namespace {}".format(
+            count, namespace or "all"))
+
+    def _upsert(self, connection, metric, refreshed):
+        key = (metric['Namespace'], metric['MetricName'],
+               _dumps_dimensions(metric.get('Dimensions', [])))
+        cursor = connection.execute(
+            "UPDATE metrics SET refreshed = ? WHERE namespace = ? AND metricname = ? AND "
+            "dimensions = ?", (refreshed,) + key)
+        if cursor.rowcount:
+            return
+
+        cursor = connection.execute(
+            "INSERT INTO metrics (namespace, metricname, dimensions, refreshed) "
+            "VALUES (?, ?, ?, ?)", key + (refreshed,))
+        connection.executemany(
+            "INSERT INTO dimensions (metric_id, name, value) VALUES (?, ?, ?)",
+            [(cursor.lastrowid, d['Name'], d['Value']) for d in metric.get('Dimensions', [])])
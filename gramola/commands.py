@@ -5,12 +5,16 @@ of commands supported are:
 
   * gramola types                  : List of the datasource types supported.
   * gramola datasource             : Show a specific datasource.
-  * gramola datasource-test        : Test a specific datasource.
+  * gramola datasource-test        : Test one or many datasources.
   * gramola datasource-list        : List all datasources.
   * gramola datasource-rm          : Remove one datasource.
   * gramola datasource-add-<type>  : Add a new datasource.
   * gramola datasource-echo-<type> : Echo a datasource.
+  * gramola store-import           : Import the INI datasources into the SQLite store.
   * gramola query-<type>           : Run a metrics query.
+  * gramola query-batch            : Run many queries read as NDJSON.
+  * gramola metrics-find-graphite  : Find Graphite metrics using a local index.
+  * gramola metrics-find-cw        : Find CloudWatch metrics using a local catalogue.
   * gramola dashboard              : Show a specific dashboard.
   * gramola dashboard-list         : List all dashboards.
   * gramola dashboard-rm           : Remove a dashboard.
@@ -23,17 +27,37 @@ from __future__ import print_function
 
 import sys
 import optparse
+import threading
 import sparkline
 
-from time import sleep
-from json import loads
+from time import time
+from json import loads, dumps
+from Queue import Queue, Empty
+from itertools import izip
+from collections import deque
 
 from gramola import log
-from gramola.plot import Plot, DEFAULT_ROWS
+from gramola.plot import Plot, DEFAULT_ROWS, DEFAULT_MODE, MODES, MAX_FPS
+from gramola.grid import Grid, parse_grid
+from gramola.heatmap import Heatmap, HEATMAP
+from gramola.scheduler import Scheduler, DEFAULT_INTERVAL, DEFAULT_STEP
+from gramola.output import Writer, FORMATS, newer, tail
+from gramola.cache import SeriesCache, fetch_series
+from gramola.shards import shard_queries
+from gramola.rollup import Pyramid, fetch_rollup
+from gramola.snapshot import Snapshot
+from gramola.ratelimit import report as ratelimit_report
+from gramola.interactive import Viewport, Keyboard, QUIT
+from gramola.batch import read_queries, run_batch, write_records, MAX_WORKERS as BATCH_WORKERS
+from gramola.transforms import Series, Pipeline, InvalidTransform
+from gramola.index import GraphiteIndex, DEFAULT_TTL as DEFAULT_INDEX_TTL
+from gramola.catalogue import CWCatalogue, DEFAULT_TTL as DEFAULT_CATALOGUE_TTL
 from gramola.store import (
     Store,
     NotFound,
-    DuplicateEntry
+    DuplicateEntry,
+    INIBackend,
+    SQLiteBackend
 )
 from gramola.contrib.subcommand import (
     Subcommand,
@@ -45,6 +69,17 @@ from gramola.datasources.base import (
     InvalidDataSourceConfig
 )
 
+# status of the datasources tested
+CHECK_OK = 'ok'
+CHECK_FAILED = 'failed'
+CHECK_TIMEOUT = 'timeout'
+
+# seconds to wait for all datasources tested
+DEFAULT_CHECK_TIMEOUT = 10
+
+# datasources tested at once
+MAX_CHECK_WORKERS = 8
+
 
 class InvalidParams(Exception):
     def __init__(self, error_params):
@@ -115,28 +150,53 @@ class DataSourceCommand(GramolaCommand):
 
 class DataSourceTestCommand(GramolaCommand):
     NAME = 'datasource-test'
-    DESCRIPTION = 'Test if the service behind a data source is available'
-    USAGE = '%prog NAME'
+    DESCRIPTION = 'Test if the services behind one or many data sources are available'
+    USAGE = '%prog [NAME ...]'
 
     @staticmethod
     def execute(options, suboptions, *subargs):
-        """ Test an already saved datasource."""
-        try:
-            name = subargs[0]
-        except IndexError:
+        """ Test already saved datasources, the ones named or all of them
+        with the flag `--all`, filtered by type with `--type`. They are tested
+        concurrently and the ones not finished by the timeout are given as
+        timed out.
+        """
+        if not subargs and not suboptions.all and not suboptions.type:
             raise InvalidParams("NAME")
 
         store = options.store and Store(path=options.store) or Store()
-        try:
-            config = store.datasources(name=name)[0]
-        except IndexError:
-            print("Datasource `{}` not found, NOT TESTED".format(name))
+        configs = store.datasources(type_=suboptions.type)
+        if subargs:
+            found = set(config.name for config in configs)
+            for name in subargs:
+                if name not in found:
+                    print("Datasource `{}` not found, NOT TESTED".format(name))
+            configs = [config for config in configs if config.name in subargs]
+
+        if not configs:
             return
 
-        if DataSource.find(config.type)(config).test():
-            print("Datasource `{}` seems ok".format(name))
-        else:
-            print("Datasource `{}` FAILED!".format(name))
+        results = check_datasources(configs, timeout=suboptions.timeout)
+        if suboptions.json:
+            print(dumps([{'name': config.name, 'type': config.type, 'status': status,
+                          'latency': latency} for config, status, latency in results]))
+            return
+
+        for line in format_checks(results):
+            print(line)
+
+    @staticmethod
+    def options():
+        return [
+            (("--all",), {"action": "store_true", "default": False,
+                          "help": "Test all saved datasources"}),
+            (("--type",), {"action": "store", "default": None,
+                           "help": "Test only the datasources of this type"}),
+            (("--timeout",), {"action": "store", "type": "float", "default": DEFAULT_CHECK_TIMEOUT,
+                              "help": "Seconds to wait for all tests, default " +
+                              "{}s".format(DEFAULT_CHECK_TIMEOUT)}),
+            (("--json",), {"action": "store_true", "default": False,
+                           "help": "Print the results as JSON"}),
+        ]
 
 
 class DataSourceRmCommand(GramolaCommand):
@@ -308,6 +368,180 @@ class DataSourceListCommand(GramolaCommand):
             print("Datasource `{}` ({})".format(datasource.name, datasource.type))
 
 
+class StoreImportCommand(GramolaCommand):
+    NAME = 'store-import'
+    DESCRIPTION = 'Import the datasources of the INI file into the SQLite store'
+    USAGE = '%prog'
+
+    @staticmethod
+    def execute(options, suboptions, *subargs):
+        """ Import the datasources saved into the INI file, afterwards the
+        store uses the SQLite backend.
+        """
+        store = Store(path=options.store or None, backend=SQLiteBackend.NAME)
+        for name in store.backend.import_from(INIBackend(store.datasources_filepath)):
+            print("Datasource `{}` imported".format(name))
+
+
+class QueryBatchCommand(GramolaCommand):
+    NAME = 'query-batch'
+    DESCRIPTION = 'Run many queries read as NDJSON from a file or the stdin'
+    USAGE = '%prog [FILE]'
+
+    @staticmethod
+    def execute(options, suboptions, *subargs):
+        """ Run the queries of the file given, or the stdin, concurrently and
+        write one NDJSON record with the series or the error of each query
+        as they finish.
+        """
+        store = options.store and Store(path=options.store) or Store()
+        if subargs and subargs[0] != '-':
+            try:
+                with open(subargs[0]) as fd:
+                    groups, errors = read_queries(fd, store)
+            except IOError, e:
+                print("File `{}` can not be read: {}".format(subargs[0], e), file=sys.stderr)
+                return
+        else:
+            groups, errors = read_queries(sys.stdin, store)
+
+        write_records(errors, sys.stdout)
+        write_records(run_batch(groups, max_workers=suboptions.workers), sys.stdout)
+
+    @staticmethod
+    def options():
+        return [
+            (("--workers",), {"action": "store", "type": "int", "default": BATCH_WORKERS,
+                              "help": "Batches fetched at once, default {}".format(BATCH_WORKERS)}),
+        ]
+
+
+class MetricsFindGraphiteCommand(GramolaCommand):
+    NAME = 'metrics-find-graphite'
+    DESCRIPTION = 'Find the metrics of a Graphite datasource using a local index'
+    USAGE = '%prog DATASOURCE_NAME PATTERN'
+
+    @staticmethod
+    def execute(options, suboptions, *subargs):
+        """ Print the metric paths that match with the pattern, branches are
+        printed with a trailing dot. Only the branches of the index not found or
+        expired are fetched from the Graphite service.
+        """
+        try:
+            name, pattern = subargs[0], subargs[1]
+        except IndexError:
+            raise InvalidParams("NAME PATTERN")
+
+        store = options.store and Store(path=options.store) or Store()
+        try:
+            config = store.datasources(name=name, type_='graphite')[0]
+        except IndexError:
+            print("Datasource `{}` not found".format(name), file=sys.stderr)
+            return
+
+        datasource = None if suboptions.offline else DataSource.find(config.type)(config)
+        index = GraphiteIndex.from_store(store, name, datasource=datasource, ttl=suboptions.ttl)
+        if suboptions.complete:
+            paths = index.complete(pattern)
+        else:
+            paths = [path + ("" if leaf else ".") for path, leaf in index.find(pattern)]
+        index.save()
+
+        for path in paths:
+            print(path)
+
+    @staticmethod
+    def options():
+        return [
+            (("--ttl",), {"action": "store", "type": "int", "default": DEFAULT_INDEX_TTL,
+                          "help": "Seconds that the branches of the index are fresh, " +
+                          "default {}s".format(DEFAULT_INDEX_TTL)}),
+            (("--complete",), {"action": "store_true", "default": False,
+                               "help": "Complete the PATTERN as a prefix, used by shells"}),
+            (("--offline",), {"action": "store_true", "default": False,
+                              "help": "Use only the local index"}),
+        ]
+
+
+class MetricsFindCWCommand(GramolaCommand):
+    NAME = 'metrics-find-cw'
+    DESCRIPTION = 'Find the metrics of a CloudWatch datasource using a local catalogue'
+    USAGE = '%prog DATASOURCE_NAME'
+
+    @staticmethod
+    def execute(options, suboptions, *subargs):
+        """ Print the metrics of the catalogue that match with the filters given. The
+        catalogue is crawled the first time, afterwards the namespaces expired and
+        the new ones are refreshed in background while the metrics are printed.
+        The command waits for the refresh before exiting, unless it is interrupted.
+        """
+        try:
+            name = subargs[0]
+        except IndexError:
+            raise InvalidParams("NAME")
+
+        dimension = None
+        if suboptions.dimension:
+            dimension = tuple(suboptions.dimension.split("=", 1))
+            if len(dimension) == 1:
+                dimension = (dimension[0], None)
+
+        store = options.store and Store(path=options.store) or Store()
+        try:
+            config = store.datasources(name=name, type_='cw')[0]
+        except IndexError:
+            print("Datasource `{}` not found".format(name), file=sys.stderr)
+            return
+
+        datasource = DataSource.find(config.type)(config)
+        datasource.use_store(store)
+        catalogue = CWCatalogue.from_store(store, profile=config.profile,
+                                           region=suboptions.region or config.region,
+                                           datasource=datasource, ttl=suboptions.ttl)
+        refresh = None
+        if suboptions.offline:
+            pass
+        elif catalogue.empty() or suboptions.refresh:
+            log.info("Crawling the CloudWatch metrics, it might take a while")
+            catalogue.refresh()
+        elif catalogue.expired():
+            refresh = catalogue.refresh_in_background(expired=True)
+
+        for namespace, metricname, dimensions in catalogue.search(
+                namespace=suboptions.namespace, prefix=suboptions.prefix, dimension=dimension):
+            print("{} {} {}".format(namespace, metricname,
+                                    " ".join("{}={}".format(*d) for d in dimensions)))
+
+        if refresh:
+            log.info("Refreshing the expired namespaces of the catalogue, Ctrl-C to skip it")
+            try:
+                # a join with timeout can be interrupted by the user
+                while refresh.is_alive():
+                    refresh.join(0.5)
+            except KeyboardInterrupt:
+                log.info("Catalogue refresh skipped until the next search")
+
+    @staticmethod
+    def options():
+        return [
+            (("--namespace",), {"action": "store", "default": None,
+                                "help": "Only the metrics of this namespace, ex: AWS/EC2"}),
+            (("--prefix",), {"action": "store", "default": None,
+                             "help": "Only the metrics whose name starts with this prefix"}),
+            (("--dimension",), {"action": "store", "default": None, "metavar": "NAME[=VALUE]",
+                                "help": "Only the metrics with this dimension"}),
+            (("--region",), {"action": "store", "default": None,
+                             "help": "Use this region instead of the datasource one"}),
+            (("--ttl",), {"action": "store", "type": "int", "default": DEFAULT_CATALOGUE_TTL,
+                          "help": "Seconds that the namespaces of the catalogue are fresh, " +
+                          "default {}s".format(DEFAULT_CATALOGUE_TTL)}),
+            (("--refresh",), {"action": "store_true", "default": False,
+                              "help": "Crawl again all metrics before searching"}),
+            (("--offline",), {"action": "store_true", "default": False,
+                              "help": "Use only the local catalogue"}),
+        ]
+
+
 def build_datasource_query_type(datasource_cls):
     """
     Build the query command for one type of datasource_cls, it turns out
@@ -329,9 +563,18 @@ def build_datasource_query_type(datasource_cls):
             except IndexError:
                 raise InvalidParams("NAME")
 
-            if name == '-':
+            cache = store = None
+            if name == '-' and datasource_cls.CONSUMES_STDIN:
+                # the stdin belongs to the datasource, use the default config
+                config = datasource_cls.DATA_SOURCE_CONFIGURATION_CLS(
+                    type=datasource_cls.TYPE, name=name)
+            elif name == '-':
                 buffer_ = sys.stdin.read()
-                config = loads(buffer_)
+                try:
+                    config = datasource_cls.DATA_SOURCE_CONFIGURATION_CLS(**loads(buffer_))
+                except InvalidDataSourceConfig, e:
+                    print("Datasource config invalid {}".format(e.errors), file=sys.stderr)
+                    return
             else:
                 store = options.store and Store(path=options.store) or Store()
                 try:
@@ -339,51 +582,179 @@ def build_datasource_query_type(datasource_cls):
                 except IndexError:
                     print("Datasource {} not found".format(name), file=sys.stderr)
                     return
+                cache = SeriesCache.from_store(store)
+
+            required_keys = datasource_cls.METRIC_QUERY_CLS.required_keys()
+            if suboptions.grid or suboptions.output:
+                # each group of required args belongs to one query
+                args = subargs[1:]
+                step = len(required_keys) or 1
+                queries_args = [args[i:i + step] for i in range(0, len(args), step)]
+            else:
+                queries_args = [subargs[1:]]
 
-            query_params = {
-                k: v for v, k in zip(subargs[1:],
-                                     datasource_cls.METRIC_QUERY_CLS.required_keys())
-            }
+            queries = []
+            for query_args in queries_args:
+                query_params = {k: v for v, k in zip(query_args, required_keys)}
 
-            # set also the optional keys given as suboptional params
-            query_params.update(**{str(k): getattr(suboptions, str(k))
-                                for k in filter(lambda k: getattr(suboptions, str(k)),
-                                datasource_cls.METRIC_QUERY_CLS.optional_keys())})
+                # set also the optional keys given as suboptional params
+                query_params.update(**{str(k): getattr(suboptions, str(k))
+                                    for k in filter(lambda k: getattr(suboptions, str(k)),
+                                    datasource_cls.METRIC_QUERY_CLS.optional_keys())})
+
+                try:
+                    queries.append(datasource_cls.METRIC_QUERY_CLS(**query_params))
+                except InvalidMetricQuery, e:
+                    raise InvalidParams(e.errors)
 
             try:
-                query = datasource_cls.METRIC_QUERY_CLS(**query_params)
-            except InvalidMetricQuery, e:
-                raise InvalidParams(e.errors)
+                pipelines = [Pipeline(query.transform) for query in queries]
+            except InvalidTransform, e:
+                raise InvalidParams(str(e))
 
             try:
                 datasource = datasource_cls(config)
             except InvalidDataSourceConfig, e:
                 print("Datasource config invalid {}".format(e.errors), file=sys.stderr)
+                return
+
+            if store is not None:
+                datasource.use_store(store)
+
+            # the first transforms that the datasource applies by itself are pushed down
+            queries = [pipeline.push_down(datasource, query)
+                       for query, pipeline in zip(queries, pipelines)]
+
+            if suboptions.output and datasource.LIVE:
+                raise InvalidParams("--output is not supported by live datasources")
+            elif suboptions.output:
+                write_queries(datasource, queries, Writer.find(suboptions.output)(sys.stdout),
+                              refresh=suboptions.refresh, refresh_freq=suboptions.refresh_freq,
+                              pipelines=pipelines)
+                return
+
+            heatmap = suboptions.plot_mode == HEATMAP
+            if heatmap and (suboptions.grid or datasource.LIVE):
+                raise InvalidParams("The heatmap mode does not support grids nor live datasources")
+
+            if heatmap:
+                plot = Heatmap(max_x=suboptions.plot_maxx, rows=suboptions.plot_rows)
+                maxdatapoints = [plot.maxdatapoints()]
+                draw = lambda series, stale: plot.draw(series[0], stale=stale[0])
+            elif suboptions.grid:
+                try:
+                    columns, rows = parse_grid(suboptions.grid)
+                    grid = Grid([query.label() for query in queries], columns, rows,
+                                max_x=suboptions.plot_maxx, plot_rows=suboptions.plot_rows,
+                                mode=suboptions.plot_mode)
+                except ValueError, e:
+                    raise InvalidParams(str(e))
+
+                maxdatapoints = [grid.maxdatapoints(idx) for idx in range(len(queries))]
+                draw = grid.draw
             else:
-                plot = Plot(max_x=suboptions.plot_maxx)
+                plot = Plot(max_x=suboptions.plot_maxx, rows=suboptions.plot_rows,
+                            mode=suboptions.plot_mode)
+                maxdatapoints = [plot.maxdatapoints()]
+                draw = lambda series, stale: plot.draw(series[0], stale=stale[0])
+
+            if datasource.LIVE and suboptions.interactive:
+                raise InvalidParams("--interactive is not supported by live datasources")
+            elif datasource.LIVE:
+                draw_live(datasource, queries, maxdatapoints, draw, refresh=suboptions.refresh)
+                return
+
+            # the interactive mode zooms and pans over the rollups of the raw series,
+            # saved when they belong to a saved datasource.
+            pyramids = viewports = keyboard = None
+            if suboptions.rollup or suboptions.interactive:
+                pyramids = [Pyramid.from_store(store, config, query) if store is not None
+                            else Pyramid() for query in queries]
+            if suboptions.interactive:
+                now = time()
+                viewports = [Viewport(query.time_range(now=now), now) for query in queries]
+                keyboard = Keyboard(sys.stdin)
+
+            # The scheduler gives the queries that are due, at the beginning all of them,
+            # and learns when each one will get new datapoints.
+            scheduler = Scheduler(range(len(queries)), interval=suboptions.refresh_freq)
+            series = [[] for query in queries]
+            stale = [False for query in queries]
+
+            # the last series of a saved datasource are painted as stale at once,
+            # while the fresh ones are fetched. The heatmap does not keep the series.
+            snapshots = None
+            if store is not None and not heatmap:
+                snapshots = [Snapshot.from_store(store, config, query) for query in queries]
+                draw_snapshots(snapshots, pipelines, maxdatapoints, series, stale, draw)
+
+            try:
                 while True:
-                    plot.draw(datasource.datapoints(query, maxdatapoints=plot.width()))
-                    if not suboptions.refresh:
-                        break
                     try:
-                        sleep(int(suboptions.refresh_freq))
+                        if keyboard is not None:
+                            key = keyboard.read(max(0, scheduler.next_due() - time()))
+                            if key == QUIT:
+                                break
+                            elif key is not None and any([viewport.handle(key)
+                                                          for viewport in viewports]):
+                                scheduler.wake()
+                            elif key is not None:
+                                # nothing changed, keep reading keys
+                                continue
+                        due = scheduler.wait()
                     except KeyboardInterrupt:
                         break
 
+                    if due:
+                        fetch_and_draw(datasource, queries, due, maxdatapoints, pipelines,
+                                       scheduler, series, stale, draw,
+                                       heatmap=plot if heatmap else None,
+                                       cache=cache, pyramids=pyramids, viewports=viewports,
+                                       snapshots=snapshots)
+                    if not suboptions.refresh and keyboard is None:
+                        break
+            finally:
+                if keyboard is not None:
+                    keyboard.close()
+                for snapshot in snapshots or []:
+                    snapshot.save()
+
         @staticmethod
         def options():
             # Command Options
             command_options = [
                 (("--refresh",), {"action": "store_true", "default": False,
                                   "help": "Keep graphing forever, default False "}),
-                (("--refresh-freq",), {"action": "store", "type": "int", "default": 10,
-                                       "help": "Refresh frequency in seconds, default 10s"}),
+                (("--refresh-freq",), {"action": "store", "type": "int",
+                                       "default": DEFAULT_INTERVAL,
+                                       "help": "Refresh frequency in seconds used when the step" +
+                                       " of the metric is unknown, default {}s".format(
+                                           DEFAULT_INTERVAL)}),
                 (("--plot-maxx",), {"action": "store", "type": "int", "default": None,
                                     "help": "Configure the maxium value X expected, otherwise the plot"+
                                     " will use the maxium value got by the time window" }),
                 (("--plot-rows",), {"action": "store", "type": "int", "default": DEFAULT_ROWS,
                                     "help": "Configure the maxium value X expected, otherwise the plot"+
                                     " will use the maxium value got by the time window" }),
+                (("--plot-mode",), {"action": "store", "type": "choice",
+                                    "choices": MODES + (HEATMAP,), "default": DEFAULT_MODE,
+                                    "help": "Render the plot using one of {}, default {}. The {}"
+                                    " mode renders all series in one panel".format(
+                                        ", ".join(MODES + (HEATMAP,)), DEFAULT_MODE, HEATMAP)}),
+                (("--rollup",), {"action": "store_true", "default": False,
+                                 "help": "Keep the series as rollups of many resolutions, so"
+                                 " other time ranges fetch only the datapoints not seen yet"}),
+                (("--interactive",), {"action": "store_true", "default": False,
+                                      "help": "Zoom with +/- and pan with h/l or the arrows,"
+                                      " q quits. It implies --refresh and --rollup"}),
+                (("--grid",), {"action": "store", "default": None, "metavar": "COLUMNSxROWS",
+                               "help": "Render many queries using a grid of panels, each group"+
+                               " of query args given belongs to one panel"}),
+                (("--output",), {"action": "store", "type": "choice", "choices": FORMATS,
+                                 "default": None,
+                                 "help": "Write the datapoints to the stdout using one of {}"
+                                 " instead of rendering them, each group of query args given"
+                                 " belongs to one query".format(", ".join(FORMATS))}),
             ]
 
             # Datasource Options
@@ -396,6 +767,323 @@ def build_datasource_query_type(datasource_cls):
     return QueryCommand
 
 
+def fetch_and_draw(datasource, queries, due, maxdatapoints, pipelines, scheduler, series,
+                   stale, draw, heatmap=None, cache=None, pyramids=None, viewports=None,
+                   snapshots=None):
+    """ Fetch the queries that are due and draw all of them, the series and stale
+    lists given are updated with the datapoints rendered by each query.
+
+    :param due: list of int, index of the queries due.
+    :param heatmap: :class:gramola.heatmap.Heatmap, the series of the query are
+                    binned by the heatmap instead of plotting the first one.
+    :param pyramids: list of :class:gramola.rollup.Pyramid, one for each query,
+                     used to fetch only the segments not seen yet.
+    :param viewports: list of :class:gramola.interactive.Viewport, one for each
+                      query, used instead of the time range of the queries.
+    :param snapshots: list of :class:gramola.snapshot.Snapshot, one for each query,
+                      merged with the series fetched.
+    """
+    # all queries fetched at once share the same clock read, and their
+    # time range is aligned to the step of the series.
+    now = time()
+    for idx in due:
+        if viewports:
+            query = queries[idx].with_time_range(viewports[idx].time_range(now))
+        else:
+            query = queries[idx].resolve(now=now)
+        step = datasource.step(query, maxdatapoints=maxdatapoints[idx])
+        query = query.resolve(step=step or scheduler.step(idx) or DEFAULT_STEP)
+
+        if heatmap is not None:
+            bins = heatmap.bins(query.time_range())
+            bin_series(bins, datasource, query, maxdatapoints[idx], pipelines[idx],
+                       pyramid=pyramids[idx] if pyramids else None, now=now)
+
+            # stale when none of the series got datapoints
+            stale[idx] = not bins.datapoints and bool(series[idx])
+            if not stale[idx]:
+                series[idx] = bins
+            scheduler.update(idx, [(None, bins.last_ts)] if bins.datapoints else [],
+                             step=step or bins.step, now=now)
+            continue
+
+        # the transforms run over the raw series, cached when they
+        # belong to a saved datasource.
+        if pyramids:
+            raw = fetch_rollup(datasource, query, maxdatapoints[idx], pyramids[idx], now=now)
+        elif snapshots:
+            # the snapshots keep all raw series
+            raw = fetch_series(datasource, query, maxdatapoints=maxdatapoints[idx],
+                               cache=cache, now=now)
+        else:
+            raw = stream_series(datasource, query, maxdatapoints[idx], pipelines[idx],
+                                cache=cache, now=now)
+        if snapshots:
+            raw = snapshots[idx].merge(raw, query.time_range())
+        try:
+            transformed = pipelines[idx].apply(raw)
+        except InvalidTransform, e:
+            raise InvalidParams(str(e))
+
+        datapoints = plot_datapoints(transformed, maxdatapoints[idx])
+
+        # a failed fetch keeps rendering the last good datapoints marked as
+        # stale, the scheduler backs off because nothing new arrived.
+        stale[idx] = not datapoints and bool(series[idx])
+        if not stale[idx]:
+            series[idx] = datapoints
+        scheduler.update(idx, datapoints, step=step, now=now)
+    draw(series, stale)
+
+
+def bin_series(bins, datasource, query, maxdatapoints, pipeline, pyramid=None, now=None):
+    """ Bin the series of a resolved query. The series are streamed from the
+    datasource and binned one by one, only the ones that are transformed, rolled
+    up or fetched by shards are kept in memory before binning them. The series
+    are not cached.
+
+    :param bins: :class:gramola.heatmap.Bins
+    :param pipeline: :class:gramola.transforms.Pipeline
+    :param pyramid: :class:gramola.rollup.Pyramid
+    """
+    if pipeline.chain or pyramid is not None or shard_queries(datasource, query,
+                                                              maxdatapoints=maxdatapoints):
+        if pyramid is not None:
+            raw = fetch_rollup(datasource, query, maxdatapoints, pyramid, now=now)
+        else:
+            raw = stream_series(datasource, query, maxdatapoints, pipeline, now=now)
+        try:
+            transformed = pipeline.apply(raw)
+        except InvalidTransform, e:
+            raise InvalidParams(str(e))
+        for s in transformed:
+            bins.add(izip(s.values, s.timestamps))
+        return
+
+    for _, datapoints in datasource.iter_series(query, maxdatapoints=maxdatapoints):
+        bins.add(datapoints)
+
+
+def stream_series(datasource, query, maxdatapoints, pipeline, cache=None, now=None):
+    """ Returns the raw series of a resolved query to be given to the pipeline. When
+    the pipeline streams, i.e it starts selecting the highest series, the series are
+    given as they are decoded so only the selected ones are kept in memory. Otherwise,
+    or when they are cached or fetched by shards, the list of all series is returned.
+
+    :param pipeline: :class:gramola.transforms.Pipeline
+    :param cache: :class:gramola.cache.SeriesCache
+    :rtype: iterable of :class:gramola.transforms.Series
+    """
+    if not pipeline.streams or cache is not None or shard_queries(
+            datasource, query, maxdatapoints=maxdatapoints):
+        return fetch_series(datasource, query, maxdatapoints=maxdatapoints, cache=cache, now=now)
+
+    return (Series.from_datapoints(name, datapoints) for name, datapoints in
+            datasource.iter_series(query, maxdatapoints=maxdatapoints))
+
+
+def draw_snapshots(snapshots, pipelines, maxdatapoints, series, stale, draw):
+    """ Draw the series of the snapshots marked as stale, nothing is drawn when
+    no query has a snapshot. The series and stale lists given are updated.
+
+    :param snapshots: list of :class:gramola.snapshot.Snapshot, one for each query.
+    """
+    for idx, snapshot in enumerate(snapshots):
+        if not snapshot.series:
+            continue
+
+        try:
+            transformed = pipelines[idx].apply(snapshot.series)
+        except InvalidTransform, e:
+            raise InvalidParams(str(e))
+
+        datapoints = plot_datapoints(transformed, maxdatapoints[idx])
+        if datapoints:
+            series[idx] = datapoints
+            stale[idx] = True
+
+    if any(stale):
+        draw(series, stale)
+
+
+def plot_datapoints(series, maxdatapoints):
+    """ Returns the datapoints of the first series ready to be plotted, as the
+    datasources do the last value not available is dropped and the other ones
+    are turned into 0.
+
+    :param series: list of :class:gramola.transforms.Series
+    :param maxdatapoints: int
+    :rtype: list
+    """
+    if not series:
+        return []
+    elif len(series) > 1:
+        log.warning('Multiple series found, ploting only the first one')
+
+    datapoints = series[0].datapoints()
+    if datapoints and datapoints[-1][0] is None:
+        datapoints.pop()
+
+    if maxdatapoints and len(datapoints) > maxdatapoints:
+        datapoints = datapoints[-maxdatapoints:]
+
+    return [(value or 0, ts) for value, ts in datapoints]
+
+
+def write_queries(datasource, queries, writer, refresh=False, refresh_freq=DEFAULT_INTERVAL,
+                  pipelines=None):
+    """ Write the series returned by the queries using the writer given. The
+    datapoints are streamed from the datasource to the writer, with refresh
+    only the datapoints newer than the ones already written are fetched and
+    written.
+
+    :param datasource: :class:gramola.datasources.base.DataSource
+    :param queries: list of :class:gramola.datasources.base.MetricQuery
+    :param writer: :class:gramola.output.Writer
+    :param pipelines: list of :class:gramola.transforms.Pipeline, one for each query.
+    """
+    scheduler = Scheduler(range(len(queries)), interval=refresh_freq)
+
+    # last timestamp written of each series, by (query idx, series name)
+    written = {}
+    writer.open()
+    try:
+        while True:
+            due = scheduler.wait()
+            now = time()
+            for idx in due:
+                last = [ts for (query_idx, _), ts in written.iteritems() if query_idx == idx]
+                query = queries[idx].resolve(now=now, since=min(last) if last else None)
+                step = datasource.step(query)
+                query = query.resolve(step=step or scheduler.step(idx) or DEFAULT_STEP)
+
+                # the last two datapoints of the first series feed the scheduler
+                buffers = []
+                if pipelines and pipelines[idx].chain:
+                    # transforms need the whole series, but the selectors
+                    iter_series = ((s.name, iter(s.datapoints())) for s in
+                                   pipelines[idx].apply(stream_series(datasource, query, None,
+                                                                      pipelines[idx])))
+                elif shard_queries(datasource, query):
+                    # long time ranges are fetched by shards and stitched
+                    iter_series = ((s.name, iter(s.datapoints())) for s in
+                                   fetch_series(datasource, query))
+                else:
+                    iter_series = datasource.iter_series(query)
+
+                for name, datapoints in iter_series:
+                    buffers.append(deque(maxlen=2))
+                    datapoint = writer.write(
+                        name, newer(tail(datapoints, buffers[-1]), written.get((idx, name))))
+                    if datapoint is not None:
+                        written[(idx, name)] = datapoint[1]
+
+                scheduler.update(idx, list(buffers[0]) if buffers else [], step=step, now=now)
+
+            if not refresh:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+
+
+def check_datasources(configs, timeout=DEFAULT_CHECK_TIMEOUT, max_workers=MAX_CHECK_WORKERS):
+    """ Test the datasources concurrently, waiting at most the timeout given for
+    all of them. Returns a list of tuples (config, status, latency) following the
+    order of the configs, the latency of the ones timed out is the timeout.
+
+    :param configs: list of :class:gramola.datasources.base.DataSourceConfig
+    :param timeout: float, seconds to wait for all tests.
+    :rtype: list
+    """
+    def check(config):
+        started = time()
+        try:
+            ok = DataSource.find(config.type)(config).test()
+        except Exception, e:
+            log.debug("Datasource `{}` test raised an exception: {}".format(config.name, e))
+            ok = False
+        return (CHECK_OK if ok else CHECK_FAILED, time() - started)
+
+    pending = Queue()
+    for idx, config in enumerate(configs):
+        pending.put((idx, config))
+
+    finished = {}
+    condition = threading.Condition()
+
+    def worker():
+        while True:
+            try:
+                idx, config = pending.get_nowait()
+            except Empty:
+                return
+            result = check(config)
+            with condition:
+                finished[idx] = result
+                condition.notify()
+
+    # the workers are daemon threads, the tests still running at the
+    # timeout are left behind and they do not keep the process alive.
+    for _ in range(max(1, min(max_workers, len(configs)))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    deadline = time() + timeout
+    with condition:
+        while len(finished) < len(configs) and time() < deadline:
+            condition.wait(deadline - time())
+        finished = dict(finished)
+
+    return [(config,) + finished[idx] if idx in finished else (config, CHECK_TIMEOUT, timeout)
+            for idx, config in enumerate(configs)]
+
+
+def format_checks(results):
+    """ Returns the lines of the table of the results given by `check_datasources`,
+    one row for each datasource with its name, type, status and latency.
+
+    :rtype: list of str
+    """
+    labels = {CHECK_OK: "ok", CHECK_FAILED: "FAILED", CHECK_TIMEOUT: "TIMED OUT"}
+    rows = [("NAME", "TYPE", "STATUS", "LATENCY")]
+    for config, status, latency in results:
+        rows.append((config.name, config.type, labels[status],
+                     ">{:g}s".format(latency) if status == CHECK_TIMEOUT
+                     else "{:.0f}ms".format(latency * 1000)))
+
+    widths = [max(len(row[column]) for row in rows) for column in range(3)]
+    return ["  ".join(value.ljust(width) for value, width in zip(row, widths)) + "  " + row[3]
+            for row in rows]
+
+
+def draw_live(datasource, queries, maxdatapoints, draw, refresh=False):
+    """ Draw the queries of a live datasource. With refresh the frames are drawn
+    as soon as new datapoints are received, at most MAX_FPS frames per second,
+    otherwise the stream is consumed until it is closed and drawn once.
+
+    :param datasource: :class:gramola.datasources.base.DataSource
+    :param queries: list of :class:gramola.datasources.base.MetricQuery
+    :param maxdatapoints: list of int, one for each query.
+    :param draw: callable that gets the list of datapoints of all queries and
+                 the list of the stale flags.
+    """
+    for query, query_maxdatapoints in zip(queries, maxdatapoints):
+        datasource.subscribe(query, maxdatapoints=query_maxdatapoints)
+
+    opened = True
+    while opened:
+        try:
+            opened = datasource.poll(timeout=1.0 / MAX_FPS if refresh else None)
+        except KeyboardInterrupt:
+            opened = False
+
+        if refresh or not opened:
+            draw([datasource.datapoints(query) for query in queries], [False] * len(queries))
+
+
 def gramola():
     """ Entry point called from binary generated by setuptools. Beyond
     the main command Gramola immplements a sub set of commands that each one
@@ -450,3 +1138,18 @@ def gramola():
         print("Invalid params for {} command, error: {}".format(subcommand.name, e.error_params))
         print("Get help with gramola {} --help".format(subcommand.name))
         sys.exit(1)
+    finally:
+        report_rate_limits()
+
+
+def report_rate_limits():
+    """ Report the calls done by the rate limited APIs and the time that they were
+    queued, when no call has been queued the report is only logged as debug.
+    """
+    for key, calls, waited in ratelimit_report():
+        line = "API calls of {}: {}, queued {:.2f}s".format(
+            "/".join(str(k or "default") for k in key), calls, waited)
+        if waited > 0:
+            log.info(line)
+        else:
+            log.debug(line)
@@ -4,8 +4,14 @@
 """
 from gramola.datasources.graphite import GraphiteDataSource
 from gramola.datasources.cloudwatch import CWDataSource
+from gramola.datasources.stdin import StdinDataSource
+from gramola.datasources.carbon import CarbonDataSource
+from gramola.datasources.whisper import WhisperDataSource
 
 IMPLEMENTATIONS = [
     GraphiteDataSource,
-    CWDataSource
+    CWDataSource,
+    StdinDataSource,
+    CarbonDataSource,
+    WhisperDataSource
 ]
@@ -8,10 +8,14 @@ specific configurations.
 :moduleauthor: Pau Freixes, pfreixes@gmail.com
 """
 
+from datetime import datetime
+
 from gramola.utils import (
     InvalidGramolaDictionary,
     GramolaDictionary,
-    parse_date
+    TimeRange,
+    parse_date,
+    to_timestamp
 )
 
 
@@ -23,6 +27,13 @@ class InvalidDataSourceConfig(InvalidGramolaDictionary):
     pass
 
 
+class DataSourceError(Exception):
+    """ Raised when the backend of a data source fails to answer a request
+    and the caller has to know it, i.e to report it as a part of a batch.
+    """
+    pass
+
+
 class OptionalKey(object):
     """ OptionalKey type is used by :class:DataSourceConfig and :class:MetricsQuery
     to store the OPTIONAL_KEYS and helps the gramola commands to build the properly
@@ -50,7 +61,8 @@ class OptionalKey(object):
 
     @property
     def hyphen_name(self):
-        return "--{}".format(self.name)
+        """ Name of the command line option, the underscores become dashes """
+        return "--{}".format(self.name.replace("_", "-"))
 
 
 class DataSourceConfig(GramolaDictionary):
@@ -96,14 +108,19 @@ class MetricQuery(GramolaDictionary):
     MetricQuery class configuring the required keys using the
     REQUIRED_KEYS and the optional keys uing OPTIONAL_KEYS.
 
-    MetricQuery implements the following keys : since, until.
+    MetricQuery implements the following keys : since, until, transform.
     """
     REQUIRED_KEYS = ()
 
-    # All Queries use the since, and until optional parameters.
+    # frozen time range of a resolved query
+    __slots__ = ('_time_range',)
+
+    # All Queries use the since, until and transform optional parameters.
     OPTIONAL_KEYS = (
         OptionalKey('since', 'Get values from, default -1h'),
-        OptionalKey('until', 'Get values until, default now')
+        OptionalKey('until', 'Get values until, default now'),
+        OptionalKey('transform', 'Apply a chain of transforms to the series, i.e' +
+                                 ' "sumSeries|movingAverage(5)"')
     )
 
     def __init__(self, *args, **kwargs):
@@ -115,17 +132,72 @@ class MetricQuery(GramolaDictionary):
         except InvalidGramolaDictionary, e:
             raise InvalidMetricQuery(e.errors)
 
+        self._time_range = None
+
+    def label(self):
+        """ Returns a human readable name of the query built with the values of
+        the required keys.
+        :return: str
+        """
+        return " ".join(str(getattr(self, str(k))) for k in self.required_keys())
+
+    def time_range(self, now=None):
+        """ Returns the time window of the query. A resolved query returns always
+        the same time range, otherwise the since and until values are parsed using
+        the same clock read.
+
+        :param now: float, epoch seconds used as the current time.
+        :return: TimeRange
+        """
+        if self._time_range is not None:
+            return self._time_range
+
+        now = datetime.fromtimestamp(now) if now else datetime.now()
+        return TimeRange(to_timestamp(parse_date(self.since or '-1h', now=now)),
+                         to_timestamp(parse_date(self.until or 'now', now=now)))
+
+    def resolve(self, now=None, step=None, since=None):
+        """ Returns a copy of the query with its time range frozen, optionally
+        aligned to the step given. All datasources, caches and schedulers have
+        to use the time range of a resolved query.
+
+        :param now: float, epoch seconds used as the current time.
+        :param step: int, seconds used to align the time range.
+        :param since: int, epoch seconds used as the beginning of the time range
+                      when it is later than the one of the query, used to fetch
+                      only the last datapoints.
+        :return: MetricQuery
+        """
+        time_range = self.time_range(now=now)
+        if since and since > time_range.since:
+            time_range = TimeRange(min(since, time_range.until), time_range.until)
+        if step:
+            time_range = time_range.align(step)
+
+        return self.with_time_range(time_range)
+
+    def with_time_range(self, time_range):
+        """ Returns a copy of the query resolved using the time range given,
+        i.e one shard of a long time range.
+
+        :param time_range: :class:gramola.utils.TimeRange
+        :return: MetricQuery
+        """
+        query = self.__class__(**self.dict())
+        query._time_range = time_range
+        return query
+
     def get_since(self):
         """ Returns the date time used to collect data from
         :return: datetime
         """
-        return parse_date(self.since or '-1h')
+        return self.time_range().datetimes()[0]
 
     def get_until(self):
         """ Returns the date time used to collect data until
         :return: datetime
         """
-        return parse_date(self.until or 'now')
+        return self.time_range().datetimes()[1]
 
 
 class DataSource(object):
@@ -145,6 +217,15 @@ class DataSource(object):
     # of the DataSource.
     TYPE = None
 
+    # Live data sources are fed continuously, their datapoints are pushed
+    # by someone else instead of being fetched. They have to implement the
+    # `subscribe` and `poll` methods.
+    LIVE = False
+
+    # Data sources that read the datapoints from the stdin, the query
+    # commands do not read their configuration from there.
+    CONSUMES_STDIN = False
+
     @classmethod
     def find(cls, type_):
         """Returns the DataSource implementation for a specific type_."""
@@ -168,6 +249,16 @@ class DataSource(object):
         :type configuration: `DataSourceConfig` or a derivated one
         """
         self.configuration = configuration
+        self.store = None
+
+    def use_store(self, store):
+        """ Called by the commands when the datasource has been saved in a
+        :class:gramola.store.Store, data sources can use its directories to keep
+        state shared by all Gramola processes.
+
+        :param store: :class:gramola.store.Store
+        """
+        self.store = store
 
     @classmethod
     def from_config(cls, **config_params):
@@ -191,6 +282,107 @@ class DataSource(object):
         """
         raise NotImplemented()
 
+    def iter_series(self, query, maxdatapoints=None):
+        """ Returns a generator of all series returned by the query, each one as
+        a tuple (name, datapoints) where datapoints is an iterable of tuples
+        (val, ts). Used by the output modes to stream the datapoints as they
+        are decoded, values not available are given as None.
+
+        By default the datapoints of the `datapoints` method are returned as one
+        series named as the query, data sources that can decode the response
+        incrementally or return many series should override it.
+
+        :param query: Query
+        :type query: `MetricQuery` or a derivated one
+        :param maxdatapoints: Restrict the result with a certain amount of datapoints, default All
+        """
+        yield query.label(), iter(self.datapoints(query, maxdatapoints=maxdatapoints) or [])
+
+    def step(self, query, maxdatapoints=None):
+        """ Returns the seconds between two consecutive datapoints returned
+        by the `datapoints` method using the same params, if the data source
+        knows it in advance. Otherwise None is returned and the step is
+        learnt from the datapoints.
+
+        :param query: Query
+        :type query: `MetricQuery` or a derivated one
+        :param maxdatapoints: Restrict the result with a certain amount of datapoints, default All
+        :rtype: int or None
+        """
+        return None
+
+    def max_seconds_per_request(self, query, maxdatapoints=None):
+        """ Returns the longest time range, in seconds, that one request to the
+        backend can fetch using the same params. Longer time ranges are split into
+        shards fetched concurrently, see :mod:gramola.shards. By default None is
+        returned, the data source does not have any limit.
+
+        :param query: Query
+        :type query: `MetricQuery` or a derivated one
+        :param maxdatapoints: Restrict the result with a certain amount of datapoints, default All
+        :rtype: int or None
+        """
+        return None
+
+    def push_down(self, query, transform, args):
+        """ Returns a copy of the query that applies the transform given in the
+        backend, or None if the data source can not apply it. Data sources whose
+        backend can, for example, select the series with the highest values should
+        override it, see :mod:gramola.transforms. By default None is returned.
+
+        :param query: Query
+        :type query: `MetricQuery` or a derivated one
+        :param transform: str, name of the transform, i.e `highestCurrent`.
+        :param args: list of float, arguments of the transform.
+        :rtype: `MetricQuery` or None
+        """
+        return None
+
+    def batches(self, queries):
+        """ Split the resolved queries into batches, each batch is fetched with
+        one call to `fetch_batch`. Data sources that can fetch many queries using
+        one request to the backend should override it, by default each query is
+        fetched alone.
+
+        :param queries: list of `MetricQuery` or a derivated one
+        :rtype: list of lists of queries
+        """
+        return [[query] for query in queries]
+
+    def fetch_batch(self, queries, maxdatapoints=None):
+        """ Returns for each query of a batch, see `batches`, the list of its series
+        as tuples (name, datapoints) where datapoints is a list of tuples (val, ts).
+
+        :param queries: list of `MetricQuery` or a derivated one
+        :param maxdatapoints: Restrict the result with a certain amount of datapoints, default All
+        :raises DataSourceError: If the backend failed, all queries of the batch failed.
+        :rtype: list
+        """
+        return [[(name, list(datapoints)) for name, datapoints in
+                 self.iter_series(query, maxdatapoints=maxdatapoints)]
+                for query in queries]
+
+    def subscribe(self, query, maxdatapoints=None):
+        """ Live data sources only. Register a query whose datapoints have to be
+        kept, afterwards the `datapoints` method returns the last `maxdatapoints`
+        received for this query.
+
+        :param query: Query
+        :type query: `MetricQuery` or a derivated one
+        :param maxdatapoints: Maxium number of datapoints kept for the query.
+        """
+        raise NotImplemented()
+
+    def poll(self, timeout=None):
+        """ Live data sources only. Wait for new datapoints and consume all of them
+        received until the timeout, or until the stream is closed if the timeout is
+        None. Returns False once the stream has been closed.
+
+        :param timeout: float, seconds.
+        :rtype: boolean
+        """
+        raise NotImplemented()
+
     def test(self):
         """ This function is used to test a data source configuration.
 
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the carbon listener data source, a live data source that speaks the
+protocols used by the Graphite emitters to send datapoints to carbon [1]. Point
+the emitter of a service to the port opened by Gramola and the paths queried are
+plotted as the datapoints arrive, without waiting for carbon to persist them.
+
+The following protocols are supported:
+
+    plaintext : `path value timestamp` lines, by TCP or UDP, default port 2003.
+    pickle    : pickled lists of (path, (timestamp, value)), by TCP, default port 2004.
+
+The datapoints of the paths queried are kept using a ring buffer for each path,
+the ones of the other paths are dropped just after being parsed. The listener
+is never closed by the emitters, without the refresh mode the datapoints
+received during the first `DEFAULT_WINDOW` seconds are drawn once.
+
+[1] https://graphite.readthedocs.org/en/latest/feeding-carbon.html
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import errno
+import select
+import socket
+import struct
+import cPickle
+
+from time import time
+from cStringIO import StringIO
+
+from gramola import log
+from gramola.utils import RingBuffer
+from gramola.datasources.base import (
+    OptionalKey,
+    DataSource,
+    MetricQuery,
+    DataSourceConfig,
+    InvalidDataSourceConfig
+)
+
+DEFAULT_BIND = "127.0.0.1"
+DEFAULT_PORT = 2003
+DEFAULT_PICKLE_PORT = 2004
+
+# seconds listened when the poll is not given a timeout
+DEFAULT_WINDOW = 10
+
+# bytes read from each socket at once
+READ_SIZE = 64 * 1024
+
+# datapoints kept when the query does not give the maxdatapoints
+DEFAULT_MAXDATAPOINTS = 1024
+
+# the pickle messages are prefixed by their length as an unsigned int
+_PICKLE_HEADER = struct.Struct("!L")
+
+# refuse messages bigger than this one, as carbon does
+MAX_PICKLE_SIZE = 1024 * 1024
+
+
+def unpickle(buffer_):
+    """ Unpickle a message of the pickle protocol without allowing to load any
+    global, such as classes or functions, messages are just lists of tuples.
+
+    :param buffer_: str
+    :raises: cPickle.UnpicklingError
+    """
+    unpickler = cPickle.Unpickler(StringIO(buffer_))
+    unpickler.find_global = None
+    return unpickler.load()
+
+
+class CarbonDataSourceConfig(DataSourceConfig):
+    REQUIRED_KEYS = ()
+    OPTIONAL_KEYS = (
+        OptionalKey('bind', 'Listen at this address, default {}'.format(DEFAULT_BIND)),
+        OptionalKey('port', 'Listen the plaintext protocol using TCP and UDP at this port,'
+                            ' default {}'.format(DEFAULT_PORT)),
+        OptionalKey('pickle_port', 'Listen the pickle protocol at this port,'
+                                   ' default {}'.format(DEFAULT_PICKLE_PORT))
+    )
+
+
+class CarbonMetricQuery(MetricQuery):
+    REQUIRED_KEYS = ('path',)
+    OPTIONAL_KEYS = ()
+
+
+class Connection(object):
+    """ TCP connection accepted by the listener, it keeps the bytes received
+    that do not make up a whole line or message yet.
+    """
+    def __init__(self, sock, pickle=False):
+        self.sock = sock
+        self.pickle = pickle
+        self.pending = ""
+
+
+class CarbonDataSource(DataSource):
+    DATA_SOURCE_CONFIGURATION_CLS = CarbonDataSourceConfig
+    METRIC_QUERY_CLS = CarbonMetricQuery
+    TYPE = 'carbon-listen'
+    LIVE = True
+
+    def __init__(self, configuration):
+        super(CarbonDataSource, self).__init__(configuration)
+
+        # path -> RingBuffer, only the subscribed paths
+        self._buffers = {}
+
+        # sockets listening and connections accepted
+        self._listeners = None
+        self._udp = None
+        self._connections = {}
+
+    def _ports(self):
+        try:
+            return (int(self.configuration.port or DEFAULT_PORT),
+                    int(self.configuration.pickle_port or DEFAULT_PICKLE_PORT))
+        except ValueError:
+            raise InvalidDataSourceConfig({'port': 'Invalid port'})
+
+    def _listen(self):
+        if self._listeners is not None:
+            return self._listeners
+
+        bind = self.configuration.bind or DEFAULT_BIND
+        port, pickle_port = self._ports()
+
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        pickle = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        for sock, sock_port in ((tcp, port), (udp, port), (pickle, pickle_port)):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((bind, sock_port))
+            sock.setblocking(0)
+
+        tcp.listen(socket.SOMAXCONN)
+        pickle.listen(socket.SOMAXCONN)
+        log.debug("Listening carbon protocols at {} ports {} and {}".format(
+            bind, port, pickle_port))
+
+        self._listeners = {tcp: False, pickle: True}
+        self._udp = udp
+        return self._listeners
+
+    def subscribe(self, query, maxdatapoints=None):
+        if query.path not in self._buffers:
+            self._buffers[query.path] = RingBuffer(maxdatapoints or DEFAULT_MAXDATAPOINTS)
+
+    def poll(self, timeout=None):
+        """ Consume the datapoints received until the timeout. Without timeout
+        the ones received during `DEFAULT_WINDOW` seconds are consumed and the
+        stream is reported as closed, the emitters never close it.
+        """
+        listeners = self._listen()
+        window = timeout is None
+        deadline = time() + (DEFAULT_WINDOW if window else timeout)
+
+        wait = deadline - time()
+        while True:
+            sockets = listeners.keys() + [self._udp] + self._connections.keys()
+            readable, _, _ = select.select(sockets, [], [], wait)
+            for sock in readable:
+                if sock in listeners:
+                    self._accept(sock, listeners[sock])
+                elif sock is self._udp:
+                    self._consume_lines(sock.recv(READ_SIZE) + "\n")
+                else:
+                    self._read(self._connections[sock])
+
+            wait = deadline - time()
+            if wait <= 0:
+                return not window
+
+    def _accept(self, listener, pickle):
+        try:
+            sock, _ = listener.accept()
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+
+        sock.setblocking(0)
+        self._connections[sock] = Connection(sock, pickle=pickle)
+
+    def _read(self, connection):
+        try:
+            chunk = connection.sock.recv(READ_SIZE)
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            chunk = ""
+
+        if not chunk:
+            del self._connections[connection.sock]
+            connection.sock.close()
+            return
+
+        buffer_ = connection.pending + chunk
+        if connection.pickle:
+            connection.pending = self._consume_messages(buffer_)
+        else:
+            end = buffer_.rfind("\n") + 1
+            connection.pending = buffer_[end:]
+            self._consume_lines(buffer_[:end])
+
+        if connection.pending is None:
+            # invalid message, the connection can not be synchronized anymore
+            log.warning("Invalid pickle message, closing the connection")
+            del self._connections[connection.sock]
+            connection.sock.close()
+
+    def _consume_lines(self, buffer_):
+        buffers = self._buffers
+
+        # most of the datapoints belong to paths not subscribed, the chunks
+        # that do not have any subscribed path are dropped without parsing them.
+        if not any(path in buffer_ for path in buffers):
+            return
+
+        for line in buffer_.split("\n"):
+            try:
+                path, value, ts = line.split()
+            except ValueError:
+                continue
+
+            ring = buffers.get(path)
+            if ring is None:
+                continue
+
+            try:
+                ring.append(float(value), float(ts))
+            except ValueError:
+                continue
+
+    def _consume_messages(self, buffer_):
+        # returns the bytes of the last message not received yet,
+        # or None if a message can not be decoded.
+        buffers = self._buffers
+        offset = 0
+        while len(buffer_) - offset >= _PICKLE_HEADER.size:
+            size, = _PICKLE_HEADER.unpack_from(buffer_, offset)
+            if size > MAX_PICKLE_SIZE:
+                return None
+
+            start = offset + _PICKLE_HEADER.size
+            if len(buffer_) < start + size:
+                break
+
+            try:
+                datapoints = unpickle(buffer_[start:start + size])
+            except Exception:
+                return None
+
+            for datapoint in datapoints:
+                try:
+                    path, (ts, value) = datapoint
+                    ring = buffers.get(path)
+                    if ring is not None:
+                        ring.append(float(value), float(ts))
+                except (TypeError, ValueError):
+                    continue
+
+            offset = start + size
+
+        return buffer_[offset:]
+
+    def datapoints(self, query, maxdatapoints=None):
+        ring = self._buffers.get(query.path)
+        if ring is None:
+            log.warning("Path `{}` has not been subscribed".format(query.path))
+            return []
+        return ring.datapoints()
+
+    def test(self):
+        # test that the ports can be listened
+        try:
+            self._listen()
+        except (socket.error, InvalidDataSourceConfig), e:
+            log.error("Carbon ports can not be listened: {}".format(e))
+            return False
+
+        self.close()
+        return True
+
+    def close(self):
+        """ Close all sockets opened """
+        for sock in (self._listeners or {}).keys() + self._connections.keys():
+            sock.close()
+        if self._udp is not None:
+            self._udp.close()
+        self._listeners = None
+        self._udp = None
+        self._connections = {}
@@ -2,18 +2,33 @@
 """
 Implements the CloudWatch [1] data source.
 
+CloudWatch throttles and bills the API calls by account and region, all calls
+are sent through a rate limiter shared by the pair (profile, region), and by
+all Gramola processes when the datasource has been saved. Calls throttled are
+retried after decreasing the rate, see :mod:gramola.ratelimit.
+
+The region and the profile of a query can be lists or globs, i.e `eu-*,us-east-1`,
+the metric is fetched from all of them concurrently, using one client for each
+pair (profile, region), and one series is returned for each one.
+
 [1] https://aws.amazon.com/cloudwatch/
 :moduleauthor: Pau Freixes, pfreixes@gmail.com
 """
-import time
 import boto3
 import botocore
+import botocore.session
+import calendar
+import threading
+
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
 
+from time import time, sleep
 from functools import wraps
-from itertools import count
-from itertools import dropwhile
 
 from gramola import log
+from gramola.breaker import backoff
+from gramola.ratelimit import RateLimiter, DEFAULT_RATE, RATELIMIT_DIRNAME
 
 from gramola.datasources.base import (
     OptionalKey,
@@ -24,6 +39,84 @@ from gramola.datasources.base import (
 )
 
 
+# times that a throttled call is retried
+MAX_THROTTLED_RETRIES = 3
+
+# maxium datapoints returned by one call of get_metric_statistics
+MAX_DATAPOINTS_PER_CALL = 1440
+
+# periods below one minute allowed for the high-resolution metrics
+HIGH_RESOLUTION_PERIODS = (1, 5, 10, 30)
+
+# CloudWatch keeps the datapoints of each period during a time, the tuples
+# (age in seconds, minimum period) give the minimum period available for the
+# datapoints older than each age.
+RETENTIONS = (
+    (3 * 60 * 60, 60),              # high resolution, 3 hours
+    (15 * 24 * 60 * 60, 300),       # 1 minute, 15 days
+    (63 * 24 * 60 * 60, 3600),      # 5 minutes, 63 days
+)
+
+
+# regions used to expand the region globs
+REGIONS = (
+    'us-east-1', 'us-west-1', 'us-west-2', 'eu-west-1', 'eu-central-1', 'ap-northeast-1',
+    'ap-northeast-2', 'ap-southeast-1', 'ap-southeast-2', 'sa-east-1'
+)
+
+# pairs (profile, region) fetched at once
+MAX_WORKERS = 8
+
+
+def expand(value, available):
+    """ Returns the list of values given as a comma separated list, where each
+    item can be a glob matched against the available values. None is returned
+    as [None], to use the default one.
+
+    :param value: str, i.e `eu-*,us-east-1`
+    :param available: list of str
+    :rtype: list
+    """
+    if not value:
+        return [None]
+
+    values = []
+    for item in value.split(","):
+        item = item.strip()
+        if any(c in item for c in "*?["):
+            matched = [v for v in available if fnmatch(v, item)]
+        else:
+            matched = [item] if item else []
+        values.extend(v for v in matched if v not in values)
+    return values
+
+
+def find_period(seconds, age, maxdatapoints=None, resolution=60):
+    """ Returns the shortest period available that gets at most maxdatapoints
+    for a time range of the seconds given. The period is a multiple of the minimum
+    period kept by CloudWatch for the datapoints of that age, and one of the high
+    resolution periods only for the high resolution metrics.
+
+    :param seconds: int, length of the time range.
+    :param age: int, seconds since the beginning of the time range.
+    :param maxdatapoints: int
+    :param resolution: int, storage resolution of the metric, 1 or 60.
+    :rtype: int
+    """
+    minimum = resolution if resolution < 60 else 60
+    for retention_age, retention_period in RETENTIONS:
+        if age > retention_age:
+            minimum = max(minimum, retention_period)
+
+    wanted = max(minimum, -(-seconds // maxdatapoints) if maxdatapoints else minimum)
+    if wanted < 60:
+        return next(p for p in HIGH_RESOLUTION_PERIODS + (60,) if p >= wanted)
+
+    # periods of one minute or longer are multiples of the minimum one
+    multiple = max(60, minimum)
+    return -(-wanted // multiple) * multiple
+
+
 class Boto3ClientError(Exception):
     # Global class used to trigger all Exceptions related
     # with the Boto3 client.
@@ -49,7 +142,9 @@ class CWDataSourceConfig(DataSourceConfig):
     OPTIONAL_KEYS = (
         OptionalKey('region', 'Use this region as the default one insted of the' +
                               ' region defined by the profile'),
-        OptionalKey('profile', 'Use an alternative profile than the default one')
+        OptionalKey('profile', 'Use an alternative profile than the default one'),
+        OptionalKey('rate', 'Maxium calls per second to the API shared by all queries' +
+                            ' of the same profile and region, default {}'.format(DEFAULT_RATE))
     )
 
 
@@ -57,9 +152,14 @@ class CWMetricQuery(MetricQuery):
     REQUIRED_KEYS = ('namespace', 'metricname', 'dimension_name', 'dimension_value')
     OPTIONAL_KEYS = (
         OptionalKey('region', 'Use this region overriding the region configured by the ' +
-                              ' datasource or profile'),
+                              ' datasource or profile, a list or globs fetch many regions' +
+                              ' at once, i.e "eu-*,us-east-1"'),
+        OptionalKey('profile', 'Use this profile overriding the one configured by the' +
+                               ' datasource, a list or globs fetch many profiles at once'),
         OptionalKey('statistics', 'Override the default Average by Sum, SampleCount, '
-                                  'Maximum or Minimum')
+                                  'Maximum or Minimum'),
+        OptionalKey('resolution', 'Storage resolution of the metric in seconds, 1 for the high'
+                                  ' resolution custom metrics, default 60')
     )
 
 
@@ -68,17 +168,117 @@ class CWDataSource(DataSource):
     METRIC_QUERY_CLS = CWMetricQuery
     TYPE = 'cw'
 
+    def __init__(self, configuration):
+        super(CWDataSource, self).__init__(configuration)
+
+        # (profile, region) -> client, built once and shared by the threads
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
     @_cw_safe_call
-    def _cw_client(self, region=None):
-        return boto3.session.Session(
-            region_name=region or self.configuration.region,
-            profile_name=self.configuration.profile).client('cloudwatch')
+    def _cw_client(self, region=None, profile=None):
+        key = (profile or self.configuration.profile, region or self.configuration.region)
+        with self._clients_lock:
+            if key not in self._clients:
+                self._clients[key] = boto3.session.Session(
+                    region_name=key[1], profile_name=key[0]).client('cloudwatch')
+            return self._clients[key]
+
+    def _targets(self, query):
+        # returns the list of pairs (profile, region) of the query
+        profiles = expand(query.profile or self.configuration.profile,
+                          botocore.session.get_session().available_profiles)
+        regions = expand(query.region or self.configuration.region, REGIONS)
+        return [(profile, region) for profile in profiles for region in regions]
+
+    def _limiter(self, client, profile=None):
+        try:
+            rate = float(self.configuration.rate or DEFAULT_RATE)
+        except ValueError:
+            rate = DEFAULT_RATE
+
+        directory = self.store.directory(RATELIMIT_DIRNAME) if self.store else None
+        return RateLimiter.shared((profile or self.configuration.profile,
+                                   client.meta.region_name),
+                                  rate=rate, directory=directory)
 
     @_cw_safe_call
-    def _cw_call(self, client, f, *args, **kwargs):
-        return getattr(client, f)(*args, **kwargs)
+    def _cw_call(self, client, f, profile=None, **kwargs):
+        # the profile of the client picks its limiter, the region is the client one
+        limiter = self._limiter(client, profile=profile)
+        for attempt in range(MAX_THROTTLED_RETRIES + 1):
+            waited = limiter.acquire()
+            if waited > 0:
+                log.debug("CloudWatch call {} queued {:.2f}s".format(f, waited))
+
+            try:
+                response = getattr(client, f)(**kwargs)
+            except botocore.exceptions.ClientError, e:
+                if e.response.get('Error', {}).get('Code') != 'Throttling' or\
+                        attempt == MAX_THROTTLED_RETRIES:
+                    raise
+                limiter.throttled()
+                sleep(backoff(attempt, base=0.5, cap=5.0))
+                continue
+
+            limiter.succeeded()
+            return response
+
+    def step(self, query, maxdatapoints=None):
+        return self._period(query, maxdatapoints)
+
+    def max_seconds_per_request(self, query, maxdatapoints=None):
+        return self._period(query, maxdatapoints) * MAX_DATAPOINTS_PER_CALL
+
+    def _period(self, query, maxdatapoints):
+        try:
+            resolution = int(query.resolution or 60)
+        except ValueError:
+            raise InvalidMetricQuery("Query resolution invalid value `{}`".format(query.resolution))
+
+        time_range = query.time_range()
+        return find_period(time_range.seconds, max(0, int(time()) - time_range.since),
+                           maxdatapoints=maxdatapoints, resolution=resolution)
 
     def datapoints(self, query, maxdatapoints=None):
+        targets = self._targets(query)
+        if len(targets) > 1:
+            log.warning('Multiple regions or profiles found, geting only the first one')
+        elif not targets:
+            log.warning('Any region or profile matches the query')
+            return []
+
+        profile, region = targets[0]
+        return self._datapoints(query, maxdatapoints, profile=profile, region=region)
+
+    def iter_series(self, query, maxdatapoints=None):
+        # each pair (profile, region) is fetched concurrently and returned as
+        # one series labeled with the profile and the region.
+        targets = self._targets(query)
+        if len(targets) == 1:
+            profile, region = targets[0]
+            yield query.label(), iter(self._datapoints(query, maxdatapoints, profile=profile,
+                                                       region=region))
+            return
+
+        def fetch(target):
+            try:
+                return self._datapoints(query, maxdatapoints, profile=target[0],
+                                        region=target[1])
+            except Boto3ClientError, e:
+                log.warning("Region {} of profile {} failed: {}".format(
+                    target[1] or "default", target[0] or "default", e))
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(targets)))) as executor:
+            results = list(executor.map(fetch, targets))
+
+        for (profile, region), datapoints in zip(targets, results):
+            if datapoints is not None:
+                yield "{} {}/{}".format(query.label(), profile or "default",
+                                        region or "default"), iter(datapoints)
+
+    def _datapoints(self, query, maxdatapoints, profile=None, region=None):
         if query.statistics and (query.statistics not in ['Average', 'Sum', 'SampleCount',
                                                           'Maximum', 'Minimum']):
             raise InvalidMetricQuery("Query statistic invalid value `{}`".format(query.statistics))
@@ -87,25 +287,19 @@ class CWDataSource(DataSource):
         else:
             statistics = "Average"
 
-        if maxdatapoints:
-            # Calculate the Period where the number of datapoints
-            # returned are less than maxdatapoints.
+        # The period and the request use the same time range
+        time_range = query.time_range()
+        period = self._period(query, maxdatapoints)
 
-            # Get the first granularity that suits for return the maxdatapoints
-            seconds = (query.get_until() - query.get_since()).total_seconds()
-            period = next(dropwhile(lambda g: seconds / g > maxdatapoints, count(60, 60)))
-        else:
-            period = 60
-
-        # get a client using the region given by the query, or if it
-        # is None using the one given by the datasource or the profile
-        client = self._cw_client(region=query.region)
+        # get a client using the region and profile given, or if they are
+        # None using the ones given by the datasource or the profile
+        client = self._cw_client(region=region, profile=profile)
 
         kwargs = {
             'Namespace': query.namespace,
             'MetricName': query.metricname,
-            'StartTime': query.get_since(),
-            'EndTime': query.get_until(),
+            'StartTime': time_range.since,
+            'EndTime': time_range.until,
             'Period': period,
             'Dimensions': [{
                 'Name': query.dimension_name,
@@ -114,9 +308,32 @@ class CWDataSource(DataSource):
             'Statistics': [statistics]
         }
 
-        datapoints = self._cw_call(client, "get_metric_statistics", **kwargs)
-        return [(point[statistics], time.mktime(point['Timestamp'].timetuple()))
-                for point in datapoints['Datapoints']]
+        datapoints = self._cw_call(client, "get_metric_statistics", profile=profile, **kwargs)
+        # CloudWatch does not return the datapoints sorted
+        return sorted([(point[statistics], calendar.timegm(point['Timestamp'].utctimetuple()))
+                       for point in datapoints['Datapoints']], key=lambda point: point[1])
+
+    def list_metrics(self, namespace=None, region=None):
+        """ Returns a generator of all metrics available, following all pages
+        returned by CloudWatch. Each metric is a dictionary with the `Namespace`,
+        `MetricName` and `Dimensions` keys.
+
+        :param namespace: str, list only the metrics of this namespace.
+        :param region: str, use this region instead of the default one.
+        """
+        client = self._cw_client(region=region)
+        kwargs = {}
+        if namespace:
+            kwargs['Namespace'] = namespace
+
+        while True:
+            response = self._cw_call(client, "list_metrics", **kwargs)
+            for metric in response['Metrics']:
+                yield metric
+
+            if not response.get('NextToken'):
+                break
+            kwargs['NextToken'] = response['NextToken']
 
     def test(self):
         # Just test creating the boto client and trying to get the list of
@@ -2,27 +2,64 @@
 """
 Implements the Grahpite [1] data source.
 
+Each request has a deadline, by default 10 seconds, and the ones that fail
+because of the network or a 5XX error are retried a bounded number of times. After
+many consecutive failures the circuit breaker of the datasource skips the requests
+until a probe succeeds, see :mod:gramola.breaker.
+
 [1] https://graphite.readthedocs.org/en/latest/
 :moduleauthor: Pau Freixes, pfreixes@gmail.com
 """
+import re
 import requests
 
+from time import time, sleep
+
 from gramola import log
+from gramola.breaker import CircuitBreaker, backoff
 from requests.exceptions import RequestException
 
 from gramola.datasources.base import (
     OptionalKey,
     DataSource,
+    DataSourceError,
     MetricQuery,
     DataSourceConfig
 )
 
-DATE_FORMAT = "%H:%M_%y%m%d"
+
+# seconds that a request, including its retries, can last
+DEFAULT_TIMEOUT = 10
+
+# times that a failed request is retried
+DEFAULT_RETRIES = 2
+
+# longest time range fetched by one request when the datapoints are not
+# consolidated by Graphite, longer ones are split into shards.
+MAX_SECONDS_PER_REQUEST = 24 * 60 * 60
+
+# targets fetched by one request of a batch
+MAX_TARGETS_PER_REQUEST = 20
+
+# targets with wildcards or functions return series with other names
+_PATTERN = re.compile(r"[*?\[\]{}(),]")
+
+# transforms applied by Graphite when they are pushed down
+PUSH_DOWN_TRANSFORMS = ('highestCurrent', 'highestMax', 'highestAverage',
+                        'lowestCurrent', 'lowestAverage')
+
+# the series selected by these functions depend on the whole time range
+_SELECTOR = re.compile(r"^\s*(highest|lowest)\w*\(")
 
 
 class GraphiteDataSourceConfig(DataSourceConfig):
     REQUIRED_KEYS = ('url',)
-    OPTIONAL_KEYS = ()
+    OPTIONAL_KEYS = (
+        OptionalKey('timeout', 'Seconds that a request can last, default {}'.format(
+            DEFAULT_TIMEOUT)),
+        OptionalKey('retries', 'Times that a failed request is retried, default {}'.format(
+            DEFAULT_RETRIES))
+    )
 
 
 class GraphiteMetricQuery(MetricQuery):
@@ -35,19 +72,64 @@ class GraphiteDataSource(DataSource):
     METRIC_QUERY_CLS = GraphiteMetricQuery
     TYPE = 'graphite'
 
-    def _safe_request(self, url, params):
+    def __init__(self, configuration):
+        super(GraphiteDataSource, self).__init__(configuration)
+        self.breaker = CircuitBreaker()
+
+    def _url(self, endpoint):
+        if self.configuration.url[-1] != '/':
+            return self.configuration.url + '/' + endpoint
+        else:
+            return self.configuration.url + endpoint
+
+    def _timeout(self):
         try:
-            response = requests.get(url, params=params)
-        except RequestException, e:
-            log.warning("Something was wrong with Graphite service")
-            log.debug(e)
-            return None
+            return float(self.configuration.timeout or DEFAULT_TIMEOUT)
+        except ValueError:
+            return DEFAULT_TIMEOUT
 
-        if response.status_code != 200:
-            log.warning("Get an invalid {} HTTP code from Grahpite".format(response.status_code))
+    def _retries(self):
+        try:
+            return int(self.configuration.retries or DEFAULT_RETRIES)
+        except ValueError:
+            return DEFAULT_RETRIES
+
+    def _safe_request(self, url, params, stream=False):
+        if not self.breaker.allow():
+            log.warning("Grahpite is failing, request skipped until the next probe")
             return None
 
-        return response.json()
+        # streamed responses are read by the caller while they arrive
+        kwargs = {'stream': True} if stream else {}
+        deadline = time() + self._timeout()
+        retries = self._retries()
+        for attempt in range(retries + 1):
+            try:
+                response = requests.get(url, params=params, timeout=max(0.1, deadline - time()),
+                                        **kwargs)
+            except RequestException, e:
+                log.warning("Something was wrong with Graphite service")
+                log.debug(e)
+            else:
+                if response.status_code == 200:
+                    self.breaker.success()
+                    return response if stream else response.json()
+
+                log.warning("Get an invalid {} HTTP code from Grahpite".format(
+                    response.status_code))
+                if response.status_code < 500:
+                    # the request is wrong, retrying it does not help. The
+                    # backend answered, so it closes the circuit.
+                    self.breaker.success()
+                    return None
+
+            delay = backoff(attempt)
+            if attempt == retries or time() + delay >= deadline:
+                break
+            sleep(delay)
+
+        self.breaker.failure()
+        return None
 
     def datapoints(self, query, maxdatapoints=None):
         # Graphite publishes the endpoint `/render` to retrieve
@@ -55,10 +137,11 @@ class GraphiteDataSource(DataSource):
         # only retrieve one target at once, Gramola supports only
         # rendering of one target.
 
+        time_range = query.time_range()
         params = {
             'target': query.target,
-            'from': query.get_since().strftime(DATE_FORMAT),
-            'to': query.get_until().strftime(DATE_FORMAT),
+            'from': time_range.since,
+            'until': time_range.until,
             # graphite supports mulitple output format, we have
             # to configure the json output
             'format': 'json'
@@ -67,12 +150,7 @@ class GraphiteDataSource(DataSource):
         if maxdatapoints:
             params['maxDataPoints'] = maxdatapoints
 
-        if self.configuration.url[-1] != '/':
-            url = self.configuration.url + '/render'
-        else:
-            url = self.configuration.url + 'render'
-
-        response = self._safe_request(url, params)
+        response = self._safe_request(self._url('render'), params)
 
         if response is None:
             return []
@@ -98,13 +176,139 @@ class GraphiteDataSource(DataSource):
 
         return values
 
+    def iter_series(self, query, maxdatapoints=None):
+        # The raw format is read line by line, see _raw_series, and the
+        # values are decoded while they are consumed.
+        time_range = query.time_range()
+        params = {
+            'target': query.target,
+            'from': time_range.since,
+            'until': time_range.until,
+            'format': 'raw'
+        }
+
+        if maxdatapoints:
+            params['maxDataPoints'] = maxdatapoints
+
+        response = self._safe_request(self._url('render'), params, stream=True)
+        if response is None:
+            return
+
+        for target, datapoints in _raw_series(response):
+            yield target, datapoints
+
+    def batches(self, queries):
+        # plain targets, the names of their series are the targets, with the
+        # same time range are fetched together using many targets per request.
+        batches = []
+        plain = {}
+        for query in queries:
+            if _PATTERN.search(query.target):
+                batches.append([query])
+                continue
+
+            batch = plain.get(query.time_range())
+            if batch is None or len(set(q.target for q in batch)) >= MAX_TARGETS_PER_REQUEST:
+                batch = plain[query.time_range()] = []
+                batches.append(batch)
+            batch.append(query)
+        return batches
+
+    def fetch_batch(self, queries, maxdatapoints=None):
+        time_range = queries[0].time_range()
+        targets = []
+        for query in queries:
+            if query.target not in targets:
+                targets.append(query.target)
+
+        params = {
+            'target': targets,
+            'from': time_range.since,
+            'until': time_range.until,
+            'format': 'raw'
+        }
+
+        if maxdatapoints:
+            params['maxDataPoints'] = maxdatapoints
+
+        response = self._safe_request(self._url('render'), params, stream=True)
+        if response is None:
+            raise DataSourceError("Graphite request failed")
+
+        series = [(target, list(datapoints)) for target, datapoints in _raw_series(response)]
+        if len(queries) == 1:
+            return [series]
+
+        by_target = {}
+        for target, datapoints in series:
+            by_target.setdefault(target, []).append((target, datapoints))
+        return [by_target.get(query.target, []) for query in queries]
+
+    def max_seconds_per_request(self, query, maxdatapoints=None):
+        # the maxDataPoints consolidation and the selectors of series
+        # need the whole time range.
+        if maxdatapoints or _SELECTOR.match(query.target):
+            return None
+        return MAX_SECONDS_PER_REQUEST
+
+    def push_down(self, query, transform, args):
+        # invalid arguments are reported by the transform run by Gramola
+        if transform not in PUSH_DOWN_TRANSFORMS or int(args[0]) < 1:
+            return None
+
+        params = query.dict()
+        params['target'] = "{}({},{})".format(transform, query.target, int(args[0]))
+        return query.__class__(**params)
+
+    def find(self, pattern):
+        """ Returns the nodes that match with the pattern given using the Graphite
+        endpoint `/metrics/find`, each node is returned as a tuple (name, leaf) where
+        the name is the last part of the metric path.
+
+        :param pattern: str, for example `servers.*`
+        :rtype: list, or None when the request failed.
+        """
+        response = self._safe_request(self._url('metrics/find'), {'query': pattern})
+        if response is None:
+            return None
+
+        return [(node['text'], bool(node['leaf'])) for node in response]
+
     def test(self):
         # test using the metrics find endpoint
         url = self.configuration.url + '/metrics/find'
         try:
-            response = requests.get(url, params={'query': '*'})
+            response = requests.get(url, params={'query': '*'}, timeout=self._timeout())
         except RequestException, e:
             log.debug('Test failed request error {}'.format(e))
             return False
 
+        if response.status_code != 200:
+            log.debug('Test failed unexpected status code {}'.format(response.status_code))
+            return False
+
         return True
+
+
+def _raw_series(response):
+    # The raw format returns one line for each series found by the target,
+    # `target,start,end,step|value,value,...`
+    for line in response.iter_lines():
+        if not line:
+            continue
+        header, values = line.split('|', 1)
+        # the target can have commas, i.e sumSeries(a,b)
+        target, start, _, step = header.rsplit(',', 3)
+        values = values.split(',')
+
+        # as the `datapoints` method does, the last None is dropped
+        # until the value of the last bucket is available.
+        if values and values[-1] == 'None':
+            values.pop()
+
+        yield target, _raw_datapoints(values, int(start), int(step))
+
+
+def _raw_datapoints(values, start, step):
+    for idx, value in enumerate(values):
+        yield (None if value == 'None' else float(value), start + idx * step)
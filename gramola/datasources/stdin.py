@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the stdin data source, a live data source that reads a continuous
+stream of datapoints from the stdin or from a named pipe. Each line of the
+stream is one datapoint given using one of the following formats:
+
+    value [timestamp]       : i.e `42` or `42 1454872083`
+    space separated columns : i.e the output of `vmstat 1`, using --column
+    NDJSON                  : i.e `{"value": 42, "ts": 1454872083}`
+
+Lines that can not be parsed, such as headers, are skipped. When the timestamp
+is not given the time when the line was read is used.
+
+The stream is read incrementally and only the last datapoints that fit into
+the plot are kept using a ring buffer for each query, so the memory used is
+constant no matter how long the stream is.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import os
+import sys
+import json
+import select
+
+from time import time
+
+from gramola import log
+from gramola.utils import RingBuffer
+from gramola.datasources.base import (
+    OptionalKey,
+    DataSource,
+    MetricQuery,
+    DataSourceConfig,
+    InvalidMetricQuery
+)
+
+# bytes read from the stream at once
+READ_SIZE = 64 * 1024
+
+# datapoints kept when the query does not give the maxdatapoints
+DEFAULT_MAXDATAPOINTS = 1024
+
+
+def parse_line(line, column=None, field=None, now=None):
+    """ Parse a line of the stream, returns a tuple (value, ts) or None if the
+    line does not have a valid datapoint.
+
+    :param line: str
+    :param column: int, 1-based column used as value, the timestamp is not read.
+    :param field: str, field of the NDJSON object used as value, default `value`.
+    :param now: float, timestamp used when the line does not have one.
+    :rtype: tuple or None
+    """
+    line = line.strip()
+    if not line:
+        return None
+
+    try:
+        if line[0] == '{':
+            datapoint = json.loads(line)
+            value = float(datapoint[field or 'value'])
+            ts = datapoint.get('ts', datapoint.get('timestamp'))
+            return value, float(ts) if ts is not None else (now or time())
+
+        columns = line.split()
+        if column:
+            return float(columns[column - 1]), now or time()
+
+        return float(columns[0]), float(columns[1]) if len(columns) > 1 else (now or time())
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+class StdinDataSourceConfig(DataSourceConfig):
+    REQUIRED_KEYS = ()
+    OPTIONAL_KEYS = (
+        OptionalKey('path', 'Read the datapoints from a named pipe instead of the stdin'),
+    )
+
+
+class StdinMetricQuery(MetricQuery):
+    REQUIRED_KEYS = ()
+    OPTIONAL_KEYS = (
+        OptionalKey('column', 'Use this column of each line as value, i.e 13 for the' +
+                              ' user CPU of vmstat'),
+        OptionalKey('field', 'Use this field of the NDJSON lines as value, default value')
+    )
+
+    def label(self):
+        if self.column:
+            return "column {}".format(self.column)
+        return self.field or "stdin"
+
+
+class StdinDataSource(DataSource):
+    DATA_SOURCE_CONFIGURATION_CLS = StdinDataSourceConfig
+    METRIC_QUERY_CLS = StdinMetricQuery
+    TYPE = 'stdin'
+    LIVE = True
+    CONSUMES_STDIN = True
+
+    def __init__(self, configuration):
+        super(StdinDataSource, self).__init__(configuration)
+        self._fd = None
+        self._pending = ""
+        self._closed = False
+
+        # (column, field) -> RingBuffer, queries that read the
+        # same values share the same buffer.
+        self._buffers = {}
+
+    def _key(self, query):
+        try:
+            column = int(query.column) if query.column else None
+        except ValueError:
+            raise InvalidMetricQuery("Query column invalid value `{}`".format(query.column))
+
+        if column is not None and column < 1:
+            raise InvalidMetricQuery("Query column invalid value `{}`".format(query.column))
+
+        return column, query.field
+
+    def _open(self):
+        if self._fd is None:
+            if self.configuration.path:
+                self._fd = os.open(self.configuration.path, os.O_RDONLY)
+            else:
+                self._fd = sys.stdin.fileno()
+        return self._fd
+
+    def subscribe(self, query, maxdatapoints=None):
+        key = self._key(query)
+        if key not in self._buffers:
+            self._buffers[key] = RingBuffer(maxdatapoints or DEFAULT_MAXDATAPOINTS)
+
+    def poll(self, timeout=None):
+        if self._closed:
+            return False
+
+        fd = self._open()
+        deadline = time() + timeout if timeout is not None else None
+
+        # wait for the first chunk, afterwards keep reading until the deadline
+        wait = None
+        while True:
+            readable, _, _ = select.select([fd], [], [], wait)
+            if not readable:
+                return True
+
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                self._consume("", flush=True)
+                self._closed = True
+                return False
+
+            self._consume(chunk)
+            if deadline is not None:
+                wait = deadline - time()
+                if wait <= 0:
+                    return True
+
+    def _consume(self, chunk, flush=False):
+        lines = (self._pending + chunk).split("\n")
+        self._pending = "" if flush else lines.pop()
+
+        now = time()
+        for line in lines:
+            for (column, field), buffer_ in self._buffers.iteritems():
+                datapoint = parse_line(line, column=column, field=field, now=now)
+                if datapoint is not None:
+                    buffer_.append(*datapoint)
+
+    def datapoints(self, query, maxdatapoints=None):
+        buffer_ = self._buffers.get(self._key(query))
+        if buffer_ is None:
+            log.warning("Query `{}` has not been subscribed".format(query.label()))
+            return []
+        return buffer_.datapoints()
+
+    def test(self):
+        # nothing to test, the stream is opened by the query
+        return True
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the Whisper [1] data source, it reads the `.wsp` files saved by
+carbon straight from the local disk instead of asking graphite-web.
+
+A Whisper file starts with a header followed by the information of each archive,
+from the highest precision to the lowest one, and afterwards the archives. Each
+archive is a circular buffer of points (timestamp, value), where the slot of a
+timestamp is given by its distance to the timestamp of the first slot.
+
+The files are mapped into memory and only the slots that belong to the time
+range queried are decoded, using the archive with the highest precision that
+covers the time range and returns fewer points than the maxdatapoints. Patterns,
+such as `servers.web*.cpu`, are expanded to many files read concurrently.
+
+[1] http://graphite.readthedocs.org/en/latest/whisper.html
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import os
+import mmap
+import struct
+
+from time import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from gramola import log
+from gramola.index import compile_pattern, is_pattern
+from gramola.datasources.base import (
+    OptionalKey,
+    DataSource,
+    MetricQuery,
+    DataSourceConfig
+)
+
+EXTENSION = ".wsp"
+
+# files read at once when a pattern matches many files
+MAX_WORKERS = 8
+
+_METADATA = struct.Struct("!2LfL")
+_ARCHIVE_INFO = struct.Struct("!3L")
+_POINT_SIZE = struct.calcsize("!Ld")
+
+
+class CorruptWhisperFile(Exception):
+    pass
+
+
+class Archive(object):
+    """ Information of one archive of a Whisper file """
+    def __init__(self, offset, seconds_per_point, points):
+        self.offset = offset
+        self.seconds_per_point = seconds_per_point
+        self.points = points
+        self.retention = seconds_per_point * points
+        self.size = points * _POINT_SIZE
+
+
+def read_archives(buffer_):
+    """ Returns the list of archives of a Whisper file, from the highest
+    precision to the lowest one.
+
+    :param buffer_: the content of the file, usually a mmap.
+    :raises: CorruptWhisperFile
+    """
+    try:
+        _, _, _, count = _METADATA.unpack_from(buffer_, 0)
+        archives = [Archive(*_ARCHIVE_INFO.unpack_from(buffer_, _METADATA.size +
+                                                       idx * _ARCHIVE_INFO.size))
+                    for idx in range(count)]
+    except struct.error:
+        raise CorruptWhisperFile()
+
+    if not archives or any(a.offset + a.size > len(buffer_) for a in archives):
+        raise CorruptWhisperFile()
+    return archives
+
+
+def pick_archive(archives, time_range, maxdatapoints=None, now=None):
+    """ Returns the archive with the highest precision that covers the time range
+    and returns at most maxdatapoints, if none of them does it the one with the
+    lowest precision that covers the time range is returned.
+
+    :param archives: list of :class:Archive sorted by precision.
+    :param time_range: :class:gramola.utils.TimeRange
+    :param maxdatapoints: int
+    :param now: int, epoch seconds.
+    :rtype: :class:Archive
+    """
+    now = now or int(time())
+    covering = [a for a in archives if now - time_range.since <= a.retention] or archives[-1:]
+    if maxdatapoints:
+        for archive in covering:
+            if time_range.seconds / archive.seconds_per_point <= maxdatapoints:
+                return archive
+        return covering[-1]
+    return covering[0]
+
+
+def read_points(buffer_, archive, since, until):
+    """ Decode the slots of the archive that belong to the interval [since, until),
+    returns the tuple (values, timestamps) as arrays where the values of the
+    slots without datapoint are NaN.
+
+    :param buffer_: the content of the file, usually a mmap.
+    :param archive: :class:Archive
+    :param since: int, epoch seconds.
+    :param until: int, epoch seconds.
+    """
+    step = archive.seconds_per_point
+    since = since - (since % step) + step
+    until = until - (until % step) + step
+    count = max(0, (until - since) / step)
+
+    timestamps = array('l', range(since, since + count * step, step))
+    values = array('d', [float('nan')]) * count
+
+    base, _ = struct.unpack_from("!Ld", buffer_, archive.offset)
+    if base == 0 or count == 0:
+        # the archive has never been written
+        return values, timestamps
+
+    # the archive keeps at most the last `points` slots of the interval
+    skip = max(0, count - archive.points)
+
+    # slots are read wrapping around the end of the archive, at most once
+    first = ((since + skip * step - base) / step) % archive.points
+    idx = skip
+    for start, length in _slices(first, count - skip, archive.points):
+        points = struct.unpack_from("!" + "Ld" * length, buffer_,
+                                    archive.offset + start * _POINT_SIZE)
+        for ts, value in zip(points[0::2], points[1::2]):
+            # slots not written since the last lap have an old timestamp
+            if ts == timestamps[idx]:
+                values[idx] = value
+            idx += 1
+
+    return values, timestamps
+
+
+def _slices(first, count, points):
+    if first + count <= points:
+        return [(first, count)]
+    return [(first, points - first), (0, count - (points - first))]
+
+
+def consolidate(values, timestamps, maxdatapoints):
+    """ Average consecutive points, ignoring the NaN values, until there are at
+    most maxdatapoints. Returns the tuple (values, timestamps).
+    """
+    if not maxdatapoints or len(values) <= maxdatapoints:
+        return values, timestamps
+
+    points_per_bucket = -(-len(values) // maxdatapoints)
+    consolidated = array('d')
+    for idx in range(0, len(values), points_per_bucket):
+        known = [v for v in values[idx:idx + points_per_bucket] if v == v]
+        consolidated.append(sum(known) / len(known) if known else float('nan'))
+    return consolidated, timestamps[::points_per_bucket]
+
+
+class WhisperDataSourceConfig(DataSourceConfig):
+    REQUIRED_KEYS = ('root',)
+    OPTIONAL_KEYS = ()
+
+
+class WhisperMetricQuery(MetricQuery):
+    REQUIRED_KEYS = ('path',)
+    OPTIONAL_KEYS = ()
+
+
+class WhisperDataSource(DataSource):
+    DATA_SOURCE_CONFIGURATION_CLS = WhisperDataSourceConfig
+    METRIC_QUERY_CLS = WhisperMetricQuery
+    TYPE = 'whisper'
+
+    def expand(self, pattern):
+        """ Returns the sorted list of metric paths that match with the pattern
+        given, looking for the Whisper files under the storage root.
+
+        :param pattern: str, for example `servers.web*.cpu`
+        :rtype: list
+        """
+        paths = [""]
+        segments = pattern.split(".")
+        for depth, segment in enumerate(segments):
+            last = depth == len(segments) - 1
+            matcher = compile_pattern(segment) if is_pattern(segment) else None
+            matched = []
+            for path in paths:
+                directory = os.path.join(self.configuration.root, *path.split(".") if path else [])
+                try:
+                    names = os.listdir(directory) if matcher else\
+                        [segment + EXTENSION if last else segment]
+                except OSError:
+                    continue
+
+                for name in names:
+                    filename = name
+                    if last:
+                        if not name.endswith(EXTENSION):
+                            continue
+                        name = name[:-len(EXTENSION)]
+
+                    if matcher and not matcher.match(name):
+                        continue
+
+                    exists = os.path.isfile if last else os.path.isdir
+                    if exists(os.path.join(directory, filename)):
+                        matched.append(path + "." + name if path else name)
+            paths = matched
+
+        return sorted(paths)
+
+    def _filepath(self, path):
+        return os.path.join(self.configuration.root, *path.split(".")) + EXTENSION
+
+    def _read(self, path, time_range, maxdatapoints, now):
+        # returns the tuple (values, timestamps, step) of one metric path
+        with open(self._filepath(path), "rb") as fd:
+            buffer_ = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                archive = pick_archive(read_archives(buffer_), time_range,
+                                       maxdatapoints=maxdatapoints, now=now)
+                values, timestamps = read_points(buffer_, archive, time_range.since,
+                                                 min(time_range.until, now))
+            finally:
+                buffer_.close()
+
+        return consolidate(values, timestamps, maxdatapoints) + (archive.seconds_per_point,)
+
+    def _read_all(self, query, maxdatapoints):
+        # returns a list of (path, result), where the result is the tuple
+        # (values, timestamps, step) or None if the file can not be read.
+        paths = self.expand(query.path)
+        if not paths:
+            log.warning('Metric `{}` not found'.format(query.path))
+            return []
+
+        time_range = query.time_range()
+        now = int(time())
+
+        def read(path):
+            try:
+                return self._read(path, time_range, maxdatapoints, now)
+            except (IOError, OSError, ValueError, CorruptWhisperFile), e:
+                log.warning("Whisper file of `{}` can not be read: {}".format(path, e))
+                return None
+
+        if len(paths) == 1:
+            return [(paths[0], read(paths[0]))]
+
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(paths))) as executor:
+            return zip(paths, executor.map(read, paths))
+
+    def datapoints(self, query, maxdatapoints=None):
+        results = self._read_all(query, maxdatapoints)
+        if not results or results[0][1] is None:
+            return []
+        elif len(results) > 1:
+            log.warning('Multiple metrics found, geting only the first one')
+
+        values, timestamps, _ = results[0][1]
+
+        # as the Graphite datasource does, the last empty slot is dropped until
+        # its value is available and the other empty slots are turned into 0.
+        datapoints = [(value if value == value else 0, ts)
+                      for value, ts in zip(values, timestamps)]
+        if datapoints and values[-1] != values[-1]:
+            datapoints.pop()
+        return datapoints
+
+    def iter_series(self, query, maxdatapoints=None):
+        for path, result in self._read_all(query, maxdatapoints):
+            if result is None:
+                continue
+            values, timestamps, _ = result
+            yield path, ((value if value == value else None, ts)
+                         for value, ts in zip(values, timestamps))
+
+    def step(self, query, maxdatapoints=None):
+        paths = self.expand(query.path)
+        if not paths:
+            return None
+
+        try:
+            with open(self._filepath(paths[0]), "rb") as fd:
+                buffer_ = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    archive = pick_archive(read_archives(buffer_), query.time_range(),
+                                           maxdatapoints=maxdatapoints)
+                finally:
+                    buffer_.close()
+        except (IOError, OSError, ValueError, CorruptWhisperFile):
+            return None
+
+        # the points are consolidated when the archive returns too many of them
+        seconds = query.time_range().seconds
+        count = seconds / archive.seconds_per_point
+        if maxdatapoints and count > maxdatapoints:
+            return archive.seconds_per_point * -(-count // maxdatapoints)
+        return archive.seconds_per_point
+
+    def test(self):
+        return os.path.isdir(self.configuration.root)
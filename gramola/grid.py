@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the grid compositor used to render many series at once, each
+series is rendered by its own :class:gramola.plot.Plot as a panel of the grid.
+For example the grid 2x2 renders four series using the following layout:
+
+    title one               title two
+    |       *               |    *
+    |    ****               |  ****
+    +---+---+               +---+---+
+    min=1, max=8, last=8,   min=2, max=9, last=2,
+    title three             title four
+    ...
+
+The grid has a fixed number of columns and rows, the width of each panel is
+derived from the width of the terminal and the number of columns. Each frame
+is composed in memory and written using just one call, once the first frame
+has been written only the panels that got new datapoints are rewritten moving
+the cursor to their region of the screen.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+from gramola.plot import (
+    Plot,
+    DEFAULT_ROWS,
+    DEFAULT_MODE,
+    getTerminalSize,
+    write
+)
+
+SEPARATOR = u" "
+
+
+def parse_grid(spec):
+    """ Parse a grid spec given as COLUMNSxROWS, for example 3x4, and
+    returns the tuple (columns, rows).
+
+    :param spec: str
+    :raises ValueError: If the spec is not well formed.
+    :rtype: tuple
+    """
+    try:
+        columns, rows = [int(v) for v in spec.lower().split("x")]
+    except ValueError:
+        raise ValueError("Invalid grid {}, expected COLUMNSxROWS".format(spec))
+
+    if columns < 1 or rows < 1:
+        raise ValueError("Invalid grid {}, expected COLUMNSxROWS".format(spec))
+
+    return columns, rows
+
+
+class Panel(object):
+    """ One cell of the grid, it keeps the plot used to render the series and
+    the lines rendered the last time to avoid render them again when the
+    datapoints didn't change.
+    """
+    def __init__(self, title, plot, width):
+        self.title = title
+        self.plot = plot
+        self.width = width
+        self.datapoints = None
+        self.stale = False
+        self.lines = None
+
+    def update(self, datapoints, stale=False):
+        """ Render the datapoints if they are different to the ones rendered
+        the last time. Returns True if the panel has been rendered.
+        """
+        if self.lines is not None and datapoints == self.datapoints and stale == self.stale:
+            return False
+
+        lines = [self.title] + self.plot.render(datapoints, stale=stale)
+        self.lines = [_fit(line, self.width) for line in lines]
+        self.datapoints = datapoints
+        self.stale = stale
+        return True
+
+
+class Grid(object):
+
+    def __init__(self, titles, columns, rows, max_x=None, plot_rows=DEFAULT_ROWS,
+                 mode=DEFAULT_MODE, width=None):
+        """
+        :param titles: list of str, one title for each panel.
+        :param columns: int, columns of the grid.
+        :param rows: int, rows of the grid.
+        :param max_x: int, maxium value expected used by all panels.
+        :param plot_rows: int, rows used by the plot of each panel.
+        :param mode: str, plot mode used by all panels.
+        :param width: int, use a fixed number of columns instead of the whole
+                      width of the terminal.
+        """
+        if len(titles) > columns * rows:
+            raise ValueError("Grid {}x{} can not render {} panels".format(
+                columns, rows, len(titles)))
+
+        self.columns = columns
+        self.rows = rows
+
+        if not width:
+            width, _ = getTerminalSize()
+
+        self.panel_width = (width - len(SEPARATOR) * (columns - 1)) / columns
+        if self.panel_width < 2:
+            raise ValueError("Grid {}x{} does not fit into screen of {}".format(
+                columns, rows, width))
+
+        # the plot needs the first column of the panel
+        self.panels = [Panel(title, Plot(max_x=max_x, rows=plot_rows, mode=mode,
+                                         width=self.panel_width - 1),
+                             self.panel_width)
+                       for title in titles]
+
+        # all panels have the same height, title + plot
+        self.panel_height = 1 + self.panels[0].plot.height() if self.panels else 0
+        self.__drawn = False
+
+    def height(self):
+        """ Returns the number of lines used to render the grid """
+        used_rows = (len(self.panels) + self.columns - 1) / self.columns
+        return used_rows * self.panel_height
+
+    def maxdatapoints(self, idx):
+        """ Returns the maxium number of datapoints that the panel idx can render """
+        return self.panels[idx].plot.maxdatapoints()
+
+    def draw(self, series, stale=None):
+        """ Render a list of datapoints, one for each panel following the same
+        order used for the titles. The first call writes the whole frame, the next
+        ones only rewrite the panels that got different datapoints.
+
+        :param series: list of list of tuples (value, ts).
+        :param stale: list of bool, the panels whose datapoints could not be refreshed.
+        """
+        stale = stale or [False] * len(series)
+        changed = [idx for idx, (panel, datapoints, panel_stale) in
+                   enumerate(zip(self.panels, series, stale))
+                   if panel.update(datapoints, stale=panel_stale)]
+
+        if not self.__drawn:
+            write(self._frame())
+            self.__drawn = True
+        elif changed:
+            write(self._partial_frame(changed))
+
+    def _frame(self):
+        buffer_ = []
+        blank = u" " * self.panel_width
+        for row in range(0, self.height() / self.panel_height):
+            panels = self.panels[row * self.columns:(row + 1) * self.columns]
+            for line in range(0, self.panel_height):
+                buffer_.append(SEPARATOR.join(
+                    [panel.lines[line] for panel in panels] +
+                    [blank] * (self.columns - len(panels))).rstrip())
+                buffer_.append(u"\n")
+        return u"".join(buffer_)
+
+    def _partial_frame(self, changed):
+        # The cursor is placed at the beginning of the line just below the
+        # frame, each line of a changed panel is written moving the cursor up
+        # to its line and right to its column, and afterwards back down.
+        buffer_ = []
+        height = self.height()
+        for idx in changed:
+            panel = self.panels[idx]
+            top = (idx / self.columns) * self.panel_height
+            column = (idx % self.columns) * (self.panel_width + len(SEPARATOR)) + 1
+            for line_idx, line in enumerate(panel.lines):
+                up = height - (top + line_idx)
+                buffer_.append(u"\033[{}A\033[{}G{}\r\033[{}B".format(up, column, line, up))
+        return u"".join(buffer_)
+
+
+def _fit(line, width):
+    # panels are aligned by padding or truncating each line
+    return line[:width].ljust(width)
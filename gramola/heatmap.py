@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the heatmap used to render many series in one panel, for example the
+latency of every host of a fleet. The series are binned into a grid of time x
+value cells, each column covers one slice of the time range and each row one
+slice of the values, and each cell is shaded by the number of datapoints that
+fell into it:
+
+|     ░░ ░        ░
+|  ░░▒▒░░▒░░   ░░▒▒░
+|░▒▓▓██▓▓▓▓▒▒░▒▓▓██▓▒░
+|▓███████████████████▓
++---+---+---+---+---+-
+series=1000, min=3, max=412, cell max=97
+
+The series are binned while they are iterated, one datapoint at a time, into a
+grid finer than the rows rendered. When a value falls out of the range of the
+grid the range is widened and the counters are binned again, so the memory used
+depends on the size of the heatmap and not on the number of series rendered.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+from array import array
+
+from gramola.plot import DEFAULT_ROWS, STALE_MARKER, write, getTerminalSize
+from gramola.stats import format_value
+
+HEATMAP = 'heatmap'
+
+# Glyphs used by the cells from the empty one to the densest one
+SHADES = (u' ', u'░', u'▒', u'▓', u'█')
+
+
+# rows of the grid used to bin the values for each row rendered
+RESOLUTION = 8
+
+
+def _isnan(value):
+    return value != value
+
+
+class Bins(object):
+    """ Grid of time x value counters filled while the series are iterated """
+
+    def __init__(self, columns, rows, time_range, max_x=None, resolution=RESOLUTION):
+        """
+        :param columns: int, one for each slice of the time range.
+        :param rows: int, one for each slice of the values rendered.
+        :param time_range: :class:gramola.utils.TimeRange, datapoints out of it are skipped.
+        :param max_x: int, the maxium value expected, bigger values are binned
+                      into the top row, default None.
+        :param resolution: int, rows of the grid for each row rendered.
+        """
+        self.columns = columns
+        self.rows = rows
+        self.time_range = time_range
+        self.max_x = max_x
+        self._fine = rows * resolution
+        self._counts = array('l', [0]) * (self._fine * columns)
+
+        # range of values covered by the grid
+        self._lo = self._hi = None
+
+        # range of values, datapoints and series binned
+        self.low = self.high = None
+        self.datapoints = 0
+        self.series = 0
+
+        # the last timestamp and the shortest step seen, used by the scheduler
+        self.last_ts = None
+        self.step = None
+
+    def add(self, datapoints):
+        """ Bin the datapoints of one series, an iterable of tuples (value, ts)
+        where the value is None or NaN when it is not available.
+        """
+        self.series += 1
+        since, until = self.time_range
+        column_scale = (self.columns - 1) / float(until - since) if until > since else 0
+        previous = None
+        for value, ts in datapoints:
+            if value is None or _isnan(value) or not since <= ts <= until:
+                continue
+
+            if self.max_x is not None:
+                value = min(value, self.max_x)
+            if self._lo is None or not self._lo <= value < self._hi:
+                self._widen(value)
+            self.low = min(self.low, value) if self.low is not None else value
+            self.high = max(self.high, value)
+
+            # the last timestamp of the time range is aligned with the right corner
+            row = int((value - self._lo) * self._fine / (self._hi - self._lo))
+            column = self.columns - 1 - int((until - ts) * column_scale)
+            self._counts[min(row, self._fine - 1) * self.columns + column] += 1
+
+            self.datapoints += 1
+            self.last_ts = max(self.last_ts, ts)
+            if previous is not None and ts > previous:
+                self.step = min(self.step or ts - previous, ts - previous)
+            previous = ts
+
+    def _widen(self, value):
+        # the new range keeps room at both sides, so it is widened
+        # just a few times, and the counters are binned again.
+        low = min(self.low, value) if self.low is not None else value
+        high = max(self.high, value) if self.high is not None else value
+        room = (high - low) / 2.0 or abs(value) / 2.0 or 1.0
+        lo, hi = low - room, high + room
+
+        if self._lo is not None:
+            counts = array('l', [0]) * len(self._counts)
+            width = (self._hi - self._lo) / self._fine
+            for row in range(self._fine):
+                center = self._lo + (row + 0.5) * width
+                new_row = min(self._fine - 1, int((center - lo) * self._fine / (hi - lo)))
+                offset, new_offset = row * self.columns, new_row * self.columns
+                for column in range(self.columns):
+                    counts[new_offset + column] += self._counts[offset + column]
+            self._counts = counts
+        self._lo, self._hi = lo, hi
+
+    def counts(self):
+        """ Returns the array of rows x columns counters rendered, being the
+        first row the lowest values, between the minimum value binned and the
+        max_x, or the maxium value binned when it is not given.
+        """
+        counts = array('l', [0]) * (self.rows * self.columns)
+        if self.low is None:
+            return counts
+
+        high = self.max_x if self.max_x is not None else self.high
+        low = min(self.low, high)
+        row_scale = self.rows / float(high - low) if high > low else 0
+        width = (self._hi - self._lo) / self._fine
+        for row in range(self._fine):
+            center = self._lo + (row + 0.5) * width
+            new_row = max(0, min(self.rows - 1, int((center - low) * row_scale)))
+            offset, new_offset = row * self.columns, new_row * self.columns
+            for column in range(self.columns):
+                counts[new_offset + column] += self._counts[offset + column]
+        return counts
+
+
+class Heatmap(object):
+
+    def __init__(self, max_x=None, rows=DEFAULT_ROWS, width=None):
+        """
+        :param max_x: int, the maxium value expected, bigger values are binned
+                      into the top row, default None.
+        :param rows: int, number of rows used to render the values.
+        :param width: int, use a fixed number of columns instead of the
+                      whole width of the terminal, default None.
+        """
+        self.rows = rows
+        self.max_x = max_x
+        self._width = width
+        self.__drawn = False
+
+    def width(self):
+        if self._width:
+            return self._width
+
+        width, _ = getTerminalSize()
+
+        # the heatmap needs the first column
+        return (width - 1)
+
+    def height(self):
+        """ Returns the number of lines used to render the heatmap """
+        return self.rows + 2
+
+    def maxdatapoints(self):
+        """ Returns the maxium number of datapoints of each series that can be
+        rendered, one for each column.
+        """
+        return self.width()
+
+    def bins(self, time_range):
+        """ Returns an empty :class:Bins with the size of the heatmap, the series
+        of the time range given are binned one by one and afterwards the bins
+        are rendered.
+        """
+        return Bins(self.width(), self.rows, time_range, max_x=self.max_x)
+
+    def draw(self, bins, stale=False):
+        """ Render the :class:Bins given. When stale is True the bins are
+        the last good ones and the footer is marked.
+
+        The whole heatmap is built in memory and written using just one call.
+        """
+        lines = self.render(bins, stale=stale)
+
+        buffer_ = []
+        if self.__drawn:
+            # remove the lines used by the previous frame to refresh
+            # the heatmap using the same console space
+            for i in range(0, self.height()):
+                buffer_.append(u"\033[K")   # remove line
+                buffer_.append(u"\033[1A")  # up the cursor
+
+        for line in lines:
+            buffer_.append(line)
+            buffer_.append(u"\n")
+
+        write(u"".join(buffer_))
+        self.__drawn = True
+
+    def render(self, bins, stale=False):
+        """ Render the bins given as a parameter returning the list of
+        lines, without the line breaks, that make up the heatmap.
+
+        :param bins: :class:Bins
+        :param stale: bool, the series could not be refreshed.
+        :rtype: list.
+        """
+        columns = bins.columns
+        counts = bins.counts()
+        densest = max(counts) if counts else 0
+
+        # the cells with datapoints get at least the lightest shade
+        levels = len(SHADES) - 1
+        lines = []
+        for row in range(self.rows - 1, -1, -1):
+            cells = counts[row * columns:(row + 1) * columns]
+            lines.append(u"|" + u"".join(
+                SHADES[-(-count * levels // densest)] if count else SHADES[0] for count in cells))
+
+        lines.append(u"+" + u"---+" * (columns / 4) + u"-" * (columns % 4))
+
+        if bins.low is None:
+            footer = u"no datapoints found ..."
+        else:
+            high = bins.max_x if bins.max_x is not None else bins.high
+            footer = u"series={}, min={}, max={}, cell max={}".format(
+                bins.series, format_value(min(bins.low, high)), format_value(high), densest)
+        lines.append((STALE_MARKER if stale else u"") + footer)
+
+        return lines
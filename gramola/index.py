@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Implements a local index of the metric tree published by a Graphite service
+through the `/metrics/find` endpoint. The index is saved under the Store
+directory, one file for each datasource, and it is used to expand patterns
+and complete metric paths without asking Graphite each time.
+
+Each branch of the tree is saved along with the time when its children were
+fetched, only the branches visited by a pattern whose children are older than
+the TTL given are fetched again. For example the pattern `servers.web*.cpu`
+visits the root, the `servers` branch and the `servers.webN` branches.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import os
+import re
+import json
+import time
+
+from gramola import log
+
+DEFAULT_TTL = 3600
+INDEX_DIRNAME = "indexes"
+
+_ROOT = ""
+
+
+def compile_pattern(segment):
+    """ Compile a segment of a Graphite pattern, the part between dots, to a
+    regular expression. Supports the `*`, `?`, `[...]` and `{a,b}` wildcards.
+
+    :param segment: str
+    :rtype: compiled regular expression.
+    """
+    regex = []
+    i = 0
+    while i < len(segment):
+        c = segment[i]
+        if c == '*':
+            regex.append('.*')
+        elif c == '?':
+            regex.append('.')
+        elif c == '[':
+            end = segment.find(']', i)
+            if end == -1:
+                regex.append(re.escape(c))
+            else:
+                regex.append(segment[i:end + 1])
+                i = end
+        elif c == '{':
+            end = segment.find('}', i)
+            if end == -1:
+                regex.append(re.escape(c))
+            else:
+                regex.append('(?:' + '|'.join(
+                    re.escape(alt) for alt in segment[i + 1:end].split(',')) + ')')
+                i = end
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(regex) + r'\Z')
+
+
+def is_pattern(segment):
+    """ Returns True if the segment has any wildcard """
+    return any(c in segment for c in '*?[{')
+
+
+class GraphiteIndex(object):
+    """ Index of the metric tree of one Graphite datasource. The datasource
+    given is only used to fetch the branches not found or expired, it can be
+    None to work only with the local index.
+    """
+    def __init__(self, filepath, datasource=None, ttl=DEFAULT_TTL):
+        """
+        :param filepath: str, file used to save the index.
+        :param datasource: :class:gramola.datasources.graphite.GraphiteDataSource
+        :param ttl: int, seconds that the children of a branch are considered fresh.
+        """
+        self.filepath = filepath
+        self.datasource = datasource
+        self.ttl = ttl
+        self._dirty = False
+
+        # path of the branch -> [fetched timestamp, {child name: leaf}]
+        self._branches = {}
+        if os.path.exists(filepath):
+            with open(filepath) as fd:
+                self._branches = json.load(fd)
+
+    @classmethod
+    def from_store(cls, store, name, datasource=None, ttl=DEFAULT_TTL):
+        """ Returns the index of the datasource called `name` saved under the
+        store directory.
+        """
+        filename = "graphite-{}.json".format(name)
+        return cls(os.path.join(store.directory(INDEX_DIRNAME), filename),
+                   datasource=datasource, ttl=ttl)
+
+    def save(self):
+        """ Save the index if it has been changed """
+        if not self._dirty:
+            return
+
+        tmp = self.filepath + ".tmp"
+        with open(tmp, "w") as fd:
+            json.dump(self._branches, fd)
+        os.rename(tmp, self.filepath)
+        self._dirty = False
+
+    def children(self, path, now=None):
+        """ Returns the children of the branch as a dictionary {name: leaf},
+        the branch is fetched if it is not found or it has expired.
+
+        :param path: str, path of the branch, empty string for the root.
+        :rtype: dict
+        """
+        now = now or time.time()
+        branch = self._branches.get(path)
+        if branch and (self.datasource is None or branch[0] + self.ttl > now):
+            return branch[1]
+
+        if self.datasource is None:
+            return {}
+
+        nodes = self.datasource.find(path + ".*" if path else "*")
+        if nodes is None:
+            # keep the stale children if Graphite is not available
+            log.warning("Branch `{}` can not be fetched".format(path))
+            return branch[1] if branch else {}
+
+        children = dict(nodes)
+        if branch:
+            # forget the branches that do not exist anymore
+            for name in set(branch[1]) - set(children):
+                self._forget(_join(path, name))
+
+        self._branches[path] = [now, children]
+        self._dirty = True
+        return children
+
+    def _forget(self, path):
+        prefix = path + "."
+        for branch in [b for b in self._branches if b == path or b.startswith(prefix)]:
+            del self._branches[branch]
+
+    def find(self, pattern, now=None):
+        """ Returns the sorted list of paths that match with the pattern, each
+        element is a tuple (path, leaf).
+
+        :param pattern: str, Graphite pattern such as `servers.web*.cpu`.
+        :rtype: list
+        """
+        now = now or time.time()
+        segments = pattern.split(".")
+        frontier = [_ROOT]
+        for depth, segment in enumerate(segments):
+            last = depth == len(segments) - 1
+            matcher = compile_pattern(segment) if is_pattern(segment) else None
+            matched = []
+            for path in frontier:
+                children = self.children(path, now=now)
+                if matcher:
+                    names = [(n, l) for n, l in children.iteritems() if matcher.match(n)]
+                elif segment in children:
+                    names = [(segment, children[segment])]
+                else:
+                    names = []
+
+                matched.extend((_join(path, name), leaf) for name, leaf in names
+                               if last or not leaf)
+
+            if last:
+                return sorted(matched)
+            frontier = [path for path, _ in matched]
+
+        return []
+
+    def complete(self, prefix, now=None):
+        """ Returns the sorted list of paths that start with the prefix given
+        looking only the children of the last branch of the prefix, branches are
+        returned with a trailing dot.
+
+        :param prefix: str, for example `servers.we`
+        :rtype: list
+        """
+        if "." in prefix:
+            path, partial = prefix.rsplit(".", 1)
+        else:
+            path, partial = _ROOT, prefix
+
+        children = self.children(path, now=now)
+        return sorted(_join(path, name) + ("" if leaf else ".")
+                      for name, leaf in children.iteritems() if name.startswith(partial))
+
+
+def _join(path, name):
+    return path + "." + name if path else name
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the interactive mode of the query commands, the keys pressed zoom
+and pan the time range rendered:
+
+    +, up       : zoom in, halves the time range keeping its center.
+    -, down     : zoom out, doubles the time range keeping its center.
+    h, left     : pan backward half of the time range.
+    l, right    : pan forward half of the time range, never beyond now.
+    0           : back to the time range of the query.
+    q           : quit.
+
+The time range is kept relative to the current time, when it reaches now it
+keeps moving forward as the refresh mode does.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import os
+import tty
+import select
+import termios
+
+from time import sleep
+
+from gramola.utils import TimeRange
+
+QUIT = 'q'
+
+# minimum seconds rendered when zooming in
+MIN_SECONDS = 60
+
+# escape sequences of the arrow keys
+ARROWS = {
+    '\x1b[A': 'up',
+    '\x1b[B': 'down',
+    '\x1b[C': 'right',
+    '\x1b[D': 'left',
+}
+
+
+class Viewport(object):
+
+    def __init__(self, time_range, now, min_seconds=MIN_SECONDS):
+        """
+        :param time_range: :class:gramola.utils.TimeRange, the initial one.
+        :param now: float, current time used to resolve the time range.
+        :param min_seconds: int, minimum seconds rendered.
+        """
+        self.min_seconds = min_seconds
+        self.seconds = time_range.seconds
+        self.offset = max(0, int(now - time_range.until))
+        self._initial = (self.seconds, self.offset)
+
+    def time_range(self, now):
+        """ Returns the time range rendered at the current time given """
+        until = int(now) - self.offset
+        return TimeRange(until - self.seconds, until)
+
+    def zoom_in(self):
+        seconds = max(self.min_seconds, self.seconds / 2)
+        self.offset += (self.seconds - seconds) / 2
+        self.seconds = seconds
+
+    def zoom_out(self):
+        seconds = self.seconds * 2
+        self.offset = max(0, self.offset - (seconds - self.seconds) / 2)
+        self.seconds = seconds
+
+    def pan_backward(self):
+        self.offset += self.seconds / 2
+
+    def pan_forward(self):
+        self.offset = max(0, self.offset - self.seconds / 2)
+
+    def reset(self):
+        self.seconds, self.offset = self._initial
+
+    def handle(self, key):
+        """ Apply the action bound to the key, returns True if the time range
+        has changed.
+        """
+        action = KEYS.get(key)
+        if action is None:
+            return False
+
+        before = (self.seconds, self.offset)
+        action(self)
+        return (self.seconds, self.offset) != before
+
+
+KEYS = {
+    '+': Viewport.zoom_in,
+    '=': Viewport.zoom_in,
+    'up': Viewport.zoom_in,
+    '-': Viewport.zoom_out,
+    'down': Viewport.zoom_out,
+    'h': Viewport.pan_backward,
+    'left': Viewport.pan_backward,
+    'l': Viewport.pan_forward,
+    'right': Viewport.pan_forward,
+    '0': Viewport.reset,
+}
+
+
+class Keyboard(object):
+    """ Reads the keys pressed without waiting for the line break. When the
+    stream is not a terminal no key is ever read.
+    """
+
+    def __init__(self, stream):
+        self.fd = stream.fileno() if stream.isatty() else None
+        self._attrs = None
+        if self.fd is not None:
+            self._attrs = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)
+
+    def read(self, timeout):
+        """ Returns the key pressed, the name of the arrows, or None if no key
+        has been pressed before the timeout.
+
+        :param timeout: float, seconds.
+        """
+        if self.fd is None:
+            sleep(timeout)
+            return None
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return None
+
+        key = os.read(self.fd, 8)
+        return ARROWS.get(key, key[:1])
+
+    def close(self):
+        if self._attrs is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self._attrs)
+            self._attrs = None
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the writers used by the query commands to stream the datapoints to
+the stdout instead of rendering them, making Gramola usable as a fetcher in
+shell pipelines. The formats supported are:
+
+  * ndjson : One JSON object for each datapoint, {"target": .., "ts": .., "value": ..}
+  * csv    : One row for each datapoint, target,ts,value, with a header.
+  * json   : One JSON list with all datapoints, using the same objects than ndjson.
+
+The datapoints are written as they are pulled from the generators given by the
+datasource, without building any list, the json format writes the brackets of
+the list when it is opened and closed.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import csv
+import json
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+JSON = 'json'
+FORMATS = (NDJSON, CSV, JSON)
+
+ENCODING = 'utf-8'
+
+
+class Writer(object):
+    """ Base class of the writers, the `write` method has to be
+    implemented by each format.
+    """
+    def __init__(self, stream):
+        """
+        :param stream: file object where the datapoints are written.
+        """
+        self.stream = stream
+
+    @classmethod
+    def find(cls, format_):
+        """ Returns the Writer implementation for the format given """
+        try:
+            return next(c for c in cls.__subclasses__() if c.FORMAT == format_)
+        except StopIteration:
+            raise KeyError(format_)
+
+    def open(self):
+        pass
+
+    def write(self, target, datapoints):
+        """ Write the datapoints of one series, returns the last datapoint
+        written or None if the generator was empty.
+
+        :param target: str, name of the series.
+        :param datapoints: iterable of tuples (value, ts).
+        """
+        raise NotImplemented()
+
+    def close(self):
+        self.stream.flush()
+
+
+class NDJSONWriter(Writer):
+    FORMAT = NDJSON
+
+    def write(self, target, datapoints):
+        last = None
+        for last in datapoints:
+            self.stream.write(json.dumps({'target': target, 'ts': last[1], 'value': last[0]}))
+            self.stream.write("\n")
+        self.stream.flush()
+        return last
+
+
+class CSVWriter(Writer):
+    FORMAT = CSV
+
+    def open(self):
+        self._writer = csv.writer(self.stream)
+        self._writer.writerow(['target', 'ts', 'value'])
+
+    def write(self, target, datapoints):
+        if isinstance(target, unicode):
+            target = target.encode(ENCODING)
+
+        last = None
+        for last in datapoints:
+            self._writer.writerow([target, last[1], '' if last[0] is None else last[0]])
+        self.stream.flush()
+        return last
+
+
+class JSONWriter(Writer):
+    FORMAT = JSON
+
+    def open(self):
+        self._separator = "\n"
+        self.stream.write("[")
+
+    def write(self, target, datapoints):
+        last = None
+        for last in datapoints:
+            self.stream.write(self._separator)
+            self.stream.write(json.dumps({'target': target, 'ts': last[1], 'value': last[0]}))
+            self._separator = ",\n"
+        self.stream.flush()
+        return last
+
+    def close(self):
+        self.stream.write("\n]\n")
+        super(JSONWriter, self).close()
+
+
+def newer(datapoints, ts):
+    """ Returns a generator of the datapoints whose timestamp is greater than
+    the one given, all of them if it is None.
+
+    :param datapoints: iterable of tuples (value, ts).
+    :param ts: int or None.
+    """
+    if ts is None:
+        return iter(datapoints)
+    return (datapoint for datapoint in datapoints if datapoint[1] > ts)
+
+
+def tail(datapoints, buffer_):
+    """ Returns a generator of the datapoints given that keeps the last ones
+    consumed into the buffer given, usually a deque with a maxlen.
+
+    :param datapoints: iterable of tuples (value, ts).
+    :param buffer_: collections.deque
+    """
+    for datapoint in datapoints:
+        buffer_.append(datapoint)
+        yield datapoint
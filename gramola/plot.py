@@ -12,7 +12,7 @@ like the following one:
 |***   ********************   *****  ******
 |*******************************************
 +---+---+---+---+---+---+---+---+---+--+---+
-min=1, max=34, last=2
+min=1, max=34, last=2, mean=12.5, stddev=9.3, p50=11, p95=31, p99=34
 
 The plot is rendred using 10 rows, it means that all datapoints that have to be displayed
 will be scaled until they fit between the range [0, 10]. By default the Plot uses the
@@ -32,6 +32,15 @@ values:
 
     datapoints displayed = 1, 3, 4, 7, 2, 1
 
+Aside of the default `ascii` mode the Plot can be rendered using the `blocks` mode, where
+each cell uses the eighth block characters getting 8 vertical levels per row, or the
+`braille` mode where each cell uses a braille glyph getting 4 vertical levels per row and
+two datapoints per column. The glyphs are taken from the lookup tables built when the module
+is loaded.
+
+The footer shows the statistics of all datapoints drawn by the plot along the session, not
+only the ones that fit into the screen, see :mod:gramola.stats.
+
 :moduleauthor: Pau Freixes, pfreixes@gmail.com
 """
 import os
@@ -39,45 +48,154 @@ import sys
 
 from itertools import dropwhile
 
+from gramola.stats import SessionStats
+
 DEFAULT_ROWS = 8
 
+# Rendering modes supported by the Plot. The `ascii` mode uses one `*` per
+# cell, the `blocks` mode uses the eighth block characters getting 8 levels
+# per cell and the `braille` mode uses the braille glyphs getting 4 levels
+# per cell and two datapoints per column.
+ASCII = 'ascii'
+BLOCKS = 'blocks'
+BRAILLE = 'braille'
+MODES = (ASCII, BLOCKS, BRAILLE)
+DEFAULT_MODE = ASCII
+
+# Number of vertical levels that each mode can render using one cell
+LEVELS_PER_ROW = {ASCII: 1, BLOCKS: 8, BRAILLE: 4}
+
+# Number of datapoints that each mode can render using one column
+DATAPOINTS_PER_COLUMN = {ASCII: 1, BLOCKS: 1, BRAILLE: 2}
+
+# Glyph for a cell filled from the bottom with N eighths, from 0 to 8.
+BLOCK_GLYPHS = [u' '] + [unichr(c) for c in range(0x2581, 0x2589)]
+
+# Braille dots filled from the bottom of each column of the cell, the left
+# column uses the dots 7, 3, 2, 1 and the right column the dots 8, 6, 5, 4.
+_BRAILLE_LEFT = (0x00, 0x40, 0x44, 0x46, 0x47)
+_BRAILLE_RIGHT = (0x00, 0x80, 0xA0, 0xB0, 0xB8)
+
+# Glyph for a cell with N dots at the left column and M dots at the right
+# column, BRAILLE_GLYPHS[N][M] with N and M from 0 to 4.
+BRAILLE_GLYPHS = [[unichr(0x2800 | left | right) for right in _BRAILLE_RIGHT]
+                  for left in _BRAILLE_LEFT]
+
+ENCODING = 'utf-8'
+
+# maxium frames per second drawn when the datapoints are pushed by a live datasource
+MAX_FPS = 10
+
+# prefix of the footer when the datapoints rendered are the last good ones
+STALE_MARKER = "[stale] "
+
 
 class Plot(object):
 
-    def __init__(self, max_x=None, rows=DEFAULT_ROWS):
+    def __init__(self, max_x=None, rows=DEFAULT_ROWS, mode=DEFAULT_MODE, width=None):
+        """
+        :param max_x: int, the maxium value expected, default None.
+        :param rows: int, number of rows used to render the datapoints.
+        :param mode: str, one of the MODES values.
+        :param width: int, use a fixed number of columns instead of the
+                      whole width of the terminal, default None.
+        """
+        if mode not in MODES:
+            raise ValueError("Invalid plot mode {}, use one of {}".format(mode, MODES))
         self.rows = rows
         self.max_x = max_x
+        self.mode = mode
+        self._width = width
+        self.stats = SessionStats()
         self.__drawn = False
 
     def width(self):
+        if self._width:
+            return self._width
+
         width, _ = getTerminalSize()
 
         # the plot needs the first column
         return (width - 1)
 
-    def draw(self, datapoints):
+    def height(self):
+        """ Returns the number of lines used to render the plot """
+        return self.rows + 2
+
+    def maxdatapoints(self):
+        """ Returns the maxium number of datapoints that can be rendered
+        by the plot, it depends on the width and the mode used.
+        """
+        return self.width() * DATAPOINTS_PER_COLUMN[self.mode]
+
+    def draw(self, datapoints, stale=False):
         """ Render using the the datapoints given as a parameters, Gramola
-        subministres a list of tuples (value,ts).
+        subministres a list of tuples (value,ts). When stale is True the
+        datapoints are the last good ones and the footer is marked.
+
+        The whole plot is built in memory and written using just one call.
         """
-        if len(datapoints) > self.width():
-            raise Exception("Given to many datapoints {}, doesnt fit into screen of {}".format(len(datapoints), self.width()))
+        lines = self.render(datapoints, stale=stale)
 
+        buffer_ = []
         if self.__drawn:
             # remove the two lines used to render the plot by the
             # the previous call to refresh the plot using the
             # same console space
-            for i in range(0, self.rows+2):
-                sys.stdout.write("\033[K")   # remove line
-                sys.stdout.write("\033[1A")  # up the cursor
+            for i in range(0, self.height()):
+                buffer_.append("\033[K")   # remove line
+                buffer_.append("\033[1A")  # up the cursor
+
+        for line in lines:
+            buffer_.append(line)
+            buffer_.append("\n")
 
+        write("".join(buffer_))
+        self.__drawn = True
+
+    def render(self, datapoints, stale=False):
+        """ Render the datapoints given as a parameter returning the list of
+        lines, without the line breaks, that make up the plot.
+
+        :param datapoints: list of tuples (value, ts).
+        :param stale: bool, the datapoints could not be refreshed.
+        :rtype: list.
+        """
+        if len(datapoints) > self.maxdatapoints():
+            raise Exception("Given to many datapoints {}, doesnt fit into screen of {}".format(
+                len(datapoints), self.maxdatapoints()))
+
+        if self.mode == ASCII:
+            values, lines = self._render_ascii(datapoints)
+        else:
+            values, lines = self._render_highres(datapoints)
+
+        if self.width() / 4.0 == 0:
+            extra = ""
+        else:
+            extra = "-"*(self.width() % 4)
+
+        lines.append("+"+"---+"*(self.width()/4) + extra)
+
+        # the stats are fed with the datapoints not seen yet by the previous frames
+        self.stats.update(datapoints)
+        summary = self.stats.summary()
+        lines.append((STALE_MARKER if stale else "") +
+                     (summary if datapoints and summary else "no datapoints found ..."))
+
+        return lines
+
+    def _padding(self, values):
+        # padding the queue of the values with 0 to align
+        # the graphic with the right corner of the screen
+        if len(values) < self.maxdatapoints():
+            values = ([0]*(self.maxdatapoints() - len(values))) + values
+        return values
+
+    def _render_ascii(self, datapoints):
         if datapoints:
             # FIXME: nowadays Gramola supports only integer values
-            values = [int(value) for value, ts in datapoints]
-
-            if len(values) < self.width():
-                # padding the queue of the values with 0 to align
-                # the graphic with the right corner of the screen
-                values = ([0]*(self.width() - len(values))) + values
+            values = self._padding([int(value) for value, ts in datapoints])
 
             # find the right division value
             max_x = self.max_x or max(values)
@@ -85,32 +203,56 @@ class Plot(object):
                 # Edge case where all values are 0
                 divide_by = self.rows
             else:
-                divide_by = next(dropwhile(lambda i: max_x / i > self.rows, range(1, max_x)))
+                divide_by = next(dropwhile(lambda i: max_x / i > self.rows, range(1, max_x + 1)))
         else:
             values = [0]*self.width()
             divide_by = self.rows
 
+        lines = []
         for row in range(self.rows, 0, -1):
-            sys.stdout.write("|")
-            for v in values:
-                if v / divide_by >= row:
-                    sys.stdout.write("*")
-                else:
-                    sys.stdout.write(" ")
-            sys.stdout.write("\n")
+            lines.append("|" + "".join("*" if v / divide_by >= row else " " for v in values))
 
-        if self.width() / 4.0 == 0:
-            extra = ""
-        else:
-            extra = "-"*(self.width() % 4)
+        return values, lines
 
-        sys.stdout.write("+"+"---+"*(self.width()/4) + extra + "\n")
-        if datapoints:
-            sys.stdout.write("min={}, max={}, last={}\n".format(min(values), max(values), values[-1]))
+    def _render_highres(self, datapoints):
+        values = self._padding([value for value, ts in datapoints])
+
+        # Scale the values to the amount of levels available, each row
+        # renders LEVELS_PER_ROW levels using one glyph.
+        per_row = LEVELS_PER_ROW[self.mode]
+        total = self.rows * per_row
+        max_x = self.max_x or max(values) or 1
+        levels = [max(0, min(total, int(round(v * total / float(max_x))))) for v in values]
+
+        if self.mode == BRAILLE:
+            # each column renders two consecutive datapoints
+            columns = zip(levels[0::2], levels[1::2])
         else:
-            sys.stdout.write("no datapoints found ...\n")
-        sys.stdout.flush()
-        self.__drawn = True
+            columns = levels
+
+        lines = []
+        for row in range(self.rows - 1, -1, -1):
+            base = row * per_row
+            if self.mode == BRAILLE:
+                glyphs = (BRAILLE_GLYPHS[max(0, min(per_row, left - base))]
+                                        [max(0, min(per_row, right - base))]
+                          for left, right in columns)
+            else:
+                glyphs = (BLOCK_GLYPHS[max(0, min(per_row, level - base))] for level in columns)
+            lines.append(u"|" + u"".join(glyphs))
+
+        return values, lines
+
+
+def write(frame):
+    """ Write a frame to the stdout using just one call, unicode frames
+    are encoded before.
+    """
+    if isinstance(frame, unicode):
+        frame = frame.encode(ENCODING)
+
+    sys.stdout.write(frame)
+    sys.stdout.flush()
 
 
 # Code get from the console module
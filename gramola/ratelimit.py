@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the rate limiter used to keep the requests sent to a paid or
+throttled API, such as CloudWatch, under a budget. The limiter is a token
+bucket, each call takes one token and the bucket is refilled at the rate
+configured, calls that do not find a token wait until the next one arrives.
+
+Limiters are shared by key, i.e the pair (profile, region), between all
+threads of the process. When they are built with a directory the state of
+the bucket is kept in a small file locked by each call, so all Gramola
+processes running at once share the same budget.
+
+When the API throttles a call the rate is halved, until the minimum rate,
+and each call that succeeds increases it again until the rate configured.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import os
+import re
+import json
+import fcntl
+import threading
+
+from contextlib import contextmanager
+from time import time, sleep
+
+from gramola import log
+
+# calls per second allowed by default
+DEFAULT_RATE = 10
+
+# minimum rate used when the API keeps throttling
+MIN_RATE = 0.5
+
+RATELIMIT_DIRNAME = "ratelimit"
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate=DEFAULT_RATE, burst=None, filepath=None, min_rate=MIN_RATE):
+        """
+        :param rate: float, tokens added to the bucket per second.
+        :param burst: int, maxium tokens kept by the bucket, default the rate.
+        :param filepath: str, file used to share the bucket with other processes.
+        :param min_rate: float, minimum rate when the calls are throttled.
+        """
+        self.max_rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.burst = burst or max(1, int(rate))
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        self._state = {'tokens': self.burst, 'updated': None, 'rate': self.max_rate}
+
+        # total of calls and seconds queued by this process, see `report`
+        self.calls = 0
+        self.waited = 0.0
+
+    @classmethod
+    def shared(cls, key, rate=DEFAULT_RATE, directory=None):
+        """ Returns the limiter of the key given, the same instance is returned
+        to all callers of the process.
+
+        :param key: tuple of str, i.e (profile, region).
+        :param directory: str, directory used to share the limiter with other processes.
+        """
+        with _limiters_lock:
+            if key not in _limiters:
+                filepath = None
+                if directory:
+                    name = re.sub(r"[^\w.-]", "_", "-".join(str(k or "default") for k in key))
+                    filepath = os.path.join(directory, name + ".json")
+                _limiters[key] = cls(rate=rate, filepath=filepath)
+            return _limiters[key]
+
+    def acquire(self):
+        """ Take one token, waiting until it is available. Returns the seconds
+        waited.
+        """
+        started = time()
+        while True:
+            wait = self._take(time())
+            if wait <= 0:
+                break
+            sleep(wait)
+
+        waited = time() - started
+        with self._lock:
+            self.calls += 1
+            self.waited += waited
+        return waited
+
+    def throttled(self):
+        """ The last call has been throttled, halve the rate """
+        with self._update() as state:
+            state['rate'] = max(self.min_rate, state['rate'] / 2)
+            state['tokens'] = min(state['tokens'], 0)
+            log.debug("Throttled, rate decreased to {:.2f} calls/s".format(state['rate']))
+
+    def succeeded(self):
+        """ The last call succeeded, increase the rate until the maxium one """
+        with self._update() as state:
+            state['rate'] = min(self.max_rate, state['rate'] + self.min_rate / 10)
+
+    def _take(self, now):
+        # returns 0 if a token has been taken, otherwise the seconds to wait
+        with self._update() as state:
+            if state['updated'] is not None:
+                elapsed = max(0, now - state['updated'])
+                state['tokens'] = min(self.burst, state['tokens'] + elapsed * state['rate'])
+            state['updated'] = now
+
+            if state['tokens'] >= 1:
+                state['tokens'] -= 1
+                return 0
+            return (1 - state['tokens']) / state['rate']
+
+    @contextmanager
+    def _update(self):
+        # gives the state locked, it is read from and written to the
+        # file when the limiter is shared with other processes.
+        with self._lock:
+            try:
+                fd = open(self.filepath, "a+") if self.filepath else None
+            except IOError, e:
+                log.debug("Rate limiter file can not be opened: {}".format(e))
+                fd = None
+
+            if fd is None:
+                yield self._state
+                return
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                fd.seek(0)
+                try:
+                    self._state.update(json.loads(fd.read() or "{}"))
+                except ValueError:
+                    pass
+
+                yield self._state
+
+                fd.seek(0)
+                fd.truncate()
+                json.dump(self._state, fd)
+            finally:
+                fd.close()
+
+
+def report():
+    """ Returns the list of tuples (key, calls, waited) of the limiters used by
+    the process, with the total of calls and the seconds that they were queued.
+    """
+    with _limiters_lock:
+        limiters = sorted(_limiters.items())
+    return [(key, limiter.calls, limiter.waited) for key, limiter in limiters if limiter.calls]
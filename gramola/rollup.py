@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the pyramid of rollups used to zoom and pan over a query without
+fetching again the datapoints already seen. The raw series returned by the
+datasource are kept as buckets of min, max, sum and count at resolutions of
+power of two seconds, level 0 uses buckets of 1 second, level 1 of 2 seconds,
+and so on. Each level is built from the finer one, so once a time range has
+been fetched at one resolution all coarser ones are available as well.
+
+A query reads the finest level whose buckets are at least as wide as the
+seconds covered by each column of the plot, so the time range fits into the
+plot. Only the segments of the time range that are not covered yet by that
+level are fetched, for example zooming out from the last hour to the last day
+fetches the 23 hours not seen. Zooming in is served without any request only
+when the finer level has been fetched before.
+
+As the cache does, see :mod:gramola.cache, the segments that finished less
+than the TTL before they were fetched are not marked as covered, the recent
+datapoints might still change and they are fetched again.
+
+Pyramids are saved under the Store directory, one file for each datasource
+configuration and query without its time range and transform.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import os
+import json
+import hashlib
+
+from array import array
+from time import time
+
+from gramola import log
+from gramola.utils import TimeRange
+from gramola.cache import DEFAULT_TTL, fetch_series
+from gramola.transforms import Series
+
+ROLLUP_DIRNAME = "rollup"
+
+# maxium level, buckets of 2^MAX_LEVEL seconds
+MAX_LEVEL = 30
+
+# maxium number of buckets kept by each series and level, the oldest ones are evicted
+MAX_BUCKETS = 4096
+
+# index of each aggregate within a bucket
+MIN, MAX, SUM, COUNT = range(4)
+
+AGGREGATES = ('avg', 'min', 'max', 'sum', 'count')
+
+
+def pyramid_key(configuration, query):
+    """ Returns the key of the pyramid of a query, its time range and its
+    transform are not part of the key.
+
+    :param configuration: :class:gramola.datasources.base.DataSourceConfig
+    :param query: :class:gramola.datasources.base.MetricQuery
+    :rtype: str
+    """
+    params = query.dict()
+    for name in ('since', 'until', 'transform'):
+        params.pop(name, None)
+    key = json.dumps([configuration.dict(), params], sort_keys=True)
+    return hashlib.sha1(key).hexdigest()
+
+
+def cover(intervals, since, until):
+    """ Returns a new sorted list of intervals (since, until) adding the one given,
+    the overlapping and contiguous intervals are merged.
+    """
+    merged = []
+    for a, b in sorted(intervals + [(since, until)]):
+        if merged and a <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+        else:
+            merged.append((a, b))
+    return merged
+
+
+def gaps(intervals, since, until):
+    """ Returns the list of :class:gramola.utils.TimeRange between since and
+    until that are not covered by the sorted intervals given.
+    """
+    missing = []
+    for a, b in intervals:
+        if b <= since:
+            continue
+        elif a >= until:
+            break
+        if a > since:
+            missing.append(TimeRange(since, a))
+        since = max(since, b)
+    if since < until:
+        missing.append(TimeRange(since, until))
+    return missing
+
+
+class Pyramid(object):
+
+    def __init__(self, filepath=None, ttl=DEFAULT_TTL, max_buckets=MAX_BUCKETS):
+        """
+        :param filepath: str, file used to save the pyramid, default None keeps
+                         it only in memory.
+        :param ttl: int, seconds that the recent datapoints might change.
+        :param max_buckets: int, maxium number of buckets kept by each series and level.
+        """
+        self.filepath = filepath
+        self.ttl = ttl
+        self.max_buckets = max_buckets
+
+        # names of the series following the order they were seen
+        self.names = []
+
+        # level -> {'covered': [(since, until), ..], 'buckets': {name: {ts: bucket}}}
+        self.levels = {}
+
+    @classmethod
+    def from_store(cls, store, configuration, query, ttl=DEFAULT_TTL):
+        """ Returns the pyramid of the query saved under the store directory """
+        filepath = os.path.join(store.directory(ROLLUP_DIRNAME),
+                                pyramid_key(configuration, query) + ".json")
+        pyramid = cls(filepath=filepath, ttl=ttl)
+        pyramid.load()
+        return pyramid
+
+    def load(self):
+        try:
+            with open(self.filepath) as fd:
+                saved = json.load(fd)
+        except (IOError, ValueError):
+            return
+
+        self.names = saved['names']
+        self.levels = {
+            int(level): {
+                'covered': [tuple(interval) for interval in values['covered']],
+                'buckets': {name: {int(ts): bucket for ts, bucket in buckets.iteritems()}
+                            for name, buckets in values['buckets'].iteritems()}}
+            for level, values in saved['levels'].iteritems()}
+
+    def save(self):
+        if not self.filepath:
+            return
+
+        tmp = self.filepath + ".tmp"
+        try:
+            with open(tmp, "w") as fd:
+                json.dump({'names': self.names, 'levels': self.levels}, fd)
+            os.rename(tmp, self.filepath)
+        except IOError, e:
+            log.warning("Rollups can not be saved: {}".format(e))
+
+    @staticmethod
+    def level(seconds):
+        """ Returns the finest level whose buckets are at least as wide as the
+        seconds given, at most `MAX_LEVEL`.
+        """
+        level = 0
+        while level < MAX_LEVEL and 2 ** level < seconds:
+            level += 1
+        return level
+
+    def missing(self, level, time_range, now=None):
+        """ Returns the list of :class:gramola.utils.TimeRange of the time range
+        that are not covered by the level, aligned to its buckets but never
+        beyond now.
+        """
+        width = 2 ** level
+        since = time_range.since - time_range.since % width
+        until = min(time_range.until + (-time_range.until) % width, int(now or time()))
+        covered = self.levels.get(level, {}).get('covered', [])
+        return gaps(covered, since, until)
+
+    def insert(self, level, series, segment, now=None):
+        """ Replace the buckets of the segment of the level given using the raw
+        series fetched, afterwards the coarser levels are rebuilt.
+
+        :param level: int
+        :param series: list of :class:gramola.transforms.Series
+        :param segment: :class:gramola.utils.TimeRange, aligned to the buckets of the level,
+                        the last one might end at the current time.
+        """
+        now = now or time()
+        width = 2 ** level
+        buckets = self._replace(level, segment.since, segment.until)
+        for s in series:
+            if s.name not in self.names:
+                self.names.append(s.name)
+            by_ts = buckets.setdefault(s.name, {})
+            for value, ts in zip(s.values, s.timestamps):
+                if value != value or not segment.since <= ts < segment.until:
+                    continue
+                ts = int(ts) - int(ts) % width
+                bucket = by_ts.get(ts)
+                if bucket is None:
+                    by_ts[ts] = [value, value, value, 1]
+                else:
+                    bucket[MIN] = min(bucket[MIN], value)
+                    bucket[MAX] = max(bucket[MAX], value)
+                    bucket[SUM] += value
+                    bucket[COUNT] += 1
+
+        # the recent datapoints might change, they are not covered
+        settled = min(segment.until, now - self.ttl)
+        self._cover(level, segment.since, settled)
+
+        # the coarser buckets that fall within the segment are rebuilt
+        # from the level below, that has just been rebuilt as well.
+        coarser = level + 1
+        while coarser <= MAX_LEVEL and 2 ** coarser <= segment.seconds:
+            width = 2 ** coarser
+            since = segment.since + (-segment.since) % width
+            until = segment.until - segment.until % width
+            if since >= until:
+                break
+
+            source = self.levels[coarser - 1]['buckets']
+            buckets = self._replace(coarser, since, until)
+            for name, by_ts in source.iteritems():
+                coarse = buckets.setdefault(name, {})
+                for ts, bucket in by_ts.iteritems():
+                    if not since <= ts < until:
+                        continue
+                    ts -= ts % width
+                    if ts not in coarse:
+                        coarse[ts] = list(bucket)
+                    else:
+                        coarse[ts][MIN] = min(coarse[ts][MIN], bucket[MIN])
+                        coarse[ts][MAX] = max(coarse[ts][MAX], bucket[MAX])
+                        coarse[ts][SUM] += bucket[SUM]
+                        coarse[ts][COUNT] += bucket[COUNT]
+
+            self._cover(coarser, since, min(until, settled))
+            coarser += 1
+
+        for level in self.levels:
+            self._evict(level)
+
+    def series(self, level, time_range, aggregate='avg'):
+        """ Returns the list of :class:gramola.transforms.Series of the level
+        within the time range, one datapoint for each bucket using the
+        aggregate given, one of `AGGREGATES`. The bucket that starts before
+        the time range is left out.
+        """
+        width = 2 ** level
+        since = time_range.since + (-time_range.since) % width
+        buckets = self.levels.get(level, {}).get('buckets', {})
+        series = []
+        for name in self.names:
+            by_ts = buckets.get(name, {})
+            timestamps = sorted(ts for ts in by_ts if since <= ts < time_range.until)
+            if not timestamps:
+                continue
+
+            if aggregate == 'avg':
+                values = [by_ts[ts][SUM] / by_ts[ts][COUNT] for ts in timestamps]
+            else:
+                idx = AGGREGATES.index(aggregate) - 1
+                values = [by_ts[ts][idx] for ts in timestamps]
+            series.append(Series(name, array('d', values), array('d', timestamps)))
+        return series
+
+    def _replace(self, level, since, until):
+        # removes the buckets of the level between since and until, returns
+        # the buckets of the level by series name.
+        buckets = self.levels.setdefault(level, {'covered': [], 'buckets': {}})['buckets']
+        for by_ts in buckets.itervalues():
+            for ts in [ts for ts in by_ts if since <= ts < until]:
+                del by_ts[ts]
+        return buckets
+
+    def _cover(self, level, since, until):
+        width = 2 ** level
+        until -= until % width
+        if since < until:
+            values = self.levels[level]
+            values['covered'] = cover(values['covered'], since, until)
+
+    def _evict(self, level):
+        values = self.levels[level]
+        cutoff = None
+        for by_ts in values['buckets'].itervalues():
+            if len(by_ts) <= self.max_buckets:
+                continue
+            timestamps = sorted(by_ts)[:len(by_ts) - self.max_buckets]
+            for ts in timestamps:
+                del by_ts[ts]
+            cutoff = max(cutoff, timestamps[-1] + 2 ** level)
+
+        if cutoff is not None:
+            # the evicted buckets have to be fetched again
+            values['covered'] = [(max(a, cutoff), b) for a, b in values['covered'] if b > cutoff]
+
+
+def fetch_rollup(datasource, query, maxdatapoints, pyramid, now=None):
+    """ Returns the list of raw :class:gramola.transforms.Series of a resolved
+    query using the level of the pyramid that fits with the maxdatapoints, only
+    the segments not covered by that level are fetched from the datasource.
+    """
+    time_range = query.time_range()
+    level = pyramid.level(time_range.seconds / float(maxdatapoints or time_range.seconds or 1))
+    width = 2 ** level
+
+    fetched = False
+    for segment in pyramid.missing(level, time_range, now=now):
+        # twice the buckets, so the step used by the backend is never wider than them
+        series = fetch_series(datasource, query.with_time_range(segment),
+                              maxdatapoints=max(1, 2 * segment.seconds / width), now=now)
+
+        # empty results are usually errors, they are not covered
+        if series:
+            pyramid.insert(level, series, segment, now=now)
+            fetched = True
+
+    if fetched:
+        pyramid.save()
+    return pyramid.series(level, time_range)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the scheduler used by the refresh mode to decide when each series
+has to be fetched again. Time series databases store the datapoints using
+buckets of a fixed step, fetching a series before a new bucket is closed just
+returns the same datapoints, therefore the scheduler learns the step of each
+series and schedules the next fetch just after the next bucket is expected to
+be closed.
+
+The step is learnt from the timestamps of the datapoints returned or it can be
+given by the datasource, for example the CloudWatch period. When a fetch does
+not return new datapoints the next one is delayed using an exponential backoff.
+Series without a known step are fetched using the default interval.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import heapq
+
+from time import time, sleep
+
+DEFAULT_INTERVAL = 10
+
+# seconds used to align the time range of the series whose step is unknown yet,
+# so the queries run at close times share the same time range.
+DEFAULT_STEP = 60
+
+# seconds waited after a bucket is expected to be closed
+DEFAULT_GRACE = 2
+
+# maxium times the step is multiplied when no new datapoints arrive
+MAX_BACKOFF = 8
+
+
+def learn_step(datapoints):
+    """ Returns the step of the datapoints given as the minimum distance
+    between two consecutive timestamps, or None if it can not be learnt.
+
+    :param datapoints: list of tuples (value, ts).
+    :rtype: int or None
+    """
+    steps = [b[1] - a[1] for a, b in zip(datapoints, datapoints[1:]) if b[1] > a[1]]
+    return int(min(steps)) if steps else None
+
+
+class Schedule(object):
+    """ State of one series handled by the scheduler """
+    def __init__(self, step=None):
+        self.step = step
+        self.last_ts = None
+        self.misses = 0
+
+
+class Scheduler(object):
+
+    def __init__(self, keys, interval=DEFAULT_INTERVAL, grace=DEFAULT_GRACE,
+                 max_backoff=MAX_BACKOFF):
+        """
+        :param keys: list of hashable values identifying each series.
+        :param interval: int, seconds between fetches for series with unknown step,
+                         also the minimum time between two fetches of the same series.
+        :param grace: int, seconds waited after a bucket is expected to be closed.
+        :param max_backoff: int, maxium multiplier of the step used by the backoff.
+        """
+        self.interval = interval
+        self.grace = grace
+        self.max_backoff = max_backoff
+        self.schedules = {key: Schedule() for key in keys}
+
+        # heap of (due time, key), all series are due at the beginning
+        self._heap = [(0, key) for key in keys]
+        heapq.heapify(self._heap)
+
+    def update(self, key, datapoints, step=None, now=None):
+        """ Schedule the next fetch of the series using the datapoints returned by
+        the last fetch, returns the time when the series is due.
+
+        :param key: the series identifier.
+        :param datapoints: list of tuples (value, ts) returned by the last fetch.
+        :param step: int, the step of the series if it is known by the datasource.
+        :param now: float, current time.
+        :rtype: float
+        """
+        now = now or time()
+        schedule = self.schedules[key]
+        schedule.step = step or learn_step(datapoints) or schedule.step
+
+        last_ts = datapoints[-1][1] if datapoints else None
+        if last_ts is not None and (schedule.last_ts is None or last_ts > schedule.last_ts):
+            schedule.last_ts = last_ts
+            schedule.misses = 0
+        else:
+            schedule.misses += 1
+
+        if not schedule.step:
+            due = now + self.interval
+        elif schedule.misses == 0:
+            # the bucket that follows the last one is closed one step later
+            due = schedule.last_ts + 2 * schedule.step + self.grace
+            if due <= now:
+                # the series is lagging behind, wait for one step
+                due = now + schedule.step
+        else:
+            due = now + schedule.step * min(2 ** (schedule.misses - 1), self.max_backoff)
+
+        due = max(due, now + min(self.interval, schedule.step or self.interval))
+        heapq.heappush(self._heap, (due, key))
+        return due
+
+    def step(self, key):
+        """ Returns the step learnt for the series, None if it is unknown """
+        return self.schedules[key].step
+
+    def wake(self):
+        """ Make all series due at once forgetting their last datapoints, i.e
+        the time range of the queries has changed. The steps learnt are kept.
+        """
+        for schedule in self.schedules.itervalues():
+            schedule.last_ts = None
+            schedule.misses = 0
+        self._heap = [(0, key) for key in self.schedules]
+        heapq.heapify(self._heap)
+
+    def next_due(self):
+        """ Returns the time when the next series is due """
+        return self._heap[0][0]
+
+    def wait(self, now=None):
+        """ Sleep until the next series is due and returns the list of keys of
+        all series due, they have to be updated once they are fetched.
+
+        :rtype: list
+        """
+        now = now or time()
+        if self._heap[0][0] > now:
+            sleep(self._heap[0][0] - now)
+            now = self._heap[0][0]
+
+        keys = []
+        while self._heap and self._heap[0][0] <= now:
+            keys.append(heapq.heappop(self._heap)[1])
+        return keys
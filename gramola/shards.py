@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the sharding of the long time ranges. Backends limit the datapoints
+returned by one request, i.e CloudWatch returns at most 1440 datapoints, or get
+slow when a request returns too many of them. The datasources tell the longest
+time range that one request can fetch and the longer ones are split into shards
+fetched concurrently, and afterwards stitched back into one series.
+
+Shards are aligned to multiples of their length since the epoch, so when the
+time range moves forward only the first and the last shards change. The other
+ones keep the same time range and, once they belong to the closed history, they
+are read from the cache without fetching them again.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from gramola.utils import TimeRange
+from gramola.transforms import Series
+
+# shards fetched at once
+MAX_WORKERS = 4
+
+
+def split(time_range, seconds):
+    """ Split the time range into shards of at most the seconds given, aligned
+    to multiples of the seconds since the epoch.
+
+    :param time_range: :class:gramola.utils.TimeRange
+    :param seconds: int, maxium length of each shard.
+    :rtype: list of :class:gramola.utils.TimeRange
+    """
+    shards = []
+    since = time_range.since
+    while since < time_range.until:
+        until = min(since - since % seconds + seconds, time_range.until)
+        shards.append(TimeRange(since, until))
+        since = until
+    return shards or [time_range]
+
+
+def shard_queries(datasource, query, maxdatapoints=None):
+    """ Returns the list of tuples (query, maxdatapoints) of the shards of a resolved
+    query, or None when the datasource can fetch the query using one request.
+
+    The step is worked out once for the whole query, when the datasource knows it,
+    and the shards are aligned to it. The maxdatapoints of each shard is its number
+    of steps, so all shards use the same step than the whole query, even the recent
+    ones that alone would get a finer one.
+    """
+    seconds = datasource.max_seconds_per_request(query, maxdatapoints=maxdatapoints)
+    time_range = query.time_range()
+    if not seconds or time_range.seconds <= seconds:
+        return None
+
+    step = datasource.step(query, maxdatapoints=maxdatapoints)
+    if not step:
+        return [(query.with_time_range(shard), maxdatapoints)
+                for shard in split(time_range, seconds)]
+
+    # shards made of whole steps, at most the ones fetched by one request
+    seconds = max(step, seconds - seconds % step)
+    time_range = TimeRange(time_range.since - time_range.since % step,
+                           time_range.until + (-time_range.until) % step)
+    return [(query.with_time_range(shard), shard.seconds / step)
+            for shard in split(time_range, seconds)]
+
+
+def fetch_shards(fetch, shards, max_workers=MAX_WORKERS):
+    """ Call fetch(query, maxdatapoints) for each shard concurrently, returns
+    the results following the order of the shards.
+    """
+    if len(shards) == 1:
+        return [fetch(*shards[0])]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(shards))) as executor:
+        return list(executor.map(lambda shard: fetch(*shard), shards))
+
+
+def stitch(shards_series):
+    """ Stitch the series returned by each shard into one list of series, the
+    series with the same name are joined sorting their datapoints. Timestamps
+    repeated at the boundaries of the shards are kept once, preferring the
+    value available.
+
+    :param shards_series: list of list of :class:gramola.transforms.Series
+    :rtype: list of :class:gramola.transforms.Series
+    """
+    names = []
+    points = {}
+    for series in shards_series:
+        for s in series:
+            if s.name not in points:
+                names.append(s.name)
+                points[s.name] = {}
+            by_ts = points[s.name]
+            for value, ts in zip(s.values, s.timestamps):
+                if ts not in by_ts or by_ts[ts] != by_ts[ts]:
+                    by_ts[ts] = value
+
+    stitched = []
+    for name in names:
+        timestamps = sorted(points[name])
+        stitched.append(Series(name, array('d', [points[name][ts] for ts in timestamps]),
+                               array('d', timestamps)))
+    return stitched
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the snapshots of the last raw series rendered by each query, used to
+paint the plot as soon as the command starts. The snapshot is rendered marked as
+stale while the query is fetched, and once the fresh series arrive they are
+merged with the older datapoints of the snapshot that they do not cover.
+
+Snapshots are saved under the Store directory when the command finishes, one
+file for each datasource configuration and query without its time range and
+transform. The datapoints are kept as the raw bytes of the arrays of doubles of
+the series, encoded with base64.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import os
+import json
+import base64
+
+from array import array
+from time import time
+
+from gramola import log
+from gramola.rollup import pyramid_key
+from gramola.shards import stitch
+from gramola.transforms import Series
+
+SNAPSHOT_DIRNAME = "snapshot"
+
+# seconds after which a snapshot is too old to be rendered
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+
+def _encode(values):
+    return base64.b64encode(values.tostring())
+
+
+def _decode(buffer_):
+    values = array('d')
+    values.fromstring(base64.b64decode(buffer_))
+    return values
+
+
+class Snapshot(object):
+
+    def __init__(self, filepath, max_age=DEFAULT_MAX_AGE):
+        """
+        :param filepath: str, file used to save the snapshot.
+        :param max_age: int, seconds after which the snapshot is not loaded.
+        """
+        self.filepath = filepath
+        self.max_age = max_age
+
+        # last raw series, list of :class:gramola.transforms.Series or None
+        self.series = None
+        self._changed = False
+
+    @classmethod
+    def from_store(cls, store, configuration, query, max_age=DEFAULT_MAX_AGE):
+        """ Returns the snapshot of the query saved under the store directory """
+        filepath = os.path.join(store.directory(SNAPSHOT_DIRNAME),
+                                pyramid_key(configuration, query) + ".json")
+        snapshot = cls(filepath, max_age=max_age)
+        snapshot.load()
+        return snapshot
+
+    def load(self, now=None):
+        now = now or time()
+        try:
+            with open(self.filepath) as fd:
+                saved = json.load(fd)
+            if saved['saved'] + self.max_age <= now:
+                return
+            self.series = [Series(name, _decode(values), _decode(timestamps))
+                           for name, values, timestamps in saved['series']]
+        except (IOError, ValueError, TypeError, KeyError):
+            return
+
+    def save(self, now=None):
+        """ Save the last series, only if they have changed since they were loaded """
+        if not self._changed or not self.series:
+            return
+
+        saved = {
+            'saved': now or time(),
+            'series': [[s.name, _encode(s.values), _encode(s.timestamps)] for s in self.series]
+        }
+        tmp = self.filepath + ".tmp"
+        try:
+            with open(tmp, "w") as fd:
+                json.dump(saved, fd)
+            os.rename(tmp, self.filepath)
+        except IOError, e:
+            log.warning("Snapshot can not be saved: {}".format(e))
+            return
+        self._changed = False
+
+    def merge(self, series, time_range):
+        """ Returns the fresh series merged with the datapoints of the snapshot
+        within the time range that are older than the first fresh ones, the
+        result is kept as the last series. Empty results are usually errors,
+        they are returned as they are.
+
+        :param series: list of :class:gramola.transforms.Series
+        :param time_range: :class:gramola.utils.TimeRange
+        :rtype: list of :class:gramola.transforms.Series
+        """
+        if not series:
+            return series
+
+        older = {s.name: s for s in self.series or []}
+        merged = []
+        for s in series:
+            first = s.timestamps[0] if len(s.timestamps) else time_range.until
+            snapshot = older.get(s.name)
+            if snapshot is not None:
+                datapoints = [(v, ts) for v, ts in zip(snapshot.values, snapshot.timestamps)
+                              if time_range.since <= ts < first]
+                if datapoints:
+                    s = stitch([[s], [Series.from_datapoints(s.name, datapoints)]])[0]
+            merged.append(s)
+
+        self.series = merged
+        self._changed = True
+        return merged
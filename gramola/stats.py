@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the statistics shown by the footer of the plot. They are updated
+incrementally with the new datapoints got at each refresh, so they cover the
+whole session and not only the datapoints that fit into the screen, using a
+constant amount of memory no matter how long the session is.
+
+    RunningStats : count, min, max, mean and standard deviation, updated in
+                   O(1) for each value using the Welford's algorithm [1].
+    TDigest      : Quantile sketch [2] that keeps the values as a bounded list
+                   of centroids, accurate at the tails where the p95 or p99
+                   live. Two digests can be merged.
+
+Both of them can be merged, i.e. to combine the statistics of many series.
+
+[1] https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance
+[2] https://github.com/tdunning/t-digest/blob/master/docs/t-digest-paper/histo.pdf
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import math
+
+from bisect import insort
+
+NAN = float('nan')
+
+# percentiles shown by the footer
+PERCENTILES = (50, 95, 99)
+
+# bigger values keep more centroids getting more accurate quantiles
+DEFAULT_COMPRESSION = 100
+
+
+class RunningStats(object):
+    """ Count, min, max, mean and standard deviation of a stream of values """
+    __slots__ = ('count', 'min', 'max', 'mean', '_m2')
+
+    def __init__(self):
+        self.count = 0
+        self.min = NAN
+        self.max = NAN
+        self.mean = NAN
+        self._m2 = 0.0
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        if self.count == 1:
+            self.min = self.max = self.mean = value
+            return
+
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """ Add the values seen by other :class:RunningStats """
+        if not other.count:
+            return
+        elif not self.count:
+            self.count, self.min, self.max = other.count, other.min, other.max
+            self.mean, self._m2 = other.mean, other._m2
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count = count
+
+    def stddev(self):
+        """ Returns the population standard deviation, NaN without values """
+        if not self.count:
+            return NAN
+        return math.sqrt(self._m2 / self.count)
+
+
+class TDigest(object):
+    """ Merging t-digest, the values added are buffered and merged into the
+    centroids once the buffer is full. Each centroid is a tuple (mean, weight)
+    and its maxium weight depends on its quantile, being small at the tails.
+    """
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        """
+        :param compression: int, the number of centroids kept is proportional
+                            to this value.
+        """
+        self.compression = compression
+        self.centroids = []
+        self.count = 0
+        self.min = NAN
+        self.max = NAN
+        self._buffer = []
+        self._buffer_size = compression * 5
+
+    def add(self, value, weight=1):
+        value = float(value)
+        if not self.count:
+            self.min = self.max = value
+        else:
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+        self.count += weight
+        self._buffer.append((value, weight))
+        if len(self._buffer) >= self._buffer_size:
+            self._compress()
+
+    def merge(self, other):
+        """ Add the centroids of other :class:TDigest """
+        for mean, weight in other.centroids + other._buffer:
+            self.add(mean, weight)
+
+    def _compress(self):
+        if not self._buffer:
+            return
+
+        points = self.centroids
+        for point in self._buffer:
+            insort(points, point)
+        self._buffer = []
+
+        # each centroid spans at most one unit of the scale function
+        total = float(self.count)
+        centroids = []
+        mean, weight = points[0]
+        cumulative = 0
+        limit = self._limit(0)
+        for next_mean, next_weight in points[1:]:
+            if (cumulative + weight + next_weight) / total <= limit:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                centroids.append((mean, weight))
+                cumulative += weight
+                limit = self._limit(cumulative / total)
+                mean, weight = next_mean, next_weight
+        centroids.append((mean, weight))
+        self.centroids = centroids
+
+    def _limit(self, q):
+        # returns the maxium quantile that a centroid that starts at the quantile
+        # q can reach, using the scale function k(q) = d / 2pi * asin(2q - 1) that
+        # gets smaller centroids at the tails.
+        k = self.compression / (2 * math.pi) * math.asin(2 * q - 1) + 1
+        return (math.sin(min(math.pi / 2, k * 2 * math.pi / self.compression)) + 1) / 2
+
+    def quantile(self, q):
+        """ Returns the estimated value at the quantile q, between 0 and 1,
+        interpolating between the centers of the centroids. NaN without values.
+        """
+        self._compress()
+        if not self.centroids:
+            return NAN
+
+        target = q * self.count
+        cumulative = 0
+        previous = None
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2.0
+            if target < center:
+                if previous is None:
+                    return self.min
+                prev_mean, prev_center = previous
+                ratio = (target - prev_center) / (center - prev_center)
+                return prev_mean + (mean - prev_mean) * ratio
+            previous = (mean, center)
+            cumulative += weight
+
+        return self.max
+
+    def percentile(self, n):
+        """ Returns the estimated n percentile, between 0 and 100 """
+        return self.quantile(n / 100.0)
+
+
+class SessionStats(object):
+    """ Statistics of the datapoints of a series drawn along the session, the
+    datapoints given at each refresh that are not newer than the last one seen
+    are skipped, so the same datapoints can be given many times.
+    """
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.stats = RunningStats()
+        self.digest = TDigest(compression=compression)
+        self.last = None
+        self._last_ts = None
+
+    def update(self, datapoints):
+        """ Feed the stats with a list of tuples (value, ts), the None values are
+        skipped. Returns the number of values added.
+        """
+        added = 0
+        for value, ts in datapoints:
+            if self._last_ts is not None and ts <= self._last_ts:
+                continue
+            if value is not None:
+                self.stats.add(value)
+                self.digest.add(value)
+                self.last = value
+                added += 1
+
+        if datapoints:
+            self._last_ts = max(self._last_ts, max(ts for _, ts in datapoints))
+        return added
+
+    def summary(self):
+        """ Returns the line with the stats, None if no values have been seen """
+        if not self.stats.count:
+            return None
+
+        fields = [("min", self.stats.min), ("max", self.stats.max), ("last", self.last),
+                  ("mean", self.stats.mean), ("stddev", self.stats.stddev())]
+        fields += [("p{}".format(n), self.digest.percentile(n)) for n in PERCENTILES]
+        return ", ".join("{}={}".format(name, format_value(value)) for name, value in fields)
+
+
+def format_value(value):
+    """ Returns a short representation of a value, integers without decimals """
+    if value != value or math.isinf(value):
+        return str(value)
+    elif value == int(value):
+        return str(int(value))
+    elif abs(value) >= 1000:
+        return "{:.1f}".format(value)
+    return "{:.4g}".format(value)
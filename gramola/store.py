@@ -4,9 +4,22 @@ This module implements the Store interface to save dashboards and datasources
 to use them after. By default Gramola uses the directory ~/.gramola, although
 all Gramola commands can override this default path for another one.
 
+The datasources are saved by a pluggable backend, the available ones are:
+
+    ini    : ConfigObj INI file, each lookup parses the whole file. Used by
+             default.
+    sqlite : SQLite file indexed by name and type, lookups do not depend on
+             the size of the catalogue and many processes can use it at
+             once. Used when the store directory has the `datasources.db`
+             file, the datasources of the INI file can be imported with the
+             `gramola store-import` command.
+
 :moduleauthor: Pau Freixes, pfreixes@gmail.com
 """
 import os
+import json
+import sqlite3
+import threading
 
 from configobj import ConfigObj
 
@@ -22,17 +35,156 @@ class DuplicateEntry(Exception):
     pass
 
 
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasources (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    type TEXT NOT NULL,
+    config TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS datasources_type ON datasources (type);
+"""
+
+
+class INIBackend(object):
+    """ Saves the datasources as the sections of a ConfigObj INI file, each
+    datasource is given as a dictionary with all its keys.
+    """
+    NAME = 'ini'
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def datasources(self, name=None, type_=None):
+        config = ConfigObj(self.filepath, create_empty=True)
+        results = []
+        for section in config.sections:
+            # User filters
+            if name and name != section:
+                continue
+
+            if type_ and type_ != config[section].get('type'):
+                continue
+
+            # The title of the section is the name of the data source, we have to
+            # pack it by hand.
+            keys = {k: v for k, v in config[section].items()}
+            keys.update({'name': section})
+            results.append(keys)
+
+        return results
+
+    def add_datasource(self, keys):
+        config = ConfigObj(infile=self.filepath, create_empty=True)
+        if keys['name'] in config:
+            raise DuplicateEntry()
+
+        config[keys['name']] = keys
+        config.write()
+
+    def rm_datasource(self, name):
+        config = ConfigObj(infile=self.filepath, create_empty=True)
+        if name not in config:
+            raise NotFound()
+
+        config.pop(name)
+        config.write()
+
+
+class SQLiteBackend(object):
+    """ Saves the datasources into a SQLite file indexed by name and type, the
+    keys of each datasource are saved as a JSON object. The connection is shared
+    by all threads, each operation runs in its own transaction.
+    """
+    NAME = 'sqlite'
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        self._connection = self._connect()
+
+    def _connect(self):
+        # the connection waits for the locks taken by other processes, the WAL
+        # journal allows readers while another process is writing.
+        connection = sqlite3.connect(self.filepath, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.executescript(_SCHEMA)
+        return connection
+
+    def datasources(self, name=None, type_=None):
+        sql = "SELECT name, config FROM datasources"
+        where = []
+        params = []
+        if name:
+            where.append("name = ?")
+            params.append(name)
+        if type_:
+            where.append("type = ?")
+            params.append(type_)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id"
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+
+        results = []
+        for row_name, config in rows:
+            keys = {str(k): v.encode('utf-8') if isinstance(v, unicode) else v
+                    for k, v in json.loads(config).items()}
+            keys.update({'name': row_name.encode('utf-8')})
+            results.append(keys)
+        return results
+
+    def add_datasource(self, keys):
+        try:
+            with self._lock, self._connection:
+                self._insert(keys)
+        except sqlite3.IntegrityError:
+            raise DuplicateEntry()
+
+    def rm_datasource(self, name):
+        with self._lock, self._connection:
+            cursor = self._connection.execute("DELETE FROM datasources WHERE name = ?", (name,))
+        if not cursor.rowcount:
+            raise NotFound()
+
+    def import_from(self, backend):
+        """ Import the datasources of other backend using one transaction, the
+        ones already saved are skipped. Returns the names of the datasources
+        imported.
+        """
+        imported = []
+        with self._lock, self._connection:
+            for keys in backend.datasources():
+                if self._connection.execute("SELECT 1 FROM datasources WHERE name = ?",
+                                            (keys['name'],)).fetchone():
+                    log.debug("Datasource `{}` already saved, skipped".format(keys['name']))
+                    continue
+                self._insert(keys)
+                imported.append(keys['name'])
+        return imported
+
+    def _insert(self, keys):
+        config = {k: v for k, v in keys.items() if k != 'name'}
+        self._connection.execute("INSERT INTO datasources (name, type, config) VALUES (?, ?, ?)",
+                                 (keys['name'], keys.get('type'), json.dumps(config)))
+
+
 class Store(object):
     DEFAULT_DIRNAME = ".gramola"
     DEFAULT_DASHBOARDS_FILENAME = "dashboards"
     DEFAULT_DATASOURCES_FILENAME = "datasources"
+    DEFAULT_DATASOURCES_DB_FILENAME = "datasources.db"
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, backend=None):
         """
         Initialize a Store instane looking into the default store path or an
         alternavite given by the `path` keyword.
 
         :param path: string, an alternative path to the default one
+        :param backend: string, name of the backend used to save the datasources,
+                        by default `sqlite` if its file exists otherwise `ini`.
         """
         if not path:
             # Use the default one, in that case first time we create it
@@ -49,6 +201,33 @@ class Store(object):
 
         self.dashboards_filepath = os.path.join(self.path, Store.DEFAULT_DASHBOARDS_FILENAME)
         self.datasources_filepath = os.path.join(self.path, Store.DEFAULT_DATASOURCES_FILENAME)
+        self.datasources_db_filepath = os.path.join(self.path,
+                                                    Store.DEFAULT_DATASOURCES_DB_FILENAME)
+
+        if not backend:
+            exists = os.path.exists(self.datasources_db_filepath)
+            backend = SQLiteBackend.NAME if exists else INIBackend.NAME
+
+        if backend == SQLiteBackend.NAME:
+            self.backend = SQLiteBackend(self.datasources_db_filepath)
+        elif backend == INIBackend.NAME:
+            self.backend = INIBackend(self.datasources_filepath)
+        else:
+            raise ValueError("Backend {} not supported".format(backend))
+
+    def directory(self, name):
+        """
+        Returns the path of a directory inside of the store used to save other
+        things than datasources and dashboards, such as indexes or caches. The
+        directory is created the first time.
+
+        :param name: string, name of the directory.
+        :return: string
+        """
+        path = os.path.join(self.path, name)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
 
     def datasources(self, name=None, type_=None):
         """
@@ -63,22 +242,11 @@ class Store(object):
         :param type_: string, filter by type_ of datasource.
         :return: list
         """
-        config = ConfigObj(self.datasources_filepath, create_empty=True)
         results = []
-        for section in config.sections:
-            # User filters
-            if name and name != section:
-                continue
-
-            if type_ and type_ != config[section].get('type'):
-                continue
-
-            # The title of the section is the name of the data source, we have to
-            # pack it by hand. Each section as at least the type key used to find out
+        for keys in self.backend.datasources(name=name, type_=type_):
+            # Each datasource has at least the type key used to find out
             # the right DataSourceConfig derivated class.
-            factory = DataSource.find(config[section].get('type')).DATA_SOURCE_CONFIGURATION_CLS
-            keys = {k: v for k, v in config[section].items()}
-            keys.update({'name': section})
+            factory = DataSource.find(keys.get('type')).DATA_SOURCE_CONFIGURATION_CLS
             results.append(factory(**keys))
 
         return results
@@ -90,12 +258,7 @@ class Store(object):
         :param datasource: :class:gramola.datasources.base.DatSourceConfig.
         :raises gramola.store.DuplicateEntry: If the datasource name already exists.
         """
-        config = ConfigObj(infile=self.datasources_filepath, create_empty=True)
-        if datasource.name in config:
-            raise DuplicateEntry()
-
-        config[datasource.name] = datasource.dict()
-        config.write()
+        self.backend.add_datasource(datasource.dict())
 
     def rm_datasource(self, name):
         """
@@ -104,12 +267,7 @@ class Store(object):
         :param name: string, name of the data source to remove.
         :raises gramola.store.NotFound: If the datasource does not exists.
         """
-        config = ConfigObj(infile=self.datasources_filepath, create_empty=True)
-        if name not in config:
-            raise NotFound()
-
-        config.pop(name)
-        config.write()
+        self.backend.rm_datasource(name)
 
     def dashboards(self, name=None):
         """
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the transforms applied by Gramola to the series returned by the
+datasources before they are rendered, such as the derivative, the rate or the
+sum of all series returned by a wildcard. Transforms are chained using a pipe,
+for example:
+
+    sumSeries|derivative|movingAverage(5)
+
+Each transform gets the list of series returned by the previous one and returns
+a new list, the series are kept as arrays of doubles where the values not
+available are NaN. Transforms run over the raw series that can be cached, so
+changing the transform of a query does not need to fetch the datapoints again.
+
+The transforms supported are:
+
+    derivative          : Difference between consecutive values.
+    rate                : Change per second, counter resets are dropped.
+    integral            : Accumulated sum of the values.
+    movingAverage(n)    : Average of the last n values.
+    percentile(n)       : Constant series with the n percentile of the values.
+    scale(factor)       : Multiply the values by a factor.
+    absolute            : Absolute value.
+    sumSeries           : One series with the sum of all series.
+    averageSeries       : One series with the average of all series.
+    maxSeries           : One series with the maxium of all series.
+    minSeries           : One series with the minium of all series.
+    highestCurrent(n)   : The n series with the highest last value.
+    highestMax(n)       : The n series with the highest maxium value.
+    highestAverage(n)   : The n series with the highest average value.
+    lowestCurrent(n)    : The n series with the lowest last value.
+    lowestMax(n)        : The n series with the lowest maxium value.
+    lowestAverage(n)    : The n series with the lowest average value.
+
+The selectors of the n highest or lowest series keep a heap of n series while
+they are scored, when they are the first transform of the chain the series can
+be given as they are streamed from the datasource, so only the n selected are
+kept in memory. The datasources that can select the series by themselves,
+i.e Graphite, get them pushed down when they are the first transforms of the
+chain, so only the series selected are returned by the backend.
+
+:moduleauthor: Pau Freixes, pfreixes@gmail.com
+"""
+import re
+import math
+import heapq
+
+from array import array
+from itertools import izip
+
+NAN = float('nan')
+
+# name -> (function, number of arguments)
+TRANSFORMS = {}
+
+_CALL = re.compile(r"^\s*(\w+)\s*(?:\((.*)\))?\s*$")
+
+
+def _isnan(value):
+    return value != value
+
+
+class Series(object):
+    """ One series of datapoints kept as two arrays of doubles """
+    __slots__ = ('name', 'values', 'timestamps')
+
+    def __init__(self, name, values, timestamps):
+        self.name = name
+        self.values = values
+        self.timestamps = timestamps
+
+    @classmethod
+    def from_datapoints(cls, name, datapoints):
+        """ Build a series from an iterable of tuples (value, ts), the None
+        values are kept as NaN.
+        """
+        values = array('d')
+        timestamps = array('d')
+        for value, ts in datapoints:
+            values.append(NAN if value is None else value)
+            timestamps.append(ts)
+        return cls(name, values, timestamps)
+
+    def datapoints(self):
+        """ Returns the list of tuples (value, ts), NaN values are given as None """
+        return [(None if _isnan(value) else value, int(ts) if ts == int(ts) else ts)
+                for value, ts in izip(self.values, self.timestamps)]
+
+    def __eq__(self, b):
+        return self.name == b.name and self.datapoints() == b.datapoints()
+
+    def __ne__(self, b):
+        return not self.__eq__(b)
+
+    def __repr__(self):
+        return "Series({!r}, {!r})".format(self.name, self.datapoints())
+
+
+class InvalidTransform(Exception):
+    pass
+
+
+def transform(name, args=0, streams=False):
+    """ Decorator used to register a transform, args is the number
+    of arguments expected and streams tells if it can get any iterable
+    of series instead of a list.
+    """
+    def register(func):
+        TRANSFORMS[name] = (func, args)
+        func.transform = name
+        func.streams = streams
+        return func
+    return register
+
+
+def parse(expression):
+    """ Parse a chain of transforms, returns a list of tuples (function, args).
+
+    :param expression: str, i.e `sumSeries|movingAverage(5)`
+    :raises InvalidTransform: If a transform is unknown or gets invalid arguments.
+    :rtype: list
+    """
+    chain = []
+    for call in expression.split("|"):
+        match = _CALL.match(call)
+        if not match:
+            raise InvalidTransform("Invalid transform `{}`".format(call.strip()))
+
+        name, args = match.group(1), match.group(2)
+        if name not in TRANSFORMS:
+            raise InvalidTransform("Unknown transform `{}`".format(name))
+
+        try:
+            args = [float(arg) for arg in args.split(",")] if args and args.strip() else []
+        except ValueError:
+            raise InvalidTransform("Invalid arguments for `{}`".format(name))
+
+        func, nargs = TRANSFORMS[name]
+        if len(args) != nargs:
+            raise InvalidTransform("Transform `{}` expects {} arguments".format(name, nargs))
+
+        chain.append((func, args))
+    return chain
+
+
+class Pipeline(object):
+    """ Chain of transforms applied to a list of series """
+    def __init__(self, expression=None):
+        """
+        :param expression: str, the transforms chained using pipes.
+        :raises InvalidTransform: If the expression is not valid.
+        """
+        self.expression = expression
+        self.chain = parse(expression) if expression else []
+
+    @property
+    def streams(self):
+        """ True if the first transform can get the series while they are
+        streamed, see `apply`.
+        """
+        return bool(self.chain) and self.chain[0][0].streams
+
+    def apply(self, series):
+        """ Apply all transforms to the list of series given, returns
+        a new list of series. When the pipeline `streams` any iterable
+        of series can be given.
+        """
+        for func, args in self.chain:
+            series = func(series, *args)
+        return series
+
+    def push_down(self, datasource, query):
+        """ Push the first transforms of the chain down to the datasource while it
+        can apply them by itself, see `DataSource.push_down`. The transforms pushed
+        are removed from the chain, returns the query to be fetched.
+
+        :param datasource: :class:gramola.datasources.base.DataSource
+        :param query: :class:gramola.datasources.base.MetricQuery
+        :rtype: :class:gramola.datasources.base.MetricQuery
+        """
+        while self.chain:
+            func, args = self.chain[0]
+            pushed = datasource.push_down(query, func.transform, args)
+            if pushed is None:
+                break
+            query = pushed
+            self.chain = self.chain[1:]
+        return query
+
+
+def _map(series, func):
+    # apply to each series a function that builds the new values
+    return [Series(s.name, func(s), s.timestamps) for s in series]
+
+
+@transform('derivative')
+def derivative(series):
+    def values(s):
+        v = s.values
+        if not v:
+            return array('d')
+        return array('d', [NAN]) + array('d', [b - a for a, b in izip(v, v[1:])])
+    return _map(series, values)
+
+
+@transform('rate')
+def rate(series):
+    def values(s):
+        v, t = s.values, s.timestamps
+        if not v:
+            return array('d')
+        rates = array('d', [NAN])
+        for a, b, ta, tb in izip(v, v[1:], t, t[1:]):
+            # counter resets give negative deltas
+            rates.append((b - a) / (tb - ta) if tb > ta and b >= a else NAN)
+        return rates
+    return _map(series, values)
+
+
+@transform('integral')
+def integral(series):
+    def values(s):
+        total = 0.0
+        result = array('d')
+        for value in s.values:
+            if not _isnan(value):
+                total += value
+            result.append(total)
+        return result
+    return _map(series, values)
+
+
+@transform('movingAverage', args=1)
+def moving_average(series, points):
+    points = int(points)
+    if points < 1:
+        raise InvalidTransform("movingAverage expects a positive window")
+
+    def values(s):
+        # running sum and count of the known values of the window
+        total, count = 0.0, 0
+        result = array('d')
+        v = s.values
+        for idx, value in enumerate(v):
+            if not _isnan(value):
+                total += value
+                count += 1
+            if idx >= points:
+                old = v[idx - points]
+                if not _isnan(old):
+                    total -= old
+                    count -= 1
+            result.append(total / count if count else NAN)
+        return result
+    return _map(series, values)
+
+
+def percentile_of(values, n):
+    """ Returns the n percentile of the values ignoring the NaN, using
+    the nearest rank method. NaN if there are no values.
+    """
+    known = sorted(v for v in values if not _isnan(v))
+    if not known:
+        return NAN
+    rank = int(math.ceil(n / 100.0 * len(known)))
+    return known[min(len(known), max(1, rank)) - 1]
+
+
+@transform('percentile', args=1)
+def percentile(series, n):
+    if not 0 <= n <= 100:
+        raise InvalidTransform("percentile expects a value between 0 and 100")
+    return [Series("percentile({}, {:g})".format(s.name, n),
+                   array('d', [percentile_of(s.values, n)]) * len(s.values), s.timestamps)
+            for s in series]
+
+
+@transform('scale', args=1)
+def scale(series, factor):
+    return _map(series, lambda s: array('d', [value * factor for value in s.values]))
+
+
+@transform('absolute')
+def absolute(series):
+    return _map(series, lambda s: array('d', [abs(value) for value in s.values]))
+
+
+def _combine(name, series, func):
+    # combine all series by timestamp, ignoring the NaN values
+    if not series:
+        return []
+
+    columns = {}
+    for s in series:
+        for value, ts in izip(s.values, s.timestamps):
+            if not _isnan(value):
+                columns.setdefault(ts, []).append(value)
+            else:
+                columns.setdefault(ts, [])
+
+    timestamps = array('d', sorted(columns))
+    values = array('d', [func(columns[ts]) if columns[ts] else NAN for ts in timestamps])
+    return [Series("{}({})".format(name, ",".join(s.name for s in series)), values, timestamps)]
+
+
+@transform('sumSeries')
+def sum_series(series):
+    return _combine('sumSeries', series, sum)
+
+
+@transform('averageSeries')
+def average_series(series):
+    return _combine('averageSeries', series, lambda values: sum(values) / len(values))
+
+
+@transform('maxSeries')
+def max_series(series):
+    return _combine('maxSeries', series, max)
+
+
+@transform('minSeries')
+def min_series(series):
+    return _combine('minSeries', series, min)
+
+
+def _last(values):
+    for value in reversed(values):
+        if not _isnan(value):
+            return value
+    return NAN
+
+
+def _max(values):
+    known = [v for v in values if not _isnan(v)]
+    return max(known) if known else NAN
+
+
+def _average(values):
+    known = [v for v in values if not _isnan(v)]
+    return sum(known) / len(known) if known else NAN
+
+
+def _select(series, n, score, highest):
+    # keeps a heap of the best n series while they are consumed one by one, the
+    # series without values are the worst ones and the ties go to the first ones.
+    n = int(n)
+    if n < 1:
+        raise InvalidTransform("Selectors expect a positive number of series")
+
+    sign = 1 if highest else -1
+    heap = []
+    for idx, s in enumerate(series):
+        value = score(s.values)
+        entry = (float('-inf') if _isnan(value) else sign * value, -idx, s)
+        if len(heap) < n:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+    return [s for _, _, s in sorted(heap, reverse=True)]
+
+
+@transform('highestCurrent', args=1, streams=True)
+def highest_current(series, n):
+    return _select(series, n, _last, True)
+
+
+@transform('highestMax', args=1, streams=True)
+def highest_max(series, n):
+    return _select(series, n, _max, True)
+
+
+@transform('highestAverage', args=1, streams=True)
+def highest_average(series, n):
+    return _select(series, n, _average, True)
+
+
+@transform('lowestCurrent', args=1, streams=True)
+def lowest_current(series, n):
+    return _select(series, n, _last, False)
+
+
+@transform('lowestMax', args=1, streams=True)
+def lowest_max(series, n):
+    return _select(series, n, _max, False)
+
+
+@transform('lowestAverage', args=1, streams=True)
+def lowest_average(series, n):
+    return _select(series, n, _average, False)
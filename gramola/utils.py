@@ -6,7 +6,9 @@ Utils used arround the Gramola project.
 """
 import json
 
-from itertools import chain
+from time import mktime
+from array import array
+from collections import namedtuple
 from datetime import datetime
 from datetime import timedelta
 
@@ -24,6 +26,22 @@ class InvalidGramolaDictionary(Exception):
         self.errors = errors
 
 
+def _inherited(bases, attr):
+    # values of a class attribute set by the metaclass to the base classes
+    return tuple(v for base in bases for v in getattr(base, attr, ()))
+
+
+def _unique_keys(keys):
+    # keys can be OptionalKey instances, they are compared by name
+    seen = set()
+    unique = []
+    for key in keys:
+        if str(key) not in seen:
+            seen.add(str(key))
+            unique.append(key)
+    return tuple(unique)
+
+
 class GramolaDictionary(object):
     """
     Implements a dictionary store with a interface to declare the allowable
@@ -35,8 +53,14 @@ class GramolaDictionary(object):
     the params defined by the base class.
 
     As the required keys and the optional keys are automatically published
-    as properties, for these optional keys that are not given a None value
-    is returned.
+    as attributes, for these optional keys that are not given a None value
+    is returned. Each key is kept in a slot, so instances are cheap to build
+    and they can not get other attributes than the ones declared by the
+    `__slots__` of the class.
+
+    A key given with a None value can not be told apart from a key not given,
+    so it is left out by the `dict` and `dumps` methods and it is not taken
+    into account by the equality.
 
     For example:
 
@@ -61,21 +85,33 @@ class GramolaDictionary(object):
     REQUIRED_KEYS = ()
     OPTIONAL_KEYS = ()
 
-    # Use a metaclass to publish dynamic properties
-    # got from the REQUIRED_KEYS and OPTIONAL_KEYS published
-    # by the base classes + derivated class
+    __slots__ = ()
+
+    # Use a metaclass to compile each class once it is created, the REQUIRED_KEYS
+    # and OPTIONAL_KEYS published by the base classes + derivated class are
+    # precomputed and each key gets a slot, so instances do not have a __dict__.
     class __metaclass__(type):
-        def __init__(cls, name, bases, nmspc):
-            type.__init__(cls, name, bases, nmspc)
-
-            # install the property for all keys to make them visible
-            # as a properties. i.e conf.name
-            for attr in chain(cls.required_keys(), cls.optional_keys()):
-                setattr(
-                    cls,
-                    str(attr),  # required for non string objects
-                    property(lambda self, a=attr: self._dict.get(a, None))
-                )
+        def __new__(mcs, name, bases, nmspc):
+            required = _unique_keys(_inherited(bases, '_required_keys') +
+                                    tuple(nmspc.get('REQUIRED_KEYS', ())))
+            optional = _unique_keys(_inherited(bases, '_optional_keys') +
+                                    tuple(nmspc.get('OPTIONAL_KEYS', ())))
+
+            # required for non string objects
+            names = tuple(str(k) for k in _unique_keys(required + optional))
+            inherited = _inherited(bases, '_names')
+
+            # the keys of the base classes already have their slot
+            nmspc['__slots__'] = tuple(nmspc.get('__slots__', ())) +\
+                tuple(n for n in names if n not in inherited)
+
+            cls = type.__new__(mcs, name, bases, nmspc)
+            cls._required_keys = required
+            cls._optional_keys = optional
+            cls._names = names
+            cls._allowed = frozenset(names)
+            cls._required_names = tuple(str(k) for k in required)
+            return cls
 
     def __init__(self, **kwargs):
         """
@@ -87,32 +123,37 @@ class GramolaDictionary(object):
         """
         # check that the keys given as a confiugaration keys are allowed either because
         # are required or optional.
-        allowed_keys = self.required_keys() + self.optional_keys()
-        if filter(lambda k: k not in allowed_keys, kwargs):
+        if not self._allowed.issuperset(kwargs):
             raise InvalidGramolaDictionary(
-                {k: 'Key not expected' for k in
-                    filter(lambda k: k not in allowed_keys, kwargs)})
+                {k: 'Key not expected' for k in kwargs if k not in self._allowed})
 
         # all required keys have to be given
-        if filter(lambda k: k not in kwargs, self.required_keys()):
-            raise InvalidGramolaDictionary(
-                {k: 'Key missing' for k in
-                    filter(lambda k: k not in kwargs, self.required_keys())})
+        for k in self._required_names:
+            if k not in kwargs:
+                raise InvalidGramolaDictionary(
+                    {k: 'Key missing' for k in self._required_names if k not in kwargs})
 
-        self._dict = kwargs
+        # the keys not given are set to None
+        for name in self._names:
+            setattr(self, name, kwargs.get(name))
 
     def __eq__(self, b):
         # Are equals if they are implemented using the same class and
-        # have the same dictionary elements
-        return self.__class__ == b.__class__ and self._dict == b._dict
+        # have the same values
+        return self.__class__ == b.__class__ and\
+            all(getattr(self, k) == getattr(b, k) for k in self._names)
+
+    def __ne__(self, b):
+        return not self.__eq__(b)
 
     def dict(self):
-        """ Returns a copy dict of the internal dict"""
-        return dict(**self._dict)
+        """ Returns a dict with the keys given, optional keys set to None
+        are considered as not given."""
+        return {k: v for k, v in ((k, getattr(self, k)) for k in self._names) if v is not None}
 
     def dumps(self):
         """ Return a string JSON object to be used as a serialized """
-        return json.dumps(self._dict)
+        return json.dumps(self.dict())
 
     @classmethod
     def loads(cls, buffer_):
@@ -126,29 +167,19 @@ class GramolaDictionary(object):
     @classmethod
     def required_keys(cls):
         """ Return all required keys inherited by the whole hierarchy classes """
-        return cls._pick_up_attr('REQUIRED_KEYS')
+        return cls._required_keys
 
     @classmethod
     def optional_keys(cls):
         """ Return all optional keys inherited by the whole hierarchy classes """
-        return cls._pick_up_attr('OPTIONAL_KEYS')
-
-    @classmethod
-    def _pick_up_attr(cls, attr):
-        class_values = getattr(cls, attr)
-        base_values = ()
-        for base in cls.__bases__:
-            if hasattr(base, '_pick_up_attr'):
-                base_values += base._pick_up_attr(attr)
-
-        return base_values + class_values
+        return cls._optional_keys
 
 
 class DateTimeInvalidValue(Exception):
     pass
 
 
-def parse_date(date_value):
+def parse_date(date_value, now=None):
     """ Parse a date_value expecting at least one of the following
     formats, otherwise it raises a DateTimeInvalidValue.
 
@@ -158,6 +189,7 @@ def parse_date(date_value):
                           ([|-](integer)[h|min|s|d]|now)
 
     :param date_value: str
+    :param now: datetime, used by the relative formats instead of the current time.
     :return: datetime
     """
     try:
@@ -166,34 +198,113 @@ def parse_date(date_value):
         try:
             return datetime.fromtimestamp(float(date_value))
         except ValueError:
+            now = now or datetime.now()
             try:
                 if date_value == 'now':
-                    return datetime.now()
+                    return now
                 elif date_value.find("h") != -1:
                     v = date_value.split("h")[0]
                     if v[0] == '-':
-                        return datetime.now() - timedelta(hours=int(v[1:]))
+                        return now - timedelta(hours=int(v[1:]))
                     else:
-                        return datetime.now() + timedelta(hours=int(v))
+                        return now + timedelta(hours=int(v))
                 elif date_value.find("min") != -1:
                     v = date_value.split("min")[0]
                     if v[0] == '-':
-                        return datetime.now() - timedelta(minutes=int(v[1:]))
+                        return now - timedelta(minutes=int(v[1:]))
                     else:
-                        return datetime.now() + timedelta(minutes=int(v))
+                        return now + timedelta(minutes=int(v))
                 elif date_value.find("s") != -1:
                     v = date_value.split("s")[0]
                     if v[0] == '-':
-                        return datetime.now() - timedelta(seconds=int(v[1:]))
+                        return now - timedelta(seconds=int(v[1:]))
                     else:
-                        return datetime.now() + timedelta(seconds=int(v))
+                        return now + timedelta(seconds=int(v))
                 elif date_value.find("d") != -1:
                     v = date_value.split("d")[0]
                     if v[0] == '-':
-                        return datetime.now() - timedelta(days=int(v[1:]))
+                        return now - timedelta(days=int(v[1:]))
                     else:
-                        return datetime.now() + timedelta(days=int(v))
+                        return now + timedelta(days=int(v))
                 raise DateTimeInvalidValue()
             except ValueError:
                 raise DateTimeInvalidValue()
-    return data_value
+
+
+def to_timestamp(date):
+    """ Returns the epoch seconds of a local datetime
+
+    :param date: datetime
+    :return: int
+    """
+    return int(mktime(date.timetuple()))
+
+
+class TimeRange(namedtuple('TimeRange', ['since', 'until'])):
+    """ Immutable time window used by the queries, both values are epoch seconds.
+    Once a time range is resolved all datasources, caches and schedulers use the
+    same values, no matter how many times they read them.
+    """
+    __slots__ = ()
+
+    @property
+    def seconds(self):
+        return self.until - self.since
+
+    def align(self, step):
+        """ Returns a new time range where both values are aligned to the
+        beginning of the bucket of `step` seconds that they belong to.
+
+        :param step: int
+        :return: TimeRange
+        """
+        return TimeRange(self.since - self.since % step, self.until - self.until % step)
+
+    def datetimes(self):
+        """ Returns the tuple (since, until) as local datetimes """
+        return datetime.fromtimestamp(self.since), datetime.fromtimestamp(self.until)
+
+
+class RingBuffer(object):
+    """ Bounded buffer of datapoints backed by two arrays of doubles, one for the
+    values and another one for the timestamps. Once the buffer is full the oldest
+    datapoints are overwritten, therefore it uses always the same memory no matter
+    how many datapoints are appended.
+    """
+    __slots__ = ('size', '_values', '_timestamps', '_next', '_count')
+
+    def __init__(self, size):
+        """
+        :param size: int, maxium number of datapoints kept.
+        """
+        if size < 1:
+            raise ValueError("Invalid ring buffer size {}".format(size))
+
+        self.size = size
+        self._values = array('d', [0.0]) * size
+        self._timestamps = array('d', [0.0]) * size
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value, ts):
+        self._values[self._next] = value
+        self._timestamps[self._next] = ts
+        self._next = (self._next + 1) % self.size
+        if self._count < self.size:
+            self._count += 1
+
+    def datapoints(self):
+        """ Returns the datapoints kept, from the oldest to the newest one
+
+        :return: list of tuples (value, ts)
+        """
+        start = (self._next - self._count) % self.size
+        if start + self._count <= self.size:
+            end = start + self._count
+            return zip(self._values[start:end], self._timestamps[start:end])
+
+        return (zip(self._values[start:], self._timestamps[start:]) +
+                zip(self._values[:self._next], self._timestamps[:self._next]))
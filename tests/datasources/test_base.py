@@ -1,5 +1,9 @@
 import pytest
 
+from datetime import datetime
+
+from gramola.utils import TimeRange
+
 from gramola.datasources.base import (
     OptionalKey,
     DataSource,
@@ -19,6 +23,10 @@ class TestOptionalKey(object):
         d = {option: "value"}
         assert d['field'] == "value"
 
+    def test_hyphen_name(self):
+        assert OptionalKey("field", "description").hyphen_name == "--field"
+        assert OptionalKey("pickle_port", "description").hyphen_name == "--pickle-port"
+
 
 class TestDataSourceConfig(object):
 
@@ -51,6 +59,38 @@ class TestMetricQuery(object):
         assert query.from_ == 1
         assert query.to == 2
 
+    def test_time_range(self):
+        class TestQuery(MetricQuery):
+            REQUIRED_KEYS = ('metric',)
+
+        query = TestQuery(**{'metric': 'cpu', 'since': '-1h', 'until': 'now'})
+        assert query.time_range(now=7250) == TimeRange(3650, 7250)
+
+        # since and until are resolved using the same clock read
+        time_range = query.time_range()
+        assert time_range.seconds == 3600
+
+    def test_resolve(self):
+        class TestQuery(MetricQuery):
+            REQUIRED_KEYS = ('metric',)
+
+        query = TestQuery(**{'metric': 'cpu'})
+        resolved = query.resolve(now=7250)
+        assert resolved == query
+        assert resolved.time_range() == TimeRange(3650, 7250)
+        assert resolved.time_range() == resolved.time_range(now=10000)
+        assert query.resolve(now=7250, step=60).time_range() == TimeRange(3600, 7200)
+        assert resolved.get_since() == datetime.fromtimestamp(3650)
+
+        # the beginning of the time range can be moved forward
+        assert query.resolve(now=7250, since=7000).time_range() == TimeRange(7000, 7250)
+        assert query.resolve(now=7250, since=1000).time_range() == TimeRange(3650, 7250)
+
+        # the shards of a long time range use their own time range
+        shard = resolved.with_time_range(TimeRange(3650, 5000))
+        assert shard == query
+        assert shard.time_range() == TimeRange(3650, 5000)
+
     def test_custom_raises(self):
         class TestQuery(MetricQuery):
             REQUIRED_KEYS = ('metric',)
@@ -0,0 +1,103 @@
+import socket
+import struct
+import pickle
+import cPickle
+import pytest
+
+from mock import patch
+
+from gramola.datasources.carbon import (
+    CarbonDataSource,
+    unpickle
+)
+
+
+def message(datapoints):
+    payload = pickle.dumps(datapoints, protocol=2)
+    return struct.pack("!L", len(payload)) + payload
+
+
+class Evil(object):
+    pass
+
+
+@pytest.fixture
+def datasource():
+    # ports chosen by the system
+    return CarbonDataSource.from_config(type='carbon-listen', name='carbon',
+                                        port='0', pickle_port='0')
+
+
+def test_unpickle():
+    assert unpickle(pickle.dumps([('foo', (60, 1))])) == [('foo', (60, 1))]
+    with pytest.raises(cPickle.UnpicklingError):
+        unpickle(pickle.dumps([Evil()]))
+
+
+class TestConsume(object):
+    def test_lines(self, datasource):
+        query = CarbonDataSource.METRIC_QUERY_CLS(path='foo.bar')
+        datasource.subscribe(query, maxdatapoints=2)
+        datasource._consume_lines("foo.bar 1 60\nfoo.other 2 60\ninvalid\nfoo.bar x 120\n"
+                                  "foo.bar 2 120\nfoo.bar 3 180\n")
+        assert datasource.datapoints(query) == [(2.0, 120.0), (3.0, 180.0)]
+
+        # paths not subscribed are dropped
+        assert set(datasource._buffers) == set(['foo.bar'])
+
+    def test_messages(self, datasource):
+        query = CarbonDataSource.METRIC_QUERY_CLS(path='foo.bar')
+        datasource.subscribe(query)
+        buffer_ = message([('foo.bar', (60, 1)), ('foo.other', (60, 2)), ('foo.bar', (120, None))])
+        second = message([('foo.bar', (180, 3))])
+        assert datasource._consume_messages(buffer_ + second[:5]) == second[:5]
+        assert datasource._consume_messages(second) == ""
+        assert datasource.datapoints(query) == [(1.0, 60.0), (3.0, 180.0)]
+
+    def test_invalid_message(self, datasource):
+        assert datasource._consume_messages(struct.pack("!L", 4) + "xxxx") is None
+        assert datasource._consume_messages(struct.pack("!L", 2 ** 30)) is None
+
+
+class TestListen(object):
+    def test_plaintext_and_pickle(self, datasource):
+        foo = CarbonDataSource.METRIC_QUERY_CLS(path='foo')
+        bar = CarbonDataSource.METRIC_QUERY_CLS(path='bar')
+        datasource.subscribe(foo)
+        datasource.subscribe(bar)
+
+        listeners = datasource._listen()
+        ports = {pickle_: sock.getsockname() for sock, pickle_ in listeners.items()}
+        try:
+            plaintext = socket.create_connection(ports[False])
+            pickled = socket.create_connection(ports[True])
+            plaintext.sendall("foo 1 60\nfoo 2 1")
+            pickled.sendall(message([('bar', (60, 5))]))
+            for i in range(10):
+                datasource.poll(timeout=0.05)
+                if len(datasource.datapoints(foo)) and datasource.datapoints(bar):
+                    break
+            plaintext.sendall("20\n")
+            plaintext.close()
+            pickled.close()
+            for i in range(10):
+                datasource.poll(timeout=0.05)
+                if len(datasource.datapoints(foo)) == 2:
+                    break
+
+            assert datasource.datapoints(foo) == [(1.0, 60.0), (2.0, 120.0)]
+            assert datasource.datapoints(bar) == [(5.0, 60.0)]
+        finally:
+            datasource.close()
+
+    def test_poll_window(self, datasource):
+        # without timeout the listener is not waited forever
+        try:
+            with patch("gramola.datasources.carbon.DEFAULT_WINDOW", 0.05):
+                assert datasource.poll() is False
+            assert datasource.poll(timeout=0.01) is True
+        finally:
+            datasource.close()
+
+    def test_test(self, datasource):
+        assert datasource.test() is True
@@ -9,12 +9,18 @@ from botocore.exceptions import (
     NoRegionError,
     ClientError,
 )
+from gramola.ratelimit import RATELIMIT_DIRNAME, _limiters, report
+from gramola.shards import shard_queries
 from gramola.datasources.cloudwatch import (
+    MAX_THROTTLED_RETRIES,
     Boto3ClientError,
+    find_period,
+    expand,
     CWDataSource,
     CWMetricQuery
 )
 from gramola.datasources.base import InvalidMetricQuery
+from gramola.utils import to_timestamp
 
 BOTO3 = 'gramola.datasources.cloudwatch.boto3'
 
@@ -118,8 +124,9 @@ class TestDatapoints(object):
         boto3.session.Session.return_value.client.return_value.\
             get_metric_statistics.assert_called_with(
                 Namespace='AWS/EC2', MetricName='CPUUtillization',
-                StartTime=datetime.strptime(query.since, '%Y-%m-%dT%H:%M:%S'),
-                EndTime=datetime.strptime(query.until, '%Y-%m-%dT%H:%M:%S'), Period=60,
+                StartTime=to_timestamp(datetime.strptime(query.since, '%Y-%m-%dT%H:%M:%S')),
+                EndTime=to_timestamp(datetime.strptime(query.until, '%Y-%m-%dT%H:%M:%S')),
+                Period=60,
                 Dimensions=[{'Name': 'AutoScalingGroupName', 'Value': 'foo'}],
                 Statistics=['Average']
             )
@@ -139,12 +146,22 @@ class TestDatapoints(object):
         boto3.session.Session.return_value.client.return_value.\
             get_metric_statistics.assert_called_with(
                 Namespace='AWS/EC2', MetricName='CPUUtillization',
-                StartTime=datetime.strptime(query.since, '%Y-%m-%dT%H:%M:%S'),
-                EndTime=datetime.strptime(query.until, '%Y-%m-%dT%H:%M:%S'), Period=60,
+                StartTime=to_timestamp(datetime.strptime(query.since, '%Y-%m-%dT%H:%M:%S')),
+                EndTime=to_timestamp(datetime.strptime(query.until, '%Y-%m-%dT%H:%M:%S')),
+                Period=60,
                 Dimensions=[{'Name': 'AutoScalingGroupName', 'Value': 'foo'}],
                 Statistics=['Sum']
             )
 
+    def test_query_sorted(self, boto3, config, query_dict, response):
+        query = CWDataSource.METRIC_QUERY_CLS(**query_dict)
+        response['Datapoints'][0]['Timestamp'] = datetime(2016, 1, 1, 0, 1)
+        response['Datapoints'][1]['Timestamp'] = datetime(2016, 1, 1, 0, 0)
+        boto3.session.Session.return_value.client.return_value.\
+            get_metric_statistics.return_value = response
+        datapoints = CWDataSource(config).datapoints(query)
+        assert [value for value, ts in datapoints] == [2, 1]
+
     def test_query_invalid_statistics(self, boto3, config, query_dict, response):
         query_dict.update({'statistics': 'foo'})
         query = CWDataSource.METRIC_QUERY_CLS(**query_dict)
@@ -160,8 +177,171 @@ class TestDatapoints(object):
         boto3.session.Session.return_value.client.return_value.\
             get_metric_statistics.assert_called_with(
                 Namespace='AWS/EC2', MetricName='CPUUtillization',
-                StartTime=datetime.strptime(query.since, '%Y-%m-%dT%H:%M:%S'),
-                EndTime=datetime.strptime(query.until, '%Y-%m-%dT%H:%M:%S'), Period=480,
+                StartTime=to_timestamp(datetime.strptime(query.since, '%Y-%m-%dT%H:%M:%S')),
+                EndTime=to_timestamp(datetime.strptime(query.until, '%Y-%m-%dT%H:%M:%S')),
+                Period=480,
                 Dimensions=[{'Name': 'AutoScalingGroupName', 'Value': 'foo'}],
                 Statistics=['Average']
             )
+
+
+@patch(BOTO3)
+class TestListMetrics(object):
+    def test_pages(self, boto3, config):
+        client = boto3.session.Session.return_value.client.return_value
+        client.list_metrics.side_effect = [
+            {'Metrics': [{'MetricName': 'foo'}], 'NextToken': 'token'},
+            {'Metrics': [{'MetricName': 'bar'}]}
+        ]
+        cw = CWDataSource(config)
+        assert [m['MetricName'] for m in cw.list_metrics(namespace='AWS/EC2')] == ['foo', 'bar']
+        client.list_metrics.assert_called_with(Namespace='AWS/EC2', NextToken='token')
+
+
+@patch("gramola.datasources.cloudwatch.sleep")
+@patch(BOTO3)
+class TestRateLimit(object):
+    def throttling(self):
+        return ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}},
+                           'ListMetrics')
+
+    def test_throttled_retried(self, boto3, psleep, config):
+        client = boto3.session.Session.return_value.client.return_value
+        client.list_metrics.side_effect = [self.throttling(), {'Metrics': [{'MetricName': 'foo'}]}]
+        cw = CWDataSource(config)
+        assert [m['MetricName'] for m in cw.list_metrics()] == ['foo']
+        assert client.list_metrics.call_count == 2
+        assert psleep.call_count == 1
+
+    def test_throttled_too_many_times(self, boto3, psleep, config):
+        client = boto3.session.Session.return_value.client.return_value
+        client.list_metrics.side_effect = self.throttling()
+        with pytest.raises(Boto3ClientError):
+            list(CWDataSource(config).list_metrics())
+        assert client.list_metrics.call_count == MAX_THROTTLED_RETRIES + 1
+
+    def test_limiter_shared_with_store(self, boto3, psleep, config, tmpdir):
+        store = Mock()
+        store.directory.return_value = str(tmpdir)
+        client = boto3.session.Session.return_value.client.return_value
+        client.meta.region_name = 'eu-west-1'
+        _limiters.clear()
+        cw = CWDataSource(config)
+        cw.use_store(store)
+        limiter = cw._limiter(client)
+        assert limiter.filepath.startswith(str(tmpdir))
+        store.directory.assert_called_with(RATELIMIT_DIRNAME)
+
+    def test_limiter_by_profile(self, boto3, psleep, config):
+        client = boto3.session.Session.return_value.client.return_value
+        client.meta.region_name = 'eu-west-1'
+        client.get_metric_statistics.return_value = {'Datapoints': []}
+        _limiters.clear()
+        query = CWDataSource.METRIC_QUERY_CLS(namespace='AWS/EC2', metricname='CPUUtilization',
+                                              dimension_name='InstanceId', dimension_value='i-1',
+                                              profile='sandbox').resolve()
+        CWDataSource(config)._datapoints(query, None, profile='sandbox', region='eu-west-1')
+        assert [key for key, _, _ in report()] == [('sandbox', 'eu-west-1')]
+
+
+def test_max_seconds_per_request(config):
+    query = CWDataSource.METRIC_QUERY_CLS(namespace='AWS/EC2', metricname='CPUUtilization',
+                                          dimension_name='InstanceId', dimension_value='i-1')
+    assert CWDataSource(config).max_seconds_per_request(query.resolve()) == 1440 * 60
+
+
+def test_shards_same_period(config):
+    query = CWDataSource.METRIC_QUERY_CLS(namespace='AWS/EC2', metricname='CPUUtilization',
+                                          dimension_name='InstanceId', dimension_value='i-1',
+                                          since='-30d').resolve()
+    datasource = CWDataSource(config)
+    shards = shard_queries(datasource, query)
+    assert len(shards) > 1
+
+    # the recent shards do not get a finer period than the whole query
+    assert set(datasource.step(shard, maxdatapoints=maxdatapoints)
+               for shard, maxdatapoints in shards) == set([300])
+    assert max(maxdatapoints for _, maxdatapoints in shards) <= 1440
+
+
+def test_find_period():
+    hour, day = 60 * 60, 24 * 60 * 60
+
+    # the largest number of datapoints up to the maxdatapoints
+    assert find_period(12 * hour, 12 * hour, maxdatapoints=100) == 480
+    assert find_period(12 * hour, 12 * hour, maxdatapoints=720) == 60
+    assert find_period(12 * hour, 12 * hour) == 60
+
+    # high resolution metrics only during the first 3 hours
+    assert find_period(hour, hour, maxdatapoints=100, resolution=1) == 60
+    assert find_period(hour, hour, maxdatapoints=400, resolution=1) == 10
+    assert find_period(hour, hour, maxdatapoints=3600, resolution=1) == 1
+    assert find_period(hour, hour, resolution=1) == 1
+    assert find_period(hour, 4 * hour, maxdatapoints=3600, resolution=1) == 60
+
+    # older datapoints are kept using longer periods
+    assert find_period(hour, 20 * day, maxdatapoints=100) == 300
+    assert find_period(day, 20 * day, maxdatapoints=100) == 900
+    assert find_period(day, 100 * day, maxdatapoints=100) == 3600
+    assert find_period(10 * day, 100 * day, maxdatapoints=100) == 3 * 3600
+
+
+@patch(BOTO3)
+def test_query_resolution(boto3, config):
+    query = CWDataSource.METRIC_QUERY_CLS(namespace='App', metricname='Latency',
+                                          dimension_name='Host', dimension_value='a',
+                                          since='-10min', resolution='1')
+    assert CWDataSource(config).step(query, maxdatapoints=120) == 5
+
+    query = CWDataSource.METRIC_QUERY_CLS(namespace='App', metricname='Latency',
+                                          dimension_name='Host', dimension_value='a',
+                                          resolution='foo')
+    with pytest.raises(InvalidMetricQuery):
+        CWDataSource(config).step(query)
+
+
+def test_expand():
+    regions = ('eu-west-1', 'eu-central-1', 'us-east-1')
+    assert expand(None, regions) == [None]
+    assert expand('us-west-2', regions) == ['us-west-2']
+    assert expand('eu-*,us-east-1', regions) == ['eu-west-1', 'eu-central-1', 'us-east-1']
+    assert expand('eu-west-1, eu-*', regions) == ['eu-west-1', 'eu-central-1']
+    assert expand('ap-*', regions) == []
+
+
+@patch(BOTO3)
+class TestFanOut(object):
+    @pytest.fixture
+    def query(self):
+        return CWDataSource.METRIC_QUERY_CLS(namespace='AWS/EC2', metricname='CPUUtilization',
+                                              dimension_name='InstanceId', dimension_value='i-1',
+                                              region='eu-west-1,us-east-1', profile='a,b')
+
+    def test_iter_series(self, boto3, config, query):
+        def session(region_name=None, profile_name=None):
+            client = Mock()
+            client.meta.region_name = region_name
+            client.get_metric_statistics.return_value = {'Datapoints': [
+                {'Timestamp': datetime(2016, 1, 1), 'Average': len(region_name + profile_name)}]}
+            return Mock(client=Mock(return_value=client))
+
+        boto3.session.Session.side_effect = session
+        series = [(name, list(datapoints)) for name, datapoints in
+                  CWDataSource(config).iter_series(query)]
+        assert [name.split(" ")[-1] for name, _ in series] == [
+            'a/eu-west-1', 'a/us-east-1', 'b/eu-west-1', 'b/us-east-1']
+        assert series[0][1] == [(10, 1451606400)]
+
+        # one client for each pair (profile, region)
+        assert boto3.session.Session.call_count == 4
+
+    def test_failed_region_skipped(self, boto3, config, query):
+        client = boto3.session.Session.return_value.client.return_value
+        client.get_metric_statistics.side_effect = ClientError(MagicMock(), Mock())
+        assert list(CWDataSource(config).iter_series(query)) == []
+
+    def test_datapoints_first_target(self, boto3, config, query):
+        client = boto3.session.Session.return_value.client.return_value
+        client.get_metric_statistics.return_value = {'Datapoints': []}
+        assert CWDataSource(config).datapoints(query) == []
+        boto3.session.Session.assert_called_once_with(region_name='eu-west-1', profile_name='a')
@@ -1,11 +1,12 @@
 import pytest
 
-from mock import patch, Mock
+from mock import patch, Mock, ANY
 from requests.exceptions import RequestException
 
-from gramola.utils import parse_date
+from gramola.utils import parse_date, to_timestamp
+from gramola.datasources.base import DataSourceError
 from gramola.datasources.graphite import (
-    DATE_FORMAT,
+    MAX_TARGETS_PER_REQUEST,
     GraphiteDataSource,
     GraphiteMetricQuery
 )
@@ -36,6 +37,13 @@ class TestTest(object):
         graphite = GraphiteDataSource(config)
         assert graphite.test() == True
 
+    def test_error_status(self, prequests, config):
+        response = Mock()
+        response.status_code = 500
+        prequests.get.return_value = response
+        graphite = GraphiteDataSource(config)
+        assert graphite.test() == False
+
 
 @patch(REQUESTS)
 class TestDatapoints(object):
@@ -60,9 +68,10 @@ class TestDatapoints(object):
         prequests.get.assert_called_with(
             'http://localhost:9000/render',
             params={'target': 'foo.bar',
-                    'from': parse_date('-24h').strftime(DATE_FORMAT),
-                    'to': parse_date('-12h').strftime(DATE_FORMAT),
-                    'format': 'json'}
+                    'from': to_timestamp(parse_date('-24h')),
+                    'until': to_timestamp(parse_date('-12h')),
+                    'format': 'json'},
+            timeout=ANY
         )
 
     def test_query_default_values(self, prequests, config):
@@ -84,9 +93,10 @@ class TestDatapoints(object):
         prequests.get.assert_called_with(
             'http://localhost:9000/render',
             params={'target': 'foo.bar',
-                    'from': parse_date('-1h').strftime(DATE_FORMAT),
-                    'to': parse_date('now').strftime(DATE_FORMAT),
-                    'format': 'json'}
+                    'from': to_timestamp(parse_date('-1h')),
+                    'until': to_timestamp(parse_date('now')),
+                    'format': 'json'},
+            timeout=ANY
         )
 
     def test_query_remove_last_None(self, prequests, config):
@@ -110,3 +120,190 @@ class TestDatapoints(object):
         prequests.get.side_effect = RequestException()
         graphite = GraphiteDataSource(config)
         assert graphite.datapoints(query) == []
+
+
+@patch(REQUESTS)
+class TestIterSeries(object):
+    def test_iter_series(self, prequests, config):
+        response = Mock()
+        response.status_code = 200
+        response.iter_lines.return_value = iter([
+            'foo.bar,60,240,60|1.0,None,3.0,None',
+            'sumSeries(foo.*,bar),60,180,60|4.0,5.0',
+            ''
+        ])
+        prequests.get.return_value = response
+        graphite = GraphiteDataSource(config)
+
+        query = GraphiteDataSource.METRIC_QUERY_CLS(**{'target': 'foo.*'}).resolve(now=1000)
+        series = [(target, list(datapoints)) for target, datapoints in graphite.iter_series(query)]
+        assert series == [
+            ('foo.bar', [(1.0, 60), (None, 120), (3.0, 180)]),
+            ('sumSeries(foo.*,bar)', [(4.0, 60), (5.0, 120)])
+        ]
+        prequests.get.assert_called_with(
+            'http://localhost:9000/render',
+            params={'target': 'foo.*', 'from': query.time_range().since,
+                    'until': query.time_range().until, 'format': 'raw'},
+            timeout=ANY,
+            stream=True
+        )
+
+    def test_requests_exception(self, prequests, config):
+        prequests.get.side_effect = RequestException()
+        graphite = GraphiteDataSource(config)
+        query = GraphiteDataSource.METRIC_QUERY_CLS(**{'target': 'foo.*'})
+        assert list(graphite.iter_series(query)) == []
+
+
+@patch(REQUESTS)
+class TestBatch(object):
+    def query(self, target, now=1000):
+        return GraphiteDataSource.METRIC_QUERY_CLS(target=target).resolve(now=now)
+
+    def test_batches(self, prequests, config):
+        graphite = GraphiteDataSource(config)
+        plain = [self.query('foo.{}'.format(i)) for i in range(MAX_TARGETS_PER_REQUEST + 1)]
+        pattern = self.query('foo.*')
+        other = self.query('foo.0', now=5000)
+        batches = graphite.batches(plain + [pattern, other])
+
+        # plain targets with the same time range are fetched together
+        assert batches == [plain[:MAX_TARGETS_PER_REQUEST], plain[MAX_TARGETS_PER_REQUEST:],
+                           [pattern], [other]]
+
+    def test_fetch_batch(self, prequests, config):
+        response = Mock()
+        response.status_code = 200
+        response.iter_lines.return_value = iter([
+            'foo.a,60,180,60|1.0,2.0',
+            'foo.b,60,180,60|3.0,None',
+        ])
+        prequests.get.return_value = response
+        graphite = GraphiteDataSource(config)
+
+        queries = [self.query('foo.a'), self.query('foo.b'), self.query('foo.c'),
+                   self.query('foo.a')]
+        assert graphite.fetch_batch(queries) == [
+            [('foo.a', [(1.0, 60), (2.0, 120)])],
+            [('foo.b', [(3.0, 60)])],
+            [],
+            [('foo.a', [(1.0, 60), (2.0, 120)])]
+        ]
+        prequests.get.assert_called_once_with(
+            'http://localhost:9000/render',
+            params={'target': ['foo.a', 'foo.b', 'foo.c'], 'from': queries[0].time_range().since,
+                    'until': queries[0].time_range().until, 'format': 'raw'},
+            timeout=ANY,
+            stream=True
+        )
+
+    def test_fetch_batch_failed(self, prequests, config):
+        prequests.get.side_effect = RequestException()
+        graphite = GraphiteDataSource(config.__class__(retries='0', **config.dict()))
+        with pytest.raises(DataSourceError):
+            graphite.fetch_batch([self.query('foo.a')])
+
+
+@patch(REQUESTS)
+class TestFind(object):
+    def test_find(self, prequests, config):
+        response = Mock()
+        response.status_code = 200
+        response.json.return_value = [
+            {'text': 'cpu', 'leaf': 1, 'id': 'foo.cpu', 'expandable': 0},
+            {'text': 'disks', 'leaf': 0, 'id': 'foo.disks', 'expandable': 1}
+        ]
+        prequests.get.return_value = response
+        graphite = GraphiteDataSource(config)
+        assert graphite.find('foo.*') == [('cpu', True), ('disks', False)]
+        prequests.get.assert_called_with('http://localhost:9000/metrics/find',
+                                         params={'query': 'foo.*'}, timeout=ANY)
+
+    def test_requests_exception(self, prequests, config):
+        prequests.get.side_effect = RequestException()
+        graphite = GraphiteDataSource(config)
+        assert graphite.find('foo.*') is None
+
+
+@patch("gramola.datasources.graphite.sleep")
+@patch(REQUESTS)
+class TestResilience(object):
+    @pytest.fixture
+    def query(self):
+        return GraphiteDataSource.METRIC_QUERY_CLS(**{'target': 'foo.bar'})
+
+    def test_retry(self, prequests, psleep, config, query):
+        response = Mock()
+        response.status_code = 200
+        response.json.return_value = [{'target': 'foo.bar', 'datapoints': [[1, 1451391760]]}]
+        prequests.get.side_effect = [RequestException(), response]
+        graphite = GraphiteDataSource(config)
+        assert graphite.datapoints(query) == [(1, 1451391760)]
+        assert prequests.get.call_count == 2
+        assert psleep.call_count == 1
+
+    def test_no_retry_client_error(self, prequests, psleep, config, query):
+        response = Mock()
+        response.status_code = 400
+        prequests.get.return_value = response
+        graphite = GraphiteDataSource(config)
+        assert graphite.datapoints(query) == []
+        assert prequests.get.call_count == 1
+
+    def test_retries_config(self, prequests, psleep, config, query):
+        prequests.get.side_effect = RequestException()
+        graphite = GraphiteDataSource(GraphiteDataSource.DATA_SOURCE_CONFIGURATION_CLS(
+            retries='0', **config.dict()))
+        assert graphite.datapoints(query) == []
+        assert prequests.get.call_count == 1
+
+    def test_circuit_opened(self, prequests, psleep, config, query):
+        response = Mock()
+        response.status_code = 503
+        prequests.get.return_value = response
+        graphite = GraphiteDataSource(config)
+        for _ in range(graphite.breaker.failures):
+            graphite.datapoints(query)
+
+        # the backend is not requested until the next probe
+        prequests.get.reset_mock()
+        assert graphite.datapoints(query) == []
+        assert not prequests.get.called
+
+    def test_probe_client_error(self, prequests, psleep, config, query):
+        response = Mock()
+        response.status_code = 404
+        prequests.get.return_value = response
+        graphite = GraphiteDataSource(config)
+        for _ in range(graphite.breaker.failures):
+            graphite.breaker.failure(now=1)
+
+        # the probe is answered, the next requests are sent
+        assert graphite.datapoints(query) == []
+        assert graphite.datapoints(query) == []
+        assert prequests.get.call_count == 2
+
+    def test_timeout(self, prequests, psleep, config, query):
+        prequests.get.side_effect = RequestException()
+        GraphiteDataSource(GraphiteDataSource.DATA_SOURCE_CONFIGURATION_CLS(
+            timeout='2', **config.dict())).datapoints(query)
+        assert prequests.get.call_args[1]['timeout'] <= 2
+
+
+class TestPushDown(object):
+    def test_push_down(self, config):
+        graphite = GraphiteDataSource(config)
+        query = GraphiteDataSource.METRIC_QUERY_CLS(target='servers.*.cpu', since='-1d')
+        pushed = graphite.push_down(query, 'highestCurrent', [10.0])
+        assert pushed.target == 'highestCurrent(servers.*.cpu,10)'
+        assert pushed.since == '-1d'
+        assert graphite.push_down(query, 'lowestMax', [10.0]) is None
+        assert graphite.push_down(query, 'highestMax', [0.0]) is None
+
+    def test_selectors_not_sharded(self, config):
+        graphite = GraphiteDataSource(config)
+        query = GraphiteDataSource.METRIC_QUERY_CLS(target='highestMax(servers.*.cpu,10)')
+        assert graphite.max_seconds_per_request(query) is None
+        query = GraphiteDataSource.METRIC_QUERY_CLS(target='servers.*.cpu')
+        assert graphite.max_seconds_per_request(query) == 24 * 60 * 60
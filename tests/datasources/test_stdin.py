@@ -0,0 +1,67 @@
+import os
+import pytest
+
+from mock import patch
+
+from gramola.datasources.base import InvalidMetricQuery
+from gramola.datasources.stdin import (
+    StdinDataSource,
+    parse_line
+)
+
+
+class TestParseLine(object):
+    def test_value(self):
+        assert parse_line("42\n", now=10) == (42.0, 10)
+        assert parse_line("42 1454872083", now=10) == (42.0, 1454872083.0)
+
+    def test_column(self):
+        line = " 1  0      0 7184232 232 4515152    0    0    32    39  238  476  5  1 94  0  0"
+        assert parse_line(line, column=13, now=10) == (5.0, 10)
+        assert parse_line(line, column=30, now=10) is None
+
+    def test_ndjson(self):
+        assert parse_line('{"value": 42, "ts": 60}') == (42.0, 60.0)
+        assert parse_line('{"value": 42}', now=10) == (42.0, 10)
+        assert parse_line('{"cpu": 42, "timestamp": 60}', field="cpu") == (42.0, 60.0)
+        assert parse_line('{"cpu": 42}') is None
+
+    def test_invalid(self):
+        assert parse_line("") is None
+        assert parse_line("procs -----------memory----------") is None
+        assert parse_line('{"value": ') is None
+
+
+class TestStdinDataSource(object):
+    @pytest.fixture
+    def datasource(self):
+        return StdinDataSource.from_config(type='stdin', name='-')
+
+    def test_poll(self, datasource):
+        query = StdinDataSource.METRIC_QUERY_CLS()
+        column = StdinDataSource.METRIC_QUERY_CLS(column='2')
+        datasource.subscribe(query, maxdatapoints=2)
+        datasource.subscribe(column, maxdatapoints=2)
+
+        read_fd, write_fd = os.pipe()
+        with patch("gramola.datasources.stdin.sys") as sys_patched:
+            sys_patched.stdin.fileno.return_value = read_fd
+            os.write(write_fd, "1 60\n2 120\n3 1")
+            assert datasource.poll(timeout=0) is True
+            assert datasource.datapoints(query) == [(1.0, 60.0), (2.0, 120.0)]
+
+            # the partial line is consumed once the stream is closed
+            os.write(write_fd, "80")
+            os.close(write_fd)
+            assert datasource.poll() is False
+            assert datasource.datapoints(query) == [(2.0, 120.0), (3.0, 180.0)]
+            assert [value for value, ts in datasource.datapoints(column)] == [120.0, 180.0]
+            assert datasource.poll() is False
+        os.close(read_fd)
+
+    def test_not_subscribed(self, datasource):
+        assert datasource.datapoints(StdinDataSource.METRIC_QUERY_CLS()) == []
+
+    def test_invalid_column(self, datasource):
+        with pytest.raises(InvalidMetricQuery):
+            datasource.subscribe(StdinDataSource.METRIC_QUERY_CLS(column='foo'))
@@ -0,0 +1,144 @@
+import os
+import struct
+import pytest
+
+from mock import patch
+
+from gramola.utils import TimeRange
+from gramola.datasources.whisper import (
+    Archive,
+    WhisperDataSource,
+    CorruptWhisperFile,
+    consolidate,
+    pick_archive,
+    read_archives
+)
+
+NOW = 6000
+
+
+def create(filepath, archives):
+    """ Create a whisper file, archives is a list of (seconds_per_point, points,
+    {ts: value}) tuples.
+    """
+    header = struct.pack("!2LfL", 1, archives[-1][0] * archives[-1][1], 0.5, len(archives))
+    offset = len(header) + 12 * len(archives)
+    infos = []
+    data = []
+    for seconds_per_point, points, datapoints in archives:
+        infos.append(struct.pack("!3L", offset, seconds_per_point, points))
+        slots = [(0, 0.0)] * points
+        base = min(datapoints) if datapoints else None
+        for ts, value in sorted(datapoints.items()):
+            slots[((ts - base) / seconds_per_point) % points] = (ts, value)
+        data.append("".join(struct.pack("!Ld", *slot) for slot in slots))
+        offset += 12 * points
+
+    with open(filepath, "wb") as fd:
+        fd.write(header + "".join(infos) + "".join(data))
+
+
+@pytest.fixture
+def root(tmpdir):
+    servers = tmpdir.mkdir("servers")
+    for idx, name in enumerate(["web1", "web2"]):
+        servers.mkdir(name)
+        create(str(servers.join(name, "cpu.wsp")), [
+            (60, 10, {ts: float(ts / 60 + idx) for ts in range(5460, 6000, 60)}),
+            (300, 20, {ts: 1.0 for ts in range(600, 6000, 300)})
+        ])
+    servers.join("web1", "notes.txt").write("")
+    return str(tmpdir)
+
+
+@pytest.fixture
+def datasource(root):
+    return WhisperDataSource.from_config(type='whisper', name='local', root=root)
+
+
+def query(path, since):
+    return WhisperDataSource.METRIC_QUERY_CLS(path=path, since=str(since)).resolve(now=NOW)
+
+
+class TestArchives(object):
+    def test_read_archives(self, root):
+        with open(os.path.join(root, "servers", "web1", "cpu.wsp")) as fd:
+            archives = read_archives(fd.read())
+        assert [(a.seconds_per_point, a.points) for a in archives] == [(60, 10), (300, 20)]
+
+    def test_corrupt(self):
+        with pytest.raises(CorruptWhisperFile):
+            read_archives("foo")
+        with pytest.raises(CorruptWhisperFile):
+            read_archives(struct.pack("!2LfL", 1, 1, 0.5, 1) + struct.pack("!3L", 28, 60, 10))
+
+    def test_pick_archive(self):
+        archives = [Archive(0, 60, 10), Archive(0, 300, 20)]
+        assert pick_archive(archives, TimeRange(5400, 6000), now=6000) == archives[0]
+        # the first archive does not cover the time range
+        assert pick_archive(archives, TimeRange(3000, 6000), now=6000) == archives[1]
+        # the first archive returns too many datapoints
+        assert pick_archive(archives, TimeRange(5400, 6000), maxdatapoints=5,
+                            now=6000) == archives[1]
+
+    def test_consolidate(self):
+        nan = float('nan')
+        values, timestamps = consolidate([1.0, 3.0, nan, 4.0, nan, nan], [0, 1, 2, 3, 4, 5], 3)
+        assert list(values[:2]) == [2.0, 4.0]
+        assert values[2] != values[2]
+        assert list(timestamps) == [0, 2, 4]
+
+
+@patch("gramola.datasources.whisper.time")
+class TestWhisperDataSource(object):
+    def test_expand(self, time_patched, datasource):
+        assert datasource.expand("servers.*.cpu") == ["servers.web1.cpu", "servers.web2.cpu"]
+        assert datasource.expand("servers.web{1,3}.cpu") == ["servers.web1.cpu"]
+        assert datasource.expand("servers.web1.*") == ["servers.web1.cpu"]
+        assert datasource.expand("servers.web1.cpu") == ["servers.web1.cpu"]
+        assert datasource.expand("servers.web1") == []
+        assert datasource.expand("foo.*") == []
+
+    def test_datapoints(self, time_patched, datasource):
+        time_patched.return_value = NOW
+        datapoints = datasource.datapoints(query("servers.web1.cpu", 5400))
+        assert datapoints == [(float(ts / 60), ts) for ts in range(5460, 6000, 60)]
+
+    def test_datapoints_wrap_around(self, time_patched, datasource, root):
+        time_patched.return_value = NOW
+        # the older datapoints are overwritten, the slots are read wrapping
+        # around the end of the archive.
+        create(os.path.join(root, "servers", "web1", "load.wsp"), [
+            (60, 10, {ts: float(ts) for ts in range(5100, 6000, 60)})])
+        datapoints = datasource.datapoints(query("servers.web1.load", 5400))
+        assert datapoints == [(float(ts), ts) for ts in range(5460, 6000, 60)]
+
+    def test_datapoints_lower_precision(self, time_patched, datasource):
+        time_patched.return_value = NOW
+        datapoints = datasource.datapoints(query("servers.web1.cpu", 3000))
+        assert datapoints == [(1.0, ts) for ts in range(3300, 6000, 300)]
+
+    def test_datapoints_maxdatapoints(self, time_patched, datasource):
+        time_patched.return_value = NOW
+        q = query("servers.web1.cpu", 600)
+        datapoints = datasource.datapoints(q, maxdatapoints=6)
+        assert len(datapoints) <= 6
+        assert datasource.step(q, maxdatapoints=6) == 900
+
+    def test_iter_series(self, time_patched, datasource):
+        time_patched.return_value = NOW
+        series = [(path, list(datapoints)) for path, datapoints in
+                  datasource.iter_series(query("servers.*.cpu", 5400))]
+        assert [path for path, _ in series] == ["servers.web1.cpu", "servers.web2.cpu"]
+        # the slots not written yet are given as None
+        assert series[0][1][-2:] == [(99.0, 5940), (None, 6000)]
+        assert series[1][1][-2:] == [(100.0, 5940), (None, 6000)]
+
+    def test_not_found(self, time_patched, datasource):
+        time_patched.return_value = NOW
+        assert datasource.datapoints(query("foo.bar", 5400)) == []
+
+    def test_test(self, time_patched, datasource, root):
+        assert datasource.test() is True
+        assert WhisperDataSource.from_config(type='whisper', name='local',
+                                             root=os.path.join(root, "foo")).test() is False
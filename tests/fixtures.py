@@ -10,7 +10,7 @@ from gramola.datasources.base import (
 )
 
 
-@pytest.fixture
+@pytest.yield_fixture
 def test_data_source():
     class TestDataSourceConfig(DataSourceConfig):
         REQUIRED_KEYS = ('foo', 'bar')
@@ -28,7 +28,11 @@ def test_data_source():
         datapoints = Mock()
         test = Mock()
 
-    return TestDataSource
+    yield TestDataSource
+
+    # classes are released by the garbage collector at any time later on, till
+    # then DataSource.find would keep finding this one.
+    TestDataSource.TYPE = None
 
 
 CONFIG = """
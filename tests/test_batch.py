@@ -0,0 +1,104 @@
+import pytest
+
+from StringIO import StringIO
+from json import dumps, loads
+from mock import Mock
+
+from gramola.batch import read_queries, run_batch, write_records
+from gramola.datasources.base import DataSourceError
+
+from .fixtures import test_data_source
+from .fixtures import nonedefault_store
+
+
+def lines(*queries):
+    return [dumps(query) for query in queries]
+
+
+class TestReadQueries(object):
+    def test_groups(self, test_data_source, nonedefault_store):
+        groups, errors = read_queries(lines(
+            {"datasource": "datasource one", "metric": "foo"},
+            {"datasource": "datasource two", "metric": "bar", "id": "bar"},
+            {"datasource": "datasource one", "metric": "gramola", "since": "-1d"}
+        ), nonedefault_store, now=1000)
+        assert errors == []
+        assert groups.keys() == ["datasource one", "datasource two"]
+
+        datasource, queries = groups["datasource one"]
+        assert isinstance(datasource, test_data_source)
+        assert [(id_, query.metric) for id_, query in queries] == [(1, "foo"), (3, "gramola")]
+        # all queries are resolved using the same time
+        assert queries[1][1].time_range().until == 1000
+        assert queries[1][1].time_range().since == 1000 - 86400
+        assert groups["datasource two"][1][0][0] == "bar"
+
+    def test_errors(self, test_data_source, nonedefault_store):
+        groups, errors = read_queries(["xxx", "[]", ""] + lines(
+            {"metric": "foo"},
+            {"datasource": "xxxx", "metric": "foo"},
+            {"datasource": "datasource one", "foo": "bar"},
+        ), nonedefault_store)
+        assert [(e['id'], e.get('datasource'), e['error'].split(" ")[0]) for e in errors] == [
+            (1, None, "Invalid"), (2, None, "Invalid"), (4, None, "Datasource"),
+            (5, "xxxx", "Datasource"), (6, "datasource one", "Invalid")]
+        assert groups["datasource one"][1] == []
+
+    def test_invalid_time_range(self, test_data_source, nonedefault_store):
+        groups, errors = read_queries(lines(
+            {"datasource": "datasource one", "metric": "foo"},
+            {"datasource": "datasource one", "metric": "bar", "since": "yesterday"},
+            {"datasource": "datasource one", "metric": "gramola"}
+        ), nonedefault_store)
+        assert errors == [{'id': 2, 'datasource': "datasource one",
+                           'error': "Invalid time range yesterday - None"}]
+        assert [id_ for id_, _ in groups["datasource one"][1]] == [1, 3]
+
+
+class TestRunBatch(object):
+    def test_run(self, test_data_source, nonedefault_store):
+        test_data_source.fetch_batch = Mock(
+            side_effect=lambda queries: [[(q.metric, [(1, 60)])] for q in queries])
+        groups, _ = read_queries(lines(
+            {"datasource": "datasource one", "metric": "foo"},
+            {"datasource": "datasource two", "metric": "bar"}
+        ), nonedefault_store)
+        records = sorted(run_batch(groups), key=lambda r: r['id'])
+        assert records == [
+            {'id': 1, 'datasource': 'datasource one',
+             'series': [{'target': 'foo', 'datapoints': [(1, 60)]}]},
+            {'id': 2, 'datasource': 'datasource two',
+             'series': [{'target': 'bar', 'datapoints': [(1, 60)]}]},
+        ]
+
+    def test_batch_failed(self, test_data_source, nonedefault_store):
+        test_data_source.batches = lambda self, queries: [queries]
+        test_data_source.fetch_batch = Mock(side_effect=DataSourceError("Request failed"))
+        groups, _ = read_queries(lines(
+            {"datasource": "datasource one", "metric": "foo"},
+            {"datasource": "datasource one", "metric": "bar"}
+        ), nonedefault_store)
+        records = list(run_batch(groups))
+        assert records == [
+            {'id': 1, 'datasource': 'datasource one', 'error': 'Request failed'},
+            {'id': 2, 'datasource': 'datasource one', 'error': 'Request failed'},
+        ]
+        assert test_data_source.fetch_batch.call_count == 1
+
+    def test_default_fetch_batch(self, test_data_source, nonedefault_store):
+        test_data_source.datapoints.return_value = [(1, 60), (2, 120)]
+        groups, _ = read_queries(lines({"datasource": "datasource one", "metric": "foo"}),
+                                 nonedefault_store)
+        assert list(run_batch(groups)) == [
+            {'id': 1, 'datasource': 'datasource one',
+             'series': [{'target': 'foo', 'datapoints': [(1, 60), (2, 120)]}]}]
+
+    def test_empty(self):
+        assert list(run_batch({})) == []
+
+
+def test_write_records():
+    stream = StringIO()
+    write_records([{'id': 1, 'error': 'foo'}, {'id': 2, 'series': []}], stream)
+    assert [loads(line) for line in stream.getvalue().splitlines()] == [
+        {'id': 1, 'error': 'foo'}, {'id': 2, 'series': []}]
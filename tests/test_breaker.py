@@ -0,0 +1,78 @@
+import random
+import threading
+
+from gramola.breaker import (
+    CircuitBreaker,
+    backoff,
+    CLOSED,
+    OPEN,
+    HALF_OPEN
+)
+
+
+class TestCircuitBreaker(object):
+    def test_opens_after_failures(self):
+        breaker = CircuitBreaker(failures=2, reset_timeout=10)
+        breaker.failure(now=100)
+        assert breaker.allow(now=100)
+        breaker.failure(now=100)
+        assert breaker.state == OPEN
+        assert not breaker.allow(now=105)
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failures=2)
+        breaker.failure(now=100)
+        breaker.success()
+        breaker.failure(now=100)
+        assert breaker.state == CLOSED
+
+    def test_probe(self):
+        breaker = CircuitBreaker(failures=1, reset_timeout=10)
+        breaker.failure(now=100)
+
+        # only one probe is allowed once the reset time is over
+        assert breaker.allow(now=110)
+        assert breaker.state == HALF_OPEN
+        assert not breaker.allow(now=110)
+
+        breaker.success()
+        assert breaker.state == CLOSED
+        assert breaker.allow(now=110)
+
+    def test_one_probe_between_threads(self):
+        breaker = CircuitBreaker(failures=1, reset_timeout=10)
+        breaker.failure(now=100)
+
+        start = threading.Event()
+        allowed = []
+
+        def probe():
+            start.wait()
+            allowed.append(breaker.allow(now=110))
+
+        threads = [threading.Thread(target=probe) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        assert allowed.count(True) == 1
+
+    def test_probe_failed_backoff(self):
+        breaker = CircuitBreaker(failures=1, reset_timeout=10, max_reset_timeout=30)
+        breaker.failure(now=100)
+        assert breaker.allow(now=110)
+        breaker.failure(now=110)
+
+        # the reset time is doubled until the maxium
+        assert not breaker.allow(now=129)
+        assert breaker.allow(now=130)
+        breaker.failure(now=130)
+        assert not breaker.allow(now=159)
+        assert breaker.allow(now=160)
+
+
+def test_backoff():
+    rnd = random.Random(1)
+    assert 0 <= backoff(0, base=0.1, cap=2.0, rnd=rnd) <= 0.1
+    assert all(0 <= backoff(10, base=0.1, cap=2.0, rnd=rnd) <= 2.0 for _ in range(100))
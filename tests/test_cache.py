@@ -0,0 +1,97 @@
+import pytest
+
+from mock import Mock
+
+from gramola.cache import (
+    SeriesCache,
+    fetch_series,
+    query_key
+)
+from gramola.transforms import Series
+from gramola.datasources.base import (
+    MetricQuery,
+    DataSourceConfig
+)
+
+
+class Query(MetricQuery):
+    REQUIRED_KEYS = ('metric',)
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return SeriesCache(str(tmpdir), ttl=60, max_entries=2)
+
+
+@pytest.fixture
+def datasource():
+    datasource = Mock()
+    datasource.configuration = DataSourceConfig(type='test', name='foo')
+    datasource.max_seconds_per_request.return_value = None
+    datasource.step.return_value = None
+    datasource.iter_series.return_value = [('foo', iter([(1, 60), (None, 120)]))]
+    return datasource
+
+
+def test_query_key():
+    config = DataSourceConfig(type='test', name='foo')
+    query = Query(metric='foo').resolve(now=7200)
+    transformed = Query(metric='foo', transform='derivative').resolve(now=7200)
+    assert query_key(config, query) == query_key(config, transformed)
+    assert query_key(config, query) != query_key(config, Query(metric='foo').resolve(now=7260))
+    assert query_key(config, query) != query_key(config, query, maxdatapoints=10)
+
+
+class TestSeriesCache(object):
+    def test_recent_entries_expire(self, cache):
+        series = [Series.from_datapoints('foo', [(1, 60), (None, 120)])]
+        cache.put('key', 1000, series, now=1000)
+        assert cache.get('key', now=1059) == series
+        assert cache.get('key', now=1060) is None
+        assert cache.get('other', now=1000) is None
+
+    def test_past_entries_do_not_expire(self, cache):
+        series = [Series.from_datapoints('foo', [(1, 60)])]
+        cache.put('key', 100, series, now=1000)
+        assert cache.get('key', now=100000) == series
+
+    def test_evict(self, cache, tmpdir):
+        series = [Series.from_datapoints('foo', [(1, 60)])]
+        for key in ('a', 'b', 'c'):
+            cache.put(key, 100, series, now=1000)
+        assert len(tmpdir.listdir()) == 2
+
+
+class TestFetchSeries(object):
+    def test_fetch(self, cache, datasource):
+        query = Query(metric='foo').resolve(now=7200)
+        expected = [Series.from_datapoints('foo', [(1, 60), (None, 120)])]
+        assert fetch_series(datasource, query, cache=cache, now=7200) == expected
+
+        # a different transform uses the series cached
+        transformed = Query(metric='foo', transform='derivative').resolve(now=7200)
+        assert fetch_series(datasource, transformed, cache=cache, now=7200) == expected
+        assert datasource.iter_series.call_count == 1
+
+    def test_empty_not_cached(self, cache, datasource):
+        datasource.iter_series.return_value = []
+        query = Query(metric='foo').resolve(now=7200)
+        assert fetch_series(datasource, query, cache=cache, now=7200) == []
+        assert fetch_series(datasource, query, cache=cache, now=7200) == []
+        assert datasource.iter_series.call_count == 2
+
+    def test_shards_cached(self, tmpdir, datasource):
+        cache = SeriesCache(str(tmpdir), ttl=60)
+        datasource.max_seconds_per_request.return_value = 3600
+        datasource.iter_series.side_effect = lambda query, maxdatapoints: [
+            ('foo', iter([(1, query.time_range().since)]))]
+
+        query = Query(metric='foo', since='-3h').resolve(now=10800 + 1800)
+        series = fetch_series(datasource, query, cache=cache, now=10800 + 1800)
+        assert series[0].datapoints() == [(1, 1800), (1, 3600), (1, 7200), (1, 10800)]
+        assert datasource.iter_series.call_count == 4
+
+        # only the shards that are not closed yet are fetched again
+        query = Query(metric='foo', since='-3h').resolve(now=10800 + 1860)
+        fetch_series(datasource, query, cache=cache, now=10800 + 1860)
+        assert datasource.iter_series.call_count == 6
@@ -0,0 +1,89 @@
+import pytest
+
+from mock import Mock
+
+from gramola.catalogue import CWCatalogue
+
+
+def metric(namespace, name, **dimensions):
+    return {'Namespace': namespace, 'MetricName': name,
+            'Dimensions': [{'Name': k, 'Value': v} for k, v in dimensions.items()]}
+
+METRICS = [
+    metric('AWS/EC2', 'CPUUtilization', InstanceId='i-1'),
+    metric('AWS/EC2', 'CPUCreditBalance', InstanceId='i-1'),
+    metric('AWS/EC2', 'CPUUtilization', InstanceId='i-2'),
+    metric('AWS/EC2', 'NetworkIn', AutoScalingGroupName='web'),
+    metric('AWS/ELB', 'Latency', LoadBalancerName='web', AvailabilityZone='eu-west-1a'),
+]
+
+
+@pytest.fixture
+def datasource():
+    datasource = Mock()
+    datasource.list_metrics.side_effect = lambda namespace=None, region=None: iter(
+        [m for m in METRICS if namespace is None or m['Namespace'] == namespace])
+    return datasource
+
+
+@pytest.fixture
+def catalogue(tmpdir, datasource):
+    catalogue = CWCatalogue(str(tmpdir.join('catalogue.db')), datasource=datasource, ttl=10)
+    catalogue.refresh()
+    return catalogue
+
+
+class TestCWCatalogue(object):
+    def test_empty(self, tmpdir, datasource):
+        catalogue = CWCatalogue(str(tmpdir.join('catalogue.db')), datasource=datasource)
+        assert catalogue.empty()
+        catalogue.refresh()
+        assert not catalogue.empty()
+
+    def test_search_dimension(self, catalogue):
+        assert catalogue.search(dimension=('InstanceId', 'i-1')) == [
+            ('AWS/EC2', 'CPUCreditBalance', [('InstanceId', 'i-1')]),
+            ('AWS/EC2', 'CPUUtilization', [('InstanceId', 'i-1')])]
+        assert len(catalogue.search(dimension=('InstanceId', None))) == 3
+        assert catalogue.search(dimension=('LoadBalancerName', 'web')) == [
+            ('AWS/ELB', 'Latency', [('AvailabilityZone', 'eu-west-1a'),
+                                    ('LoadBalancerName', 'web')])]
+
+    def test_search_prefix_namespace(self, catalogue):
+        assert len(catalogue.search(prefix='CPU')) == 3
+        assert len(catalogue.search(prefix='CPUU')) == 2
+        assert len(catalogue.search(namespace='AWS/ELB')) == 1
+
+    def test_refresh_expired(self, catalogue, datasource):
+        METRICS.append(metric('AWS/RDS', 'CPUUtilization', DBInstanceIdentifier='db'))
+        removed = METRICS.pop(0)
+        try:
+            # AWS/EC2 is fresh, only the new namespace is saved
+            catalogue.refresh_in_background(expired=True).join()
+            assert len(catalogue.search(namespace='AWS/RDS')) == 1
+            assert len(catalogue.search(namespace='AWS/EC2')) == 4
+            assert catalogue.expired(now=2**32) == ['AWS/EC2', 'AWS/ELB', 'AWS/RDS']
+
+            # once expired the metrics not seen are removed
+            catalogue.refresh(expired=True, now=2**32)
+            assert len(catalogue.search(namespace='AWS/EC2')) == 3
+        finally:
+            METRICS.insert(0, removed)
+            METRICS.pop()
+        assert catalogue.search(namespace='AWS/ELB', prefix='CPU') == []
+
+    def test_expired(self, catalogue):
+        assert catalogue.expired() == []
+        assert catalogue.expired(now=2**32) == ['AWS/EC2', 'AWS/ELB']
+
+    def test_refresh_namespace(self, catalogue, datasource):
+        removed = METRICS.pop(0)
+        try:
+            catalogue.refresh_in_background(namespaces=['AWS/EC2']).join()
+        finally:
+            METRICS.insert(0, removed)
+
+        datasource.list_metrics.assert_called_with(namespace='AWS/EC2', region=None)
+        assert catalogue.search(dimension=('InstanceId', 'i-1')) == [
+            ('AWS/EC2', 'CPUCreditBalance', [('InstanceId', 'i-1')])]
+        assert len(catalogue.search(namespace='AWS/ELB')) == 1
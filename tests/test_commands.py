@@ -1,9 +1,12 @@
+import os
 import pytest
 import sparkline
 
 from copy import copy
+from threading import Event
+from StringIO import StringIO
 from json import loads, dumps
-from mock import patch, Mock
+from mock import patch, Mock, call
 
 from gramola.commands import (
     InvalidParams,
@@ -12,10 +15,21 @@ from gramola.commands import (
     DataSourceRmCommand,
     DataSourceTestCommand,
     DataSourceListCommand,
+    StoreImportCommand,
+    QueryBatchCommand,
     build_datasource_add_type,
     build_datasource_echo_type,
-    build_datasource_query_type
+    build_datasource_query_type,
+    write_queries,
+    check_datasources,
+    format_checks,
+    stream_series,
+    report_rate_limits
 )
+from gramola.output import NDJSONWriter
+from gramola.heatmap import Bins
+from gramola.store import Store
+from gramola.transforms import Pipeline
 
 from gramola.datasources.base import (
     MetricQuery,
@@ -34,7 +48,20 @@ def empty_options(nonedefault_store):
 
 @pytest.fixture
 def empty_suboptions():
-    return Mock()
+    return Mock(rollup=False, interactive=False)
+
+
+@pytest.fixture
+def query_suboptions(empty_suboptions):
+    # defaults of the query commands, one plot fetched once
+    empty_suboptions.refresh = False
+    empty_suboptions.refresh_freq = 10
+    empty_suboptions.since = None
+    empty_suboptions.until = None
+    empty_suboptions.grid = None
+    empty_suboptions.output = None
+    empty_suboptions.transform = None
+    return empty_suboptions
 
 
 class TestGramolaCommand(object):
@@ -98,26 +125,152 @@ class TestDataSourceRm(object):
             DataSourceRmCommand.execute(empty_options, empty_suboptions)
 
 
+@pytest.fixture
+def test_suboptions(empty_suboptions):
+    empty_suboptions.all = False
+    empty_suboptions.type = None
+    empty_suboptions.json = False
+    empty_suboptions.timeout = 1
+    return empty_suboptions
+
+
 class TestDataSourceTest(object):
-    def test_execute(self, empty_options, empty_suboptions, test_data_source, nonedefault_store):
+    def test_execute(self, empty_options, test_suboptions, test_data_source, nonedefault_store):
         test_data_source.test.return_value = True
         empty_options.store = nonedefault_store.path
-        DataSourceTestCommand.execute(empty_options, empty_suboptions, "datasource one")
-        test_data_source.test.assert_called
+        with patch("__builtin__.print") as print_patched:
+            DataSourceTestCommand.execute(empty_options, test_suboptions, "datasource one")
+            assert print_patched.call_count == 2
+            assert print_patched.call_args_list[0][0][0].split() == [
+                "NAME", "TYPE", "STATUS", "LATENCY"]
+            assert print_patched.call_args[0][0].startswith("datasource one  test  ok  ")
+        test_data_source.test.assert_called_once_with()
+
+    def test_execute_failed(self, empty_options, test_suboptions, test_data_source,
+                            nonedefault_store):
+        test_data_source.test.return_value = False
+        empty_options.store = nonedefault_store.path
+        with patch("__builtin__.print") as print_patched:
+            DataSourceTestCommand.execute(empty_options, test_suboptions, "datasource one")
+            assert print_patched.call_args[0][0].startswith("datasource one  test  FAILED  ")
 
-    def test_execute_not_found(self, empty_options, empty_suboptions,
+    def test_execute_not_found(self, empty_options, test_suboptions,
                                test_data_source, nonedefault_store):
         empty_options.store = nonedefault_store.path
         with patch("__builtin__.print") as print_patched:
-            DataSourceTestCommand.execute(empty_options, empty_suboptions, "xxxx")
+            DataSourceTestCommand.execute(empty_options, test_suboptions, "xxxx")
             print_patched.assert_called_with("Datasource `xxxx` not found, NOT TESTED")
 
-    def test_invalid_params(self, empty_options, empty_suboptions, test_data_source,
+    def test_execute_all_json(self, empty_options, test_suboptions, test_data_source,
+                              nonedefault_store):
+        test_data_source.test.return_value = True
+        empty_options.store = nonedefault_store.path
+        test_suboptions.all = True
+        test_suboptions.json = True
+        with patch("__builtin__.print") as print_patched:
+            DataSourceTestCommand.execute(empty_options, test_suboptions)
+            results = loads(print_patched.call_args[0][0])
+        assert [(r['name'], r['type'], r['status']) for r in results] == [
+            ('datasource one', 'test', 'ok'), ('datasource two', 'test', 'ok')]
+        assert all(r['latency'] >= 0 for r in results)
+
+    def test_execute_type(self, empty_options, test_suboptions, test_data_source,
+                          nonedefault_store):
+        empty_options.store = nonedefault_store.path
+        test_suboptions.type = 'graphite'
+        with patch("__builtin__.print") as print_patched:
+            DataSourceTestCommand.execute(empty_options, test_suboptions)
+            assert not print_patched.called
+        assert not test_data_source.test.called
+
+    def test_execute_timeout(self, empty_options, test_suboptions, test_data_source,
+                             nonedefault_store):
+        event = Event()
+        test_data_source.test.side_effect = lambda: event.wait(5)
+        empty_options.store = nonedefault_store.path
+        test_suboptions.timeout = 0.05
+        try:
+            with patch("__builtin__.print") as print_patched:
+                DataSourceTestCommand.execute(empty_options, test_suboptions,
+                                              "datasource one", "datasource two")
+                print_patched.assert_any_call("datasource one  test  TIMED OUT  >0.05s")
+                print_patched.assert_any_call("datasource two  test  TIMED OUT  >0.05s")
+        finally:
+            event.set()
+
+    def test_check_datasources_daemon(self, test_data_source, nonedefault_store):
+        event = Event()
+        test_data_source.test.side_effect = lambda: event.wait(5)
+        try:
+            with patch("gramola.commands.threading.Thread") as thread_patched:
+                check_datasources(nonedefault_store.datasources(name="datasource one"),
+                                  timeout=0.01)
+            # the checks left behind do not keep the process alive
+            assert thread_patched.return_value.daemon is True
+        finally:
+            event.set()
+
+    def test_format_checks(self):
+        config = Mock(type='graphite')
+        config.name = 'web'
+        assert format_checks([(config, 'ok', 0.012), (config, 'timeout', 5)]) == [
+            "NAME  TYPE      STATUS     LATENCY",
+            "web   graphite  ok         12ms",
+            "web   graphite  TIMED OUT  >5s",
+        ]
+
+    def test_check_datasources_exception(self, test_data_source, nonedefault_store):
+        test_data_source.test.side_effect = ValueError()
+        results = check_datasources(nonedefault_store.datasources(name="datasource one"))
+        assert [(config.name, status) for config, status, _ in results] == [
+            ('datasource one', 'failed')]
+
+    def test_invalid_params(self, empty_options, test_suboptions, test_data_source,
                             nonedefault_store):
         empty_options.store = nonedefault_store.path
         # DataSource takes one param
         with pytest.raises(InvalidParams):
-            DataSourceTestCommand.execute(empty_options, empty_suboptions)
+            DataSourceTestCommand.execute(empty_options, test_suboptions)
+
+
+class TestStoreImport(object):
+    def test_execute(self, empty_options, empty_suboptions, test_data_source, nonedefault_store):
+        empty_options.store = nonedefault_store.path
+        with patch("__builtin__.print") as print_patched:
+            StoreImportCommand.execute(empty_options, empty_suboptions)
+            print_patched.assert_any_call("Datasource `datasource one` imported")
+            print_patched.assert_any_call("Datasource `datasource two` imported")
+        assert Store(path=nonedefault_store.path).backend.NAME == 'sqlite'
+
+
+class TestQueryBatch(object):
+    @patch("gramola.commands.sys")
+    def test_execute(self, sys_patched, empty_options, empty_suboptions, test_data_source,
+                     nonedefault_store):
+        empty_options.store = nonedefault_store.path
+        empty_suboptions.workers = 2
+        test_data_source.datapoints.return_value = [(1, 60)]
+        sys_patched.stdin = StringIO("\n".join([
+            dumps({"datasource": "datasource one", "metric": "foo"}),
+            dumps({"datasource": "xxxx", "metric": "foo"})]))
+        sys_patched.stdout = StringIO()
+        QueryBatchCommand.execute(empty_options, empty_suboptions)
+        assert [loads(line) for line in sys_patched.stdout.getvalue().splitlines()] == [
+            {"id": 2, "datasource": "xxxx", "error": "Datasource not found"},
+            {"id": 1, "datasource": "datasource one",
+             "series": [{"target": "foo", "datapoints": [[1, 60]]}]}]
+
+    def test_execute_file(self, empty_options, empty_suboptions, test_data_source,
+                          nonedefault_store, tmpdir):
+        empty_options.store = nonedefault_store.path
+        empty_suboptions.workers = 2
+        test_data_source.datapoints.return_value = [(1, 60)]
+        fd = tmpdir.join("queries")
+        fd.write(dumps({"datasource": "datasource one", "metric": "foo", "id": "foo"}))
+        with patch("gramola.commands.sys") as sys_patched:
+            sys_patched.stdout = StringIO()
+            QueryBatchCommand.execute(empty_options, empty_suboptions, str(fd))
+            assert loads(sys_patched.stdout.getvalue())["id"] == "foo"
 
 
 class TestDataSourceAdd(object):
@@ -188,22 +341,238 @@ class TestDataSourceList(object):
 class TestQueryCommand(object):
     @patch("gramola.commands.sys")
     @patch("gramola.commands.Plot")
-    def test_execute_stdin(self, plot_patched, sys_patched, empty_options, empty_suboptions,
+    def test_execute_stdin(self, plot_patched, sys_patched, empty_options, query_suboptions,
                            test_data_source):
-        empty_suboptions.refresh = False
+        plot_patched.return_value.maxdatapoints.return_value = 80
         datapoints = [(1, 0), (2, 1), (3, 1)]
         buffer_ = dumps({'type': 'test', 'name': 'stdout', 'foo': 1, 'bar': 1})
         sys_patched.stdin.read.return_value = buffer_
 
         test_data_source.datapoints.return_value = datapoints
         command = build_datasource_query_type(test_data_source)
-        command.execute(empty_options, empty_suboptions, "-", "foo", "-1d", "now")
-        plot_patched.return_value.draw.assert_called_with(datapoints)
+        command.execute(empty_options, query_suboptions, "-", "foo", "-1d", "now")
+        plot_patched.return_value.draw.assert_called_with(datapoints, stale=False)
 
         test_data_source.datapoints.assert_call_with(
             test_data_source.METRIC_QUERY_CLS(metric='foo', since='-1d', until='now')
         )
 
+    @patch("gramola.commands.sys")
+    @patch("gramola.commands.Heatmap")
+    def test_execute_heatmap(self, heatmap_patched, sys_patched, empty_options, query_suboptions,
+                             test_data_source):
+        query_suboptions.plot_mode = 'heatmap'
+        heatmap_patched.return_value.maxdatapoints.return_value = 80
+        buffer_ = dumps({'type': 'test', 'name': 'stdout', 'foo': 1, 'bar': 1})
+        sys_patched.stdin.read.return_value = buffer_
+
+        heatmap_patched.return_value.bins = lambda time_range: Bins(4, 2, time_range)
+
+        # the heatmap bins all series as they are streamed
+        test_data_source.iter_series = lambda self, query, maxdatapoints=None: iter([
+            ('a', iter([(1, query.time_range().until)])),
+            ('b', iter([(None, query.time_range().until)]))])
+        command = build_datasource_query_type(test_data_source)
+        with patch("gramola.commands.log") as log_patched:
+            command.execute(empty_options, query_suboptions, "-", "foo")
+        assert not log_patched.warning.called
+        bins = heatmap_patched.return_value.draw.call_args[0][0]
+        assert (bins.series, bins.datapoints) == (2, 1)
+        assert heatmap_patched.return_value.draw.call_args[1] == {'stale': False}
+
+        query_suboptions.grid = "2x1"
+        with pytest.raises(InvalidParams):
+            command.execute(empty_options, query_suboptions, "-", "foo")
+
+    @patch("gramola.commands.sys")
+    @patch("gramola.commands.Plot")
+    def test_execute_transform(self, plot_patched, sys_patched, empty_options, query_suboptions,
+                               test_data_source):
+        query_suboptions.transform = "derivative|scale(2)"
+        plot_patched.return_value.maxdatapoints.return_value = 80
+        buffer_ = dumps({'type': 'test', 'name': 'stdout', 'foo': 1, 'bar': 1})
+        sys_patched.stdin.read.return_value = buffer_
+
+        test_data_source.datapoints.return_value = [(1, 60), (2, 120), (4, 180)]
+        command = build_datasource_query_type(test_data_source)
+        command.execute(empty_options, query_suboptions, "-", "foo")
+        plot_patched.return_value.draw.assert_called_with([(0, 60), (2.0, 120), (4.0, 180)],
+                                                           stale=False)
+
+    @patch("gramola.commands.sys")
+    @patch("gramola.commands.Scheduler")
+    @patch("gramola.commands.Plot")
+    def test_execute_stale(self, plot_patched, scheduler_patched, sys_patched, empty_options,
+                           query_suboptions, test_data_source):
+        query_suboptions.refresh = True
+        plot_patched.return_value.maxdatapoints.return_value = 80
+        scheduler_patched.return_value.wait.side_effect = [[0], [0], KeyboardInterrupt()]
+        scheduler_patched.return_value.step.return_value = 60
+        buffer_ = dumps({'type': 'test', 'name': 'stdout', 'foo': 1, 'bar': 1})
+        sys_patched.stdin.read.return_value = buffer_
+
+        # the second fetch fails, the last good datapoints are kept
+        datapoints = [(1, 60), (2, 120)]
+        test_data_source.datapoints.side_effect = [datapoints, []]
+        command = build_datasource_query_type(test_data_source)
+        command.execute(empty_options, query_suboptions, "-", "foo")
+        plot_patched.return_value.draw.assert_called_with(datapoints, stale=True)
+
+    @patch("gramola.commands.sys")
+    def test_invalid_transform(self, sys_patched, empty_options, query_suboptions,
+                               test_data_source):
+        query_suboptions.transform = "foo(1)"
+        buffer_ = dumps({'type': 'test', 'name': 'stdout', 'foo': 1, 'bar': 1})
+        sys_patched.stdin.read.return_value = buffer_
+        command = build_datasource_query_type(test_data_source)
+        with pytest.raises(InvalidParams):
+            command.execute(empty_options, query_suboptions, "-", "foo")
+
+    @patch("gramola.commands.sys")
+    @patch("gramola.commands.Grid")
+    def test_execute_grid(self, grid_patched, sys_patched, empty_options, query_suboptions,
+                          test_data_source):
+        query_suboptions.grid = "2x1"
+        grid_patched.return_value.maxdatapoints.return_value = 40
+        datapoints = [(1, 0), (2, 1), (3, 1)]
+        buffer_ = dumps({'type': 'test', 'name': 'stdout', 'foo': 1, 'bar': 1})
+        sys_patched.stdin.read.return_value = buffer_
+
+        test_data_source.datapoints.return_value = datapoints
+        command = build_datasource_query_type(test_data_source)
+        command.execute(empty_options, query_suboptions, "-", "foo", "bar")
+
+        # one panel for each query
+        assert grid_patched.call_args[0][:3] == (['foo', 'bar'], 2, 1)
+        grid_patched.return_value.draw.assert_called_with([datapoints, datapoints], [False, False])
+
+    @patch("gramola.commands.sys")
+    def test_execute_output(self, sys_patched, empty_options, query_suboptions,
+                            test_data_source):
+        query_suboptions.output = "csv"
+        buffer_ = dumps({'type': 'test', 'name': 'stdout', 'foo': 1, 'bar': 1})
+        sys_patched.stdin.read.return_value = buffer_
+        sys_patched.stdout = StringIO()
+
+        test_data_source.datapoints.return_value = [(1, 60), (2, 120)]
+        command = build_datasource_query_type(test_data_source)
+        command.execute(empty_options, query_suboptions, "-", "foo", "bar")
+
+        # one series for each query, without padding
+        assert sys_patched.stdout.getvalue().splitlines() == [
+            "target,ts,value", "foo,60,1", "foo,120,2", "bar,60,1", "bar,120,2"]
+
+    @patch("gramola.commands.sys")
+    def test_execute_push_down(self, sys_patched, empty_options, query_suboptions,
+                               test_data_source):
+        query_suboptions.output = "csv"
+        query_suboptions.transform = "highestMax(1)|scale(2)"
+        buffer_ = dumps({'type': 'test', 'name': 'stdout', 'foo': 1, 'bar': 1})
+        sys_patched.stdin.read.return_value = buffer_
+        sys_patched.stdout = StringIO()
+
+        # the selector is applied by the datasource, only the scale by Gramola
+        test_data_source.push_down = lambda self, query, transform, args: query.__class__(
+            metric="{}({})".format(transform, query.metric)) if transform == 'highestMax' else None
+        test_data_source.datapoints.return_value = [(1, 60)]
+        command = build_datasource_query_type(test_data_source)
+        command.execute(empty_options, query_suboptions, "-", "foo")
+
+        assert sys_patched.stdout.getvalue().splitlines() == [
+            "target,ts,value", "highestMax(foo),60,2.0"]
+
+    @patch("gramola.commands.time")
+    @patch("gramola.commands.Plot")
+    def test_execute_aligned(self, plot_patched, time_patched, empty_options, query_suboptions,
+                             test_data_source):
+        empty_options.store = None
+        plot_patched.return_value.maxdatapoints.return_value = 80
+        test_data_source.datapoints.return_value = [(1, 7140)]
+        command = build_datasource_query_type(test_data_source)
+
+        # the step is unknown, runs close in time share the same time range
+        time_ranges = []
+        for now in (7201.5, 7203):
+            time_patched.return_value = now
+            with patch("gramola.commands.sys") as sys_patched:
+                sys_patched.stdin.read.return_value = dumps(
+                    {'type': 'test', 'name': 'stdout', 'foo': 1, 'bar': 1})
+                command.execute(empty_options, query_suboptions, "-", "foo")
+            time_ranges.append(test_data_source.datapoints.call_args[0][0].time_range())
+        assert time_ranges == [(3600, 7200), (3600, 7200)]
+
+    @patch("gramola.commands.time")
+    @patch("gramola.commands.Plot")
+    def test_execute_rollup(self, plot_patched, time_patched, empty_options, query_suboptions,
+                            test_data_source, nonedefault_store):
+        empty_options.store = nonedefault_store.path
+        query_suboptions.rollup = True
+        time_patched.return_value = 7200
+        plot_patched.return_value.maxdatapoints.return_value = 60
+        datapoints = [(1, 3648), (2, 3712)]
+
+        test_data_source.datapoints.return_value = datapoints
+        command = build_datasource_query_type(test_data_source)
+        command.execute(empty_options, query_suboptions, "datasource one", "foo")
+        plot_patched.return_value.draw.assert_called_with(datapoints, stale=False)
+
+        # the rollups of the saved datasource are kept by the store
+        assert len(os.listdir(os.path.join(nonedefault_store.path, "rollup"))) == 1
+
+    @patch("gramola.commands.SeriesCache")
+    @patch("gramola.commands.Plot")
+    def test_execute_snapshot(self, plot_patched, cache_patched, empty_options, query_suboptions,
+                              test_data_source, nonedefault_store):
+        # the second launch has to fetch the series again
+        cache_patched.from_store.return_value = None
+        empty_options.store = nonedefault_store.path
+        plot_patched.return_value.maxdatapoints.return_value = 80
+        command = build_datasource_query_type(test_data_source)
+
+        test_data_source.datapoints.return_value = [(1, 0), (2, 1)]
+        command.execute(empty_options, query_suboptions, "datasource one", "foo")
+        plot_patched.return_value.draw.assert_called_once_with([(1, 0), (2, 1)], stale=False)
+
+        # the next launch paints the last series as stale before fetching the fresh ones
+        plot_patched.return_value.draw.reset_mock()
+        test_data_source.datapoints.return_value = [(3, 2)]
+        command.execute(empty_options, query_suboptions, "datasource one", "foo")
+        assert plot_patched.return_value.draw.call_args_list == [
+            call([(1, 0), (2, 1)], stale=True), call([(3, 2)], stale=False)]
+
+    @patch("gramola.commands.sys")
+    @patch("gramola.commands.Plot")
+    def test_execute_live(self, plot_patched, sys_patched, empty_options, query_suboptions,
+                          test_data_source):
+        plot_patched.return_value.maxdatapoints.return_value = 80
+        datapoints = [(1, 0), (2, 1), (3, 1)]
+
+        test_data_source.LIVE = True
+        test_data_source.CONSUMES_STDIN = True
+        # the keys are compiled when the class is created, use a config without foo and bar
+        test_data_source.DATA_SOURCE_CONFIGURATION_CLS = type('LiveConfig', (DataSourceConfig,), {})
+        test_data_source.subscribe = Mock()
+        test_data_source.poll = Mock(side_effect=[True, False])
+        test_data_source.datapoints.return_value = datapoints
+        command = build_datasource_query_type(test_data_source)
+        command.execute(empty_options, query_suboptions, "-", "foo")
+
+        # the stdin is not read as a config, it is consumed until it is closed
+        assert not sys_patched.stdin.read.called
+        test_data_source.subscribe.assert_called_with(
+            test_data_source.METRIC_QUERY_CLS(metric='foo'), maxdatapoints=80)
+        assert test_data_source.poll.call_count == 2
+        plot_patched.return_value.draw.assert_called_once_with(datapoints, stale=False)
+
+    @patch("gramola.commands.sys")
+    def test_invalid_grid(self, sys_patched, empty_options, query_suboptions, test_data_source):
+        query_suboptions.grid = "foo"
+        buffer_ = dumps({'type': 'test', 'name': 'stdout', 'foo': 1, 'bar': 1})
+        sys_patched.stdin.read.return_value = buffer_
+        command = build_datasource_query_type(test_data_source)
+        with pytest.raises(InvalidParams):
+            command.execute(empty_options, query_suboptions, "-", "foo")
+
     @patch("gramola.commands.sys")
     def test_invalid_params(self, sys_patched, empty_options, empty_suboptions, test_data_source):
         # query test_data_source takes four required params
@@ -212,3 +581,64 @@ class TestQueryCommand(object):
         command = build_datasource_echo_type(test_data_source)
         with pytest.raises(InvalidParams):
             command.execute(empty_options, empty_suboptions, "-")
+
+
+class TestWriteQueries(object):
+    @patch("gramola.commands.time")
+    @patch("gramola.scheduler.sleep")
+    @patch("gramola.scheduler.time")
+    def test_refresh_newer(self, scheduler_time, sleep_patched, time_patched):
+        class Query(MetricQuery):
+            REQUIRED_KEYS = ('metric',)
+
+        scheduler_time.return_value = time_patched.return_value = 1000
+        fetched = [[(1, 60), (2, 120)], [(2, 120), (3, 180)]]
+        datasource = Mock()
+        datasource.step.return_value = 60
+        datasource.iter_series.side_effect = [
+            iter([('foo', iter(datapoints))]) for datapoints in fetched]
+
+        # the second fetch is interrupted by the user
+        sleep_patched.side_effect = [None, KeyboardInterrupt()]
+        stream = StringIO()
+        write_queries(datasource, [Query(metric='foo')], NDJSONWriter(stream), refresh=True)
+
+        assert [loads(line) for line in stream.getvalue().splitlines()] == [
+            {'target': 'foo', 'ts': 60, 'value': 1},
+            {'target': 'foo', 'ts': 120, 'value': 2},
+            {'target': 'foo', 'ts': 180, 'value': 3}]
+
+        # the second fetch starts at the last datapoint written
+        assert datasource.iter_series.call_args[0][0].time_range().since == 120
+
+
+@patch("gramola.commands.log")
+@patch("gramola.commands.ratelimit_report")
+def test_report_rate_limits(report_patched, log_patched):
+    report_patched.return_value = [((None, 'eu-west-1'), 10, 2.5), (('sandbox', 'us-east-1'), 1, 0)]
+    report_rate_limits()
+    log_patched.info.assert_called_once_with("API calls of default/eu-west-1: 10, queued 2.50s")
+    log_patched.debug.assert_called_once_with("API calls of sandbox/us-east-1: 1, queued 0.00s")
+
+
+class TestStreamSeries(object):
+    @pytest.fixture
+    def datasource(self):
+        datasource = Mock()
+        datasource.max_seconds_per_request.return_value = None
+        datasource.iter_series.return_value = iter([('foo', iter([(1, 60)])),
+                                                    ('bar', iter([(2, 60)]))])
+        return datasource
+
+    def test_selector_streamed(self, datasource):
+        raw = stream_series(datasource, MetricQuery(), None, Pipeline("highestMax(1)|scale(2)"))
+        assert not isinstance(raw, list)
+        assert [s.name for s in Pipeline("highestMax(1)").apply(raw)] == ['bar']
+
+    @patch("gramola.commands.fetch_series")
+    def test_not_streamed(self, fetch_series_patched, datasource):
+        fetch_series_patched.return_value = []
+        assert stream_series(datasource, MetricQuery(), None, Pipeline("scale(2)")) == []
+        assert stream_series(datasource, MetricQuery(), None, Pipeline("highestMax(1)"),
+                             cache=Mock()) == []
+        assert not datasource.iter_series.called
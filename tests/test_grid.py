@@ -0,0 +1,66 @@
+import pytest
+
+from StringIO import StringIO
+from mock import patch
+
+from gramola.grid import Grid, parse_grid
+
+
+class TestParseGrid(object):
+    def test_parse(self):
+        assert parse_grid("3x4") == (3, 4)
+        assert parse_grid("1X2") == (1, 2)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            parse_grid("foo")
+        with pytest.raises(ValueError):
+            parse_grid("0x1")
+
+
+FRAME_FIXTURE = """one    two
+|    * |    *
+|   ** |   **
++---+- +---+-
+min=1, min=1,
+three
+|    *
+|    *
++---+-
+min=4,
+"""
+
+
+@patch("gramola.plot.sys")
+class TestGrid(object):
+    def test_too_many_panels(self, sys_patched):
+        with pytest.raises(ValueError):
+            Grid(['one', 'two', 'three'], 1, 2, width=80)
+
+    def test_layout(self, sys_patched):
+        grid = Grid(['one', 'two', 'three'], 2, 2, plot_rows=2, width=13)
+        assert grid.panel_width == 6
+        assert grid.maxdatapoints(0) == 5
+        assert grid.height() == 10
+
+    def test_draw(self, sys_patched):
+        sys_patched.stdout = StringIO()
+        grid = Grid(['one', 'two', 'three'], 2, 2, plot_rows=2, width=13)
+        grid.draw([[(1, 1), (2, 1)], [(1, 1), (2, 1)], [(4, 1)]])
+        assert sys_patched.stdout.getvalue() == FRAME_FIXTURE
+
+    def test_draw_only_changed_panels(self, sys_patched):
+        sys_patched.stdout = StringIO()
+        grid = Grid(['one', 'two'], 2, 1, plot_rows=2, width=13)
+        grid.draw([[(1, 1)], [(1, 1)]])
+        sys_patched.stdout = StringIO()
+
+        # nothing changed nothing is written
+        grid.draw([[(1, 1)], [(1, 1)]])
+        assert sys_patched.stdout.getvalue() == ""
+
+        # only the lines of the second panel are written
+        grid.draw([[(1, 1)], [(2, 1)]])
+        output = sys_patched.stdout.getvalue()
+        assert output.count("\033[8G") == grid.panel_height
+        assert "\033[1G" not in output
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from mock import patch
+
+from gramola.heatmap import Heatmap, Bins
+from gramola.utils import TimeRange
+from gramola.transforms import Series
+
+
+def series(name, values, step=60):
+    return Series.from_datapoints(name, [(v, (idx + 1) * step) for idx, v in enumerate(values)])
+
+
+class TestBins(object):
+    def test_add(self):
+        bins = Bins(4, 2, TimeRange(60, 240))
+        for s in (series('a', [0, 1, 2, 3]), series('b', [3, None, 3, 3])):
+            bins.add(zip(s.values, s.timestamps))
+        assert (bins.low, bins.high, bins.series, bins.datapoints) == (0, 3, 2, 7)
+        assert (bins.last_ts, bins.step) == (240, 60)
+        # first row the lowest values, the end of the time range at the right corner
+        assert list(bins.counts()) == [1, 1, 0, 0,
+                                       1, 0, 2, 2]
+
+    def test_add_widens_the_range(self):
+        bins = Bins(1, 4, TimeRange(0, 60))
+        bins.add([(v, 60) for v in (10, 10, 11, 1000, -1000, 10)])
+        assert (bins.low, bins.high) == (-1000, 1000)
+        assert list(bins.counts()) == [1, 0, 4, 1]
+
+    def test_add_max_x(self):
+        bins = Bins(2, 2, TimeRange(60, 120), max_x=10)
+        bins.add([(1, 60), (100, 120)])
+        assert (bins.low, bins.high) == (1, 10)
+        assert list(bins.counts()) == [1, 0, 0, 1]
+
+    def test_add_out_of_time_range(self):
+        bins = Bins(2, 2, TimeRange(60, 120))
+        bins.add([(None, 60), (1, 180)])
+        assert (bins.low, bins.high, bins.series, bins.datapoints) == (None, None, 1, 0)
+        assert list(bins.counts()) == [0, 0, 0, 0]
+
+
+class TestHeatmap(object):
+    def test_render(self):
+        heatmap = Heatmap(rows=2, width=4)
+        bins = heatmap.bins(TimeRange(60, 240))
+        for s in [series(str(i), [0, 1, 2, 3]) for i in range(3)] + [series('b', [3, 3, 3, 3])]:
+            bins.add(zip(s.values, s.timestamps))
+        assert heatmap.render(bins) == [
+            u"|░░██",
+            u"|▓▓  ",
+            u"+---+",
+            u"series=4, min=0, max=3, cell max=4"
+        ]
+
+    def test_render_stale(self):
+        heatmap = Heatmap(rows=1, width=4)
+        assert heatmap.render(heatmap.bins(TimeRange(0, 60)), stale=True)[-1] == \
+            u"[stale] no datapoints found ..."
+
+    @patch("gramola.heatmap.write")
+    def test_draw(self, write_patched):
+        heatmap = Heatmap(rows=1, width=4)
+        heatmap.draw(heatmap.bins(TimeRange(0, 60)))
+        heatmap.draw(heatmap.bins(TimeRange(0, 60)))
+        # the second frame rewrites the lines of the first one
+        assert write_patched.call_args[0][0].startswith(u"\033[K\033[1A" * heatmap.height())
@@ -0,0 +1,87 @@
+import pytest
+
+from mock import Mock
+
+from gramola.index import GraphiteIndex, compile_pattern
+
+TREE = {
+    '*': [('servers', False), ('stats', False)],
+    'servers.*': [('web1', False), ('web2', False), ('db1', False)],
+    'servers.web1.*': [('cpu', True), ('mem', True)],
+    'servers.web2.*': [('cpu', True)],
+    'servers.db1.*': [('cpu', True)],
+}
+
+
+@pytest.fixture
+def datasource():
+    datasource = Mock()
+    datasource.find.side_effect = lambda pattern: TREE.get(pattern, [])
+    return datasource
+
+
+class TestCompilePattern(object):
+    def test_wildcards(self):
+        assert compile_pattern('web*').match('web1')
+        assert not compile_pattern('web*').match('db1')
+        assert compile_pattern('web?').match('web1')
+        assert compile_pattern('web[12]').match('web2')
+        assert not compile_pattern('web[12]').match('web3')
+        assert compile_pattern('{web,db}1').match('db1')
+        assert not compile_pattern('{web,db}1').match('db12')
+
+
+class TestGraphiteIndex(object):
+    def test_find(self, tmpdir, datasource):
+        index = GraphiteIndex(str(tmpdir.join('index')), datasource=datasource)
+        assert index.find('servers.web*.cpu') == [('servers.web1.cpu', True),
+                                                  ('servers.web2.cpu', True)]
+        assert index.find('servers.{web1,db1}') == [('servers.db1', False),
+                                                   ('servers.web1', False)]
+        assert index.find('servers.foo.cpu') == []
+
+    def test_fetch_only_expired_branches(self, tmpdir, datasource):
+        index = GraphiteIndex(str(tmpdir.join('index')), datasource=datasource, ttl=10)
+        index.find('servers.web1.*', now=100)
+        assert datasource.find.call_count == 3
+
+        # fresh branches are not fetched again
+        index.find('servers.web1.*', now=105)
+        assert datasource.find.call_count == 3
+
+        # all of them expired
+        index.find('servers.web1.*', now=111)
+        assert datasource.find.call_count == 6
+
+    def test_save_and_offline(self, tmpdir, datasource):
+        filepath = str(tmpdir.join('index'))
+        index = GraphiteIndex(filepath, datasource=datasource)
+        index.find('servers.*.cpu')
+        index.save()
+
+        offline = GraphiteIndex(filepath)
+        assert offline.find('servers.*.cpu') == index.find('servers.*.cpu')
+        assert offline.find('stats.*') == []
+
+    def test_complete(self, tmpdir, datasource):
+        index = GraphiteIndex(str(tmpdir.join('index')), datasource=datasource)
+        assert index.complete('se') == ['servers.']
+        assert index.complete('servers.w') == ['servers.web1.', 'servers.web2.']
+        assert index.complete('servers.web1.') == ['servers.web1.cpu', 'servers.web1.mem']
+
+    def test_forget_removed_branches(self, tmpdir, datasource):
+        index = GraphiteIndex(str(tmpdir.join('index')), datasource=datasource, ttl=10)
+        index.find('servers.db1.cpu', now=100)
+        TREE['servers.*'] = [('web1', False), ('web2', False)]
+        try:
+            assert index.find('servers.*.cpu', now=200) == [('servers.web1.cpu', True),
+                                                            ('servers.web2.cpu', True)]
+            assert 'servers.db1' not in index._branches
+        finally:
+            TREE['servers.*'].append(('db1', False))
+
+    def test_find_unavailable_keeps_stale(self, tmpdir, datasource):
+        index = GraphiteIndex(str(tmpdir.join('index')), datasource=datasource, ttl=10)
+        index.find('servers.*', now=100)
+        datasource.find.side_effect = lambda pattern: None
+        assert len(index.find('servers.*', now=200)) == 3
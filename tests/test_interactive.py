@@ -0,0 +1,32 @@
+from gramola.utils import TimeRange
+from gramola.interactive import Viewport
+
+
+class TestViewport(object):
+    def test_zoom(self):
+        viewport = Viewport(TimeRange(3600, 7200), now=7200, min_seconds=1000)
+        assert viewport.handle('+')
+        assert viewport.time_range(7200) == TimeRange(4500, 6300)
+        viewport.handle('+')
+        assert viewport.time_range(7200) == TimeRange(4900, 5900)
+        assert not viewport.handle('+')
+        viewport.handle('-')
+        viewport.handle('-')
+        viewport.handle('-')
+        # zooming out never goes beyond now
+        assert viewport.time_range(7200) == TimeRange(-800, 7200)
+
+    def test_pan(self):
+        viewport = Viewport(TimeRange(3600, 7200), now=7200)
+        assert not viewport.handle('l')
+        assert viewport.handle('left')
+        assert viewport.time_range(7200) == TimeRange(1800, 5400)
+        # the time range keeps relative to now
+        assert viewport.time_range(7260) == TimeRange(1860, 5460)
+        viewport.handle('h')
+        viewport.handle('0')
+        assert viewport.time_range(7200) == TimeRange(3600, 7200)
+
+    def test_unknown_key(self):
+        viewport = Viewport(TimeRange(3600, 7200), now=7200)
+        assert not viewport.handle('x')
@@ -0,0 +1,68 @@
+import pytest
+
+from json import loads
+from StringIO import StringIO
+from collections import deque
+
+from gramola.output import (
+    Writer,
+    NDJSONWriter,
+    CSVWriter,
+    JSONWriter,
+    newer,
+    tail
+)
+
+
+def write(writer_cls, series):
+    stream = StringIO()
+    writer = writer_cls(stream)
+    writer.open()
+    for target, datapoints in series:
+        writer.write(target, iter(datapoints))
+    writer.close()
+    return stream.getvalue()
+
+
+class TestWriter(object):
+    def test_find(self):
+        assert Writer.find('ndjson') == NDJSONWriter
+        assert Writer.find('csv') == CSVWriter
+        assert Writer.find('json') == JSONWriter
+        with pytest.raises(KeyError):
+            Writer.find('foo')
+
+    def test_ndjson(self):
+        output = write(NDJSONWriter, [('foo', [(1, 60), (None, 120)]), ('bar', [(2, 60)])])
+        assert [loads(line) for line in output.splitlines()] == [
+            {'target': 'foo', 'ts': 60, 'value': 1},
+            {'target': 'foo', 'ts': 120, 'value': None},
+            {'target': 'bar', 'ts': 60, 'value': 2}]
+
+    def test_csv(self):
+        output = write(CSVWriter, [('foo', [(1, 60), (None, 120)]), (u'b\xe1r', [(2, 60)])])
+        assert output.splitlines() == [
+            'target,ts,value', 'foo,60,1', 'foo,120,', 'b\xc3\xa1r,60,2']
+
+    def test_json(self):
+        output = write(JSONWriter, [('foo', [(1, 60)]), ('bar', [(2, 60)])])
+        assert loads(output) == [
+            {'target': 'foo', 'ts': 60, 'value': 1},
+            {'target': 'bar', 'ts': 60, 'value': 2}]
+        assert loads(write(JSONWriter, [])) == []
+
+    def test_write_returns_last(self):
+        writer = NDJSONWriter(StringIO())
+        assert writer.write('foo', iter([(1, 60), (2, 120)])) == (2, 120)
+        assert writer.write('foo', iter([])) is None
+
+
+def test_newer():
+    assert list(newer([(1, 60), (2, 120)], None)) == [(1, 60), (2, 120)]
+    assert list(newer([(1, 60), (2, 120)], 60)) == [(2, 120)]
+
+
+def test_tail():
+    buffer_ = deque(maxlen=2)
+    assert list(tail([(1, 60), (2, 120), (3, 180)], buffer_)) == [(1, 60), (2, 120), (3, 180)]
+    assert list(buffer_) == [(2, 120), (3, 180)]
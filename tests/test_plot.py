@@ -1,10 +1,11 @@
+# -*- coding: utf-8 -*-
 import pytest
 import time
 
 from StringIO import StringIO
 from mock import patch, Mock
 
-from gramola.plot import Plot
+from gramola.plot import Plot, BLOCKS, BRAILLE
 
 
 DEFAULT_ROWS_FIXTURE = [
@@ -21,7 +22,7 @@ DEFAULT_ROWS_FIXTURE = [
 |  ********
 | *********
 +---+---+--
-min=10, max=100, last=100
+min=10, max=100, last=100, mean=55, stddev=28.72, p50=55, p95=100, p99=100
 """
 ]
 
@@ -37,7 +38,7 @@ FIVE_ROWS_FIXTURE = [
 |   *******
 | *********
 +---+---+--
-min=10, max=100, last=100
+min=10, max=100, last=100, mean=55, stddev=28.72, p50=55, p95=100, p99=100
 """
 ]
 
@@ -54,10 +55,33 @@ MAXX_ROWS_FIXTURE = [
 |       *  
 |       *  
 +---+---+--
-min=0, max=50, last=10
+min=10, max=50, last=10, mean=20, stddev=17.32, p50=10, p95=50, p99=50
 """
 ]
 
+BLOCKS_FIXTURE = [
+# values given to the Plot to get the graph below
+[(10, 1), (20, 1), (30, 1), (40, 1), (50, 1)],
+# grap expected
+u"""|  ▂▅█
+|▃▆███
++---+-
+min=10, max=50, last=50, mean=30, stddev=14.14, p50=30, p95=50, p99=50
+""".encode('utf-8')
+]
+
+BRAILLE_FIXTURE = [
+# values given to the Plot to get the graph below
+[(10, 1), (20, 1), (30, 1), (40, 1), (50, 1),
+ (60, 1), (70, 1), (80, 1), (90, 1), (100, 1)],
+# grap expected
+u"""|⠀⠀⢀⣤⣾
+|⣠⣴⣿⣿⣿
++---+-
+min=10, max=100, last=100, mean=55, stddev=28.72, p50=55, p95=100, p99=100
+""".encode('utf-8')
+]
+
 
 @patch("gramola.plot.sys")
 @patch.object(Plot, "width", return_value=10)
@@ -87,3 +111,50 @@ class TestPlotDrawing(object):
         sys_patched.stdout.seek(0)
         output = sys_patched.stdout.read()
         assert sys_patched.stdout.read() == MAXX_ROWS_FIXTURE[1]
+
+
+@patch("gramola.plot.sys")
+@patch.object(Plot, "width", return_value=5)
+class TestPlotHighResolution(object):
+    def test_draw_blocks(self, width_patched, sys_patched):
+        sys_patched.stdout = StringIO()
+        plot = Plot(rows=2, mode=BLOCKS)
+        plot.draw(BLOCKS_FIXTURE[0])
+        sys_patched.stdout.seek(0)
+        assert sys_patched.stdout.read() == BLOCKS_FIXTURE[1]
+
+    def test_draw_braille(self, width_patched, sys_patched):
+        sys_patched.stdout = StringIO()
+        plot = Plot(rows=2, mode=BRAILLE)
+        plot.draw(BRAILLE_FIXTURE[0])
+        sys_patched.stdout.seek(0)
+        assert sys_patched.stdout.read() == BRAILLE_FIXTURE[1]
+
+    def test_maxdatapoints(self, width_patched, sys_patched):
+        assert Plot().maxdatapoints() == 5
+        assert Plot(mode=BLOCKS).maxdatapoints() == 5
+        assert Plot(mode=BRAILLE).maxdatapoints() == 10
+        with pytest.raises(Exception):
+            Plot(mode=BRAILLE).draw([(1, 1)] * 11)
+
+    def test_invalid_mode(self, width_patched, sys_patched):
+        with pytest.raises(ValueError):
+            Plot(mode='foo')
+
+
+@patch.object(Plot, "width", return_value=5)
+class TestPlotFooter(object):
+    def test_stats_along_frames(self, width_patched):
+        plot = Plot(rows=2)
+        plot.render([(10, 1), (20, 2), (30, 3)])
+
+        # the datapoints already seen are not counted twice
+        lines = plot.render([(20, 2), (30, 3), (0, 4)])
+        assert lines[-1] == "min=0, max=30, last=0, mean=15, stddev=11.18, p50=15, p95=30, p99=30"
+
+    def test_no_datapoints(self, width_patched):
+        assert Plot(rows=2).render([])[-1] == "no datapoints found ..."
+
+    def test_stale(self, width_patched):
+        lines = Plot(rows=2).render([(10, 1)], stale=True)
+        assert lines[-1].startswith("[stale] min=10")
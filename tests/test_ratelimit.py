@@ -0,0 +1,77 @@
+import json
+import pytest
+
+from mock import patch
+
+from gramola.ratelimit import RateLimiter, _limiters, report
+
+
+@pytest.yield_fixture
+def clock():
+    # fake clock advanced by the sleeps
+    now = [1000.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    with patch("gramola.ratelimit.time", side_effect=lambda: now[0]):
+        with patch("gramola.ratelimit.sleep", side_effect=sleep) as psleep:
+            yield psleep
+
+
+@pytest.yield_fixture
+def limiters():
+    _limiters.clear()
+    yield _limiters
+    _limiters.clear()
+
+
+class TestRateLimiter(object):
+    def test_burst(self, clock):
+        limiter = RateLimiter(rate=2)
+        assert limiter.acquire() == 0
+        assert limiter.acquire() == 0
+        assert not clock.called
+
+        # the third call waits for the next token
+        assert limiter.acquire() == 0.5
+        assert limiter.calls == 3
+        assert limiter.waited == 0.5
+
+    def test_throttled(self, clock):
+        limiter = RateLimiter(rate=4, min_rate=1)
+        limiter.throttled()
+        assert limiter._state['rate'] == 2
+        limiter.throttled()
+        limiter.throttled()
+        assert limiter._state['rate'] == 1
+
+        # the succeeded calls increase the rate until the maxium
+        for _ in range(100):
+            limiter.succeeded()
+        assert limiter._state['rate'] == 4
+
+    def test_shared_by_key(self, limiters, tmpdir):
+        a = RateLimiter.shared(('default', 'eu-west-1'), directory=str(tmpdir))
+        assert RateLimiter.shared(('default', 'eu-west-1')) is a
+        assert RateLimiter.shared(('default', 'us-east-1')) is not a
+        assert a.filepath == str(tmpdir.join("default-eu-west-1.json"))
+
+    def test_shared_by_processes(self, clock, tmpdir):
+        filepath = str(tmpdir.join("bucket.json"))
+        a = RateLimiter(rate=2, filepath=filepath)
+        b = RateLimiter(rate=2, filepath=filepath)
+        assert a.acquire() == 0
+        assert a.acquire() == 0
+
+        # the other limiter sees the bucket empty
+        assert b.acquire() == 0.5
+        with open(filepath) as fd:
+            assert json.load(fd)['tokens'] == 0
+
+
+def test_report(limiters, clock):
+    RateLimiter.shared(('default', 'eu-west-1'), rate=1).acquire()
+    RateLimiter.shared(('default', 'eu-west-1'), rate=1).acquire()
+    RateLimiter.shared(('sandbox', 'us-east-1'))
+    assert report() == [(('default', 'eu-west-1'), 2, 1.0)]
@@ -0,0 +1,144 @@
+import pytest
+
+from mock import Mock
+
+from gramola.rollup import (
+    Pyramid,
+    fetch_rollup,
+    pyramid_key,
+    cover,
+    gaps
+)
+from gramola.utils import TimeRange
+from gramola.transforms import Series
+from gramola.datasources.base import (
+    MetricQuery,
+    DataSourceConfig
+)
+
+
+class Query(MetricQuery):
+    REQUIRED_KEYS = ('metric',)
+
+
+@pytest.fixture
+def datasource():
+    # one datapoint every 64 seconds, whose value is its timestamp
+    datasource = Mock()
+    datasource.configuration = DataSourceConfig(type='test', name='foo')
+    datasource.max_seconds_per_request.return_value = None
+    datasource.iter_series.side_effect = lambda query, maxdatapoints: [
+        ('foo', iter([(ts, ts) for ts in range(query.time_range().since,
+                                                 query.time_range().until, 64)]))]
+    return datasource
+
+
+def test_pyramid_key():
+    config = DataSourceConfig(type='test', name='foo')
+    query = Query(metric='foo', since='-1h')
+    assert pyramid_key(config, query) == pyramid_key(
+        config, Query(metric='foo', since='-1d', transform='derivative').resolve(now=7200))
+    assert pyramid_key(config, query) != pyramid_key(config, Query(metric='bar'))
+
+
+def test_intervals():
+    assert cover([(0, 10), (20, 30)], 10, 15) == [(0, 15), (20, 30)]
+    assert cover([(0, 10), (20, 30)], 5, 25) == [(0, 30)]
+    assert gaps([(0, 10), (20, 30)], 5, 40) == [TimeRange(10, 20), TimeRange(30, 40)]
+    assert gaps([], 5, 40) == [TimeRange(5, 40)]
+
+
+class TestPyramid(object):
+    def test_level(self):
+        assert Pyramid.level(0.5) == 0
+        assert Pyramid.level(1) == 0
+        assert Pyramid.level(45) == 6
+        assert Pyramid.level(64) == 6
+        assert Pyramid.level(65) == 7
+
+    def test_missing_never_beyond_now(self):
+        pyramid = Pyramid()
+        assert pyramid.missing(6, TimeRange(3600, 7210), now=7210) == [TimeRange(3584, 7210)]
+        assert pyramid.missing(6, TimeRange(3600, 7210), now=9000) == [TimeRange(3584, 7232)]
+
+    def test_insert(self):
+        pyramid = Pyramid(ttl=0)
+        series = [Series.from_datapoints('foo', [(1, 0), (3, 1), (None, 2), (8, 3)])]
+        pyramid.insert(0, series, TimeRange(0, 4), now=100)
+        assert pyramid.series(0, TimeRange(0, 4)) == [
+            Series.from_datapoints('foo', [(1, 0), (3, 1), (8, 3)])]
+        assert pyramid.series(1, TimeRange(0, 4)) == [
+            Series.from_datapoints('foo', [(2, 0), (8, 2)])]
+        assert pyramid.series(2, TimeRange(0, 4), aggregate='max') == [
+            Series.from_datapoints('foo', [(8, 0)])]
+        assert pyramid.missing(1, TimeRange(0, 8)) == [TimeRange(4, 8)]
+
+        # the segment fetched again replaces its buckets
+        pyramid.insert(0, [Series.from_datapoints('foo', [(5, 0)])], TimeRange(0, 2), now=100)
+        assert pyramid.series(1, TimeRange(0, 4), aggregate='count') == [
+            Series.from_datapoints('foo', [(1, 0), (1, 2)])]
+
+    def test_recent_not_covered(self):
+        pyramid = Pyramid(ttl=60)
+        pyramid.insert(0, [Series.from_datapoints('foo', [(1, 0)])], TimeRange(0, 100), now=100)
+        assert pyramid.missing(0, TimeRange(0, 100)) == [TimeRange(40, 100)]
+
+    def test_evict(self):
+        pyramid = Pyramid(ttl=0, max_buckets=2)
+        series = [Series.from_datapoints('foo', [(1, ts) for ts in range(4)])]
+        pyramid.insert(0, series, TimeRange(0, 4), now=100)
+        assert pyramid.series(0, TimeRange(0, 4)) == [
+            Series.from_datapoints('foo', [(1, 2), (1, 3)])]
+        assert pyramid.missing(0, TimeRange(0, 4)) == [TimeRange(0, 2)]
+
+    def test_save_load(self, tmpdir):
+        filepath = str(tmpdir.join("pyramid.json"))
+        pyramid = Pyramid(filepath=filepath, ttl=0)
+        pyramid.insert(0, [Series.from_datapoints('foo', [(1, 0), (3, 1)])],
+                       TimeRange(0, 2), now=100)
+        pyramid.save()
+
+        loaded = Pyramid(filepath=filepath)
+        loaded.load()
+        assert loaded.series(1, TimeRange(0, 2)) == [Series.from_datapoints('foo', [(2, 0)])]
+        assert loaded.missing(0, TimeRange(0, 2)) == []
+
+
+class TestFetchRollup(object):
+    def test_zoom_out_and_in(self, datasource):
+        pyramid = Pyramid(ttl=0)
+        query = Query(metric='foo').with_time_range(TimeRange(3584, 7680))
+
+        # 4096 seconds using 64 columns, buckets of 64 seconds
+        series = fetch_rollup(datasource, query, 64, pyramid, now=7680)
+        assert len(series[0].values) == 64
+        assert datasource.iter_series.call_count == 1
+
+        # zooming out fetches only the time range not seen yet
+        wider = Query(metric='foo').with_time_range(TimeRange(0, 7680))
+        series = fetch_rollup(datasource, wider, 60, pyramid, now=7680)
+        # buckets of 128 seconds, averaging two datapoints each one
+        assert series[0].datapoints()[-1] == (7584, 7552)
+        assert datasource.iter_series.call_count == 2
+        assert datasource.iter_series.call_args[0][0].time_range() == TimeRange(0, 3584)
+
+        # zooming in is served by the finer level already fetched
+        narrower = Query(metric='foo').with_time_range(TimeRange(6656, 7680))
+        series = fetch_rollup(datasource, narrower, 16, pyramid, now=7680)
+        assert series[0].datapoints() == [(ts, ts) for ts in range(6656, 7680, 64)]
+        assert datasource.iter_series.call_count == 2
+
+    def test_fits_into_the_columns(self, datasource):
+        for seconds, columns in ((3600, 80), (86400, 80), (4000, 64)):
+            query = Query(metric='foo').with_time_range(TimeRange(86400 - seconds, 86400))
+            series = fetch_rollup(datasource, query, columns, Pyramid(ttl=0), now=86400)
+            assert columns / 2 <= len(series[0].values) <= columns
+
+    def test_empty_not_covered(self, datasource):
+        datasource.iter_series.side_effect = None
+        datasource.iter_series.return_value = []
+        pyramid = Pyramid(ttl=0)
+        query = Query(metric='foo').with_time_range(TimeRange(0, 4096))
+        assert fetch_rollup(datasource, query, 64, pyramid, now=7680) == []
+        assert fetch_rollup(datasource, query, 64, pyramid, now=7680) == []
+        assert datasource.iter_series.call_count == 2
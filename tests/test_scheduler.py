@@ -0,0 +1,69 @@
+import pytest
+
+from mock import patch
+
+from gramola.scheduler import Scheduler, learn_step
+
+
+class TestLearnStep(object):
+    def test_learn(self):
+        assert learn_step([(1, 0), (1, 60), (1, 180), (1, 240)]) == 60
+        assert learn_step([(1, 0)]) is None
+        assert learn_step([]) is None
+
+
+class TestScheduler(object):
+    def test_all_due_at_beginning(self):
+        scheduler = Scheduler(['a', 'b'])
+        assert sorted(scheduler.wait(now=1000)) == ['a', 'b']
+
+    def test_unknown_step(self):
+        scheduler = Scheduler(['a'], interval=10)
+        assert scheduler.update('a', [(1, 990)], now=1000) == 1010
+
+    def test_aligned_to_next_bucket(self):
+        scheduler = Scheduler(['a'], interval=10, grace=2)
+        # the bucket that follows the 1020 one closes at 1140
+        assert scheduler.update('a', [(1, 960), (1, 1020)], now=1050) == 1142
+
+    def test_step_given_by_datasource(self):
+        scheduler = Scheduler(['a'], interval=10, grace=2)
+        assert scheduler.update('a', [(1, 900)], step=300, now=1000) == 1502
+
+    def test_lagging_series(self):
+        scheduler = Scheduler(['a'], interval=10, grace=2)
+        assert scheduler.update('a', [(1, 0), (1, 60)], now=1000) == 1060
+
+    def test_backoff(self):
+        scheduler = Scheduler(['a'], interval=10, grace=2, max_backoff=4)
+        datapoints = [(1, 940), (1, 1000)]
+        scheduler.update('a', datapoints, now=1000)
+        # no new datapoints, the step is multiplied each time
+        assert scheduler.update('a', datapoints, now=1100) == 1160
+        assert scheduler.update('a', datapoints, now=1200) == 1320
+        assert scheduler.update('a', datapoints, now=1300) == 1540
+        assert scheduler.update('a', datapoints, now=1400) == 1640
+        # new datapoints reset the backoff
+        assert scheduler.update('a', datapoints + [(1, 1060)], now=1500) == 1560
+
+    @patch("gramola.scheduler.sleep")
+    def test_wait_heap(self, sleep_patched):
+        scheduler = Scheduler(['a', 'b'], interval=10)
+        scheduler.wait(now=1000)
+        scheduler.update('a', [], now=1000)
+        scheduler.update('b', [], step=5, now=1003)
+        assert scheduler.next_due() == 1008
+        assert scheduler.wait(now=1004) == ['b']
+        sleep_patched.assert_called_with(4)
+        assert scheduler.wait(now=1010) == ['a']
+
+    def test_wake(self):
+        scheduler = Scheduler(['a', 'b'], interval=10)
+        scheduler.wait(now=1000)
+        scheduler.update('a', [(1, 940), (1, 1000)], now=1000)
+        scheduler.update('b', [], now=1000)
+        scheduler.wake()
+        assert sorted(scheduler.wait(now=1001)) == ['a', 'b']
+        # the step is kept but the last datapoints are forgotten
+        assert scheduler.step('a') == 60
+        assert scheduler.update('a', [(1, 400), (1, 460)], now=1001) == 1061
@@ -0,0 +1,73 @@
+from mock import Mock
+
+from gramola.utils import TimeRange
+from gramola.transforms import Series
+from gramola.datasources.base import MetricQuery
+from gramola.shards import (
+    split,
+    shard_queries,
+    fetch_shards,
+    stitch
+)
+
+
+class Query(MetricQuery):
+    REQUIRED_KEYS = ('metric',)
+
+
+def test_split():
+    assert split(TimeRange(0, 100), 100) == [TimeRange(0, 100)]
+    assert split(TimeRange(50, 320), 100) == [
+        TimeRange(50, 100), TimeRange(100, 200), TimeRange(200, 300), TimeRange(300, 320)]
+    assert split(TimeRange(10, 10), 100) == [TimeRange(10, 10)]
+
+
+class TestShardQueries(object):
+    def test_one_request(self):
+        datasource = Mock()
+        datasource.max_seconds_per_request.return_value = 3600
+        query = Query(metric='foo').resolve(now=7200)
+        assert shard_queries(datasource, query) is None
+
+        datasource.max_seconds_per_request.return_value = None
+        assert shard_queries(datasource, query) is None
+
+    def test_shards(self):
+        datasource = Mock()
+        datasource.max_seconds_per_request.return_value = 1800
+        datasource.step.return_value = 60
+        query = Query(metric='foo').resolve(now=7200)
+        shards = shard_queries(datasource, query, maxdatapoints=60)
+        assert [(q.time_range(), m) for q, m in shards] == [
+            (TimeRange(3600, 5400), 30), (TimeRange(5400, 7200), 30)]
+        assert shards[0][0].metric == 'foo'
+
+    def test_shards_use_the_step_of_the_query(self):
+        datasource = Mock()
+        datasource.max_seconds_per_request.return_value = 2000
+        datasource.step.return_value = 300
+        query = Query(metric='foo').with_time_range(TimeRange(1000, 5000))
+        shards = shard_queries(datasource, query)
+        datasource.step.assert_called_with(query, maxdatapoints=None)
+        # shards aligned to whole steps, at most the ones of one request
+        assert [(q.time_range(), m) for q, m in shards] == [
+            (TimeRange(900, 1800), 3), (TimeRange(1800, 3600), 6), (TimeRange(3600, 5100), 5)]
+
+
+def test_fetch_shards():
+    shards = [(q, None) for q in range(10)]
+    assert fetch_shards(lambda q, m: q * 2, shards) == [q * 2 for q in range(10)]
+    assert fetch_shards(lambda q, m: q, shards[:1]) == [0]
+
+
+def test_stitch():
+    shards = [
+        [Series.from_datapoints('foo', [(1, 60), (None, 120)]),
+         Series.from_datapoints('bar', [(5, 60)])],
+        [Series.from_datapoints('foo', [(2, 120), (3, 180)])],
+    ]
+    assert stitch(shards) == [
+        Series.from_datapoints('foo', [(1, 60), (2, 120), (3, 180)]),
+        Series.from_datapoints('bar', [(5, 60)])
+    ]
+    assert stitch([]) == []
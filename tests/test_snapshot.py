@@ -0,0 +1,42 @@
+from gramola.snapshot import Snapshot
+from gramola.utils import TimeRange
+from gramola.transforms import Series
+
+
+class TestSnapshot(object):
+    def test_save_load(self, tmpdir):
+        filepath = str(tmpdir.join("snapshot.json"))
+        snapshot = Snapshot(filepath, max_age=60)
+        series = [Series.from_datapoints('foo', [(1, 60), (None, 120)])]
+        assert snapshot.merge(series, TimeRange(0, 180)) == series
+        snapshot.save(now=1000)
+
+        loaded = Snapshot(filepath, max_age=60)
+        loaded.load(now=1059)
+        assert loaded.series == series
+
+        # too old to be rendered
+        loaded = Snapshot(filepath, max_age=60)
+        loaded.load(now=1060)
+        assert loaded.series is None
+
+    def test_not_changed_not_saved(self, tmpdir):
+        snapshot = Snapshot(str(tmpdir.join("snapshot.json")))
+        snapshot.series = [Series.from_datapoints('foo', [(1, 60)])]
+        snapshot.save()
+        assert tmpdir.listdir() == []
+
+    def test_merge(self, tmpdir):
+        snapshot = Snapshot(str(tmpdir.join("snapshot.json")))
+        snapshot.series = [Series.from_datapoints('foo', [(1, 0), (2, 60), (3, 120)]),
+                           Series.from_datapoints('bar', [(1, 60)])]
+
+        # the older datapoints not covered by the fresh series are kept
+        fresh = [Series.from_datapoints('foo', [(4, 120), (5, 180)])]
+        merged = snapshot.merge(fresh, TimeRange(60, 240))
+        assert merged == [Series.from_datapoints('foo', [(2, 60), (4, 120), (5, 180)])]
+        assert snapshot.series == merged
+
+        # failed fetches do not change the snapshot
+        assert snapshot.merge([], TimeRange(60, 240)) == []
+        assert snapshot.series == merged
@@ -0,0 +1,113 @@
+import math
+import random
+
+from gramola.stats import (
+    RunningStats,
+    TDigest,
+    SessionStats,
+    format_value
+)
+
+
+class TestRunningStats(object):
+    def test_empty(self):
+        stats = RunningStats()
+        assert stats.count == 0
+        assert stats.stddev() != stats.stddev()
+
+    def test_add(self):
+        stats = RunningStats()
+        for value in (2, 4, 4, 4, 5, 5, 7, 9):
+            stats.add(value)
+        assert stats.count == 8
+        assert stats.min == 2
+        assert stats.max == 9
+        assert stats.mean == 5
+        assert stats.stddev() == 2
+
+    def test_merge(self):
+        a, b, both = RunningStats(), RunningStats(), RunningStats()
+        for value in (2, 4, 4, 4):
+            a.add(value)
+            both.add(value)
+        for value in (5, 5, 7, 9):
+            b.add(value)
+            both.add(value)
+        a.merge(b)
+        assert a.count == both.count
+        assert a.min == both.min and a.max == both.max
+        assert a.mean == both.mean
+        assert abs(a.stddev() - both.stddev()) < 1e-9
+
+    def test_merge_empty(self):
+        a, b = RunningStats(), RunningStats()
+        b.add(1)
+        a.merge(b)
+        assert a.count == 1 and a.mean == 1
+        a.merge(RunningStats())
+        assert a.count == 1
+
+
+class TestTDigest(object):
+    def test_empty(self):
+        assert math.isnan(TDigest().quantile(0.5))
+
+    def test_few_values(self):
+        digest = TDigest()
+        for value in range(10, 101, 10):
+            digest.add(value)
+        assert digest.percentile(0) == 10
+        assert digest.percentile(50) == 55
+        assert digest.percentile(100) == 100
+
+    def test_bounded_and_accurate(self):
+        rnd = random.Random(1)
+        values = [rnd.random() for _ in range(20000)]
+        digest = TDigest(compression=100)
+        for value in values:
+            digest.add(value)
+
+        assert digest.count == 20000
+        assert len(digest.centroids) < 200
+        assert len(digest._buffer) < digest._buffer_size
+
+        values.sort()
+        for q in (0.5, 0.95, 0.99):
+            assert abs(digest.quantile(q) - values[int(q * len(values))]) < 0.01
+
+    def test_merge(self):
+        a, b = TDigest(), TDigest()
+        for value in range(0, 1000):
+            (a if value % 2 else b).add(value)
+        a.merge(b)
+        assert a.count == 1000
+        assert a.min == 0 and a.max == 999
+        assert abs(a.percentile(50) - 500) < 10
+
+
+class TestSessionStats(object):
+    def test_only_new_datapoints(self):
+        stats = SessionStats()
+        assert stats.update([(1, 1), (2, 2)]) == 2
+        assert stats.update([(1, 1), (2, 2), (3, 3)]) == 1
+        assert stats.stats.count == 3
+        assert stats.last == 3
+
+    def test_none_values_skipped(self):
+        stats = SessionStats()
+        assert stats.update([(None, 1), (2, 2)]) == 1
+
+    def test_summary(self):
+        stats = SessionStats()
+        assert stats.summary() is None
+        stats.update([(1, 1), (2, 2)])
+        assert stats.summary() == ("min=1, max=2, last=2, mean=1.5, stddev=0.5,"
+                                   " p50=1.5, p95=2, p99=2")
+
+
+def test_format_value():
+    assert format_value(10.0) == "10"
+    assert format_value(28.7228) == "28.72"
+    assert format_value(1234.56) == "1234.6"
+    assert format_value(0.001234) == "0.001234"
+    assert format_value(float('nan')) == "nan"
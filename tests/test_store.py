@@ -6,6 +6,8 @@ from mock import patch, Mock
 from gramola.store import (
     NotFound,
     DuplicateEntry,
+    INIBackend,
+    SQLiteBackend,
     Store
 )
 
@@ -56,3 +58,56 @@ class TestStore(object):
     def test_rm_notfound_datasource(self, nonedefault_store, test_data_source):
         with pytest.raises(NotFound):
             nonedefault_store.rm_datasource("xxxx")
+
+
+@pytest.fixture
+def sqlite_store(nonedefault_store):
+    store = Store(path=nonedefault_store.path, backend=SQLiteBackend.NAME)
+    store.backend.import_from(INIBackend(store.datasources_filepath))
+    return store
+
+
+class TestSQLiteStore(object):
+    def test_datasources(self, sqlite_store, test_data_source):
+        datasources = sqlite_store.datasources()
+        assert [d.name for d in datasources] == ["datasource one", "datasource two"]
+        assert type(datasources[1]) == test_data_source.DATA_SOURCE_CONFIGURATION_CLS
+        assert datasources[1].type == "test"
+        assert datasources[1].foo == "c"
+        assert datasources[1].gramola == "e"
+
+    def test_datasources_filter(self, sqlite_store, test_data_source):
+        assert len(sqlite_store.datasources(name="datasource two")) == 1
+        assert len(sqlite_store.datasources(name="datasource two", type_="test")) == 1
+        assert len(sqlite_store.datasources(type_="notimplemented")) == 0
+
+    def test_add_rm_datasource(self, sqlite_store, test_data_source):
+        params = {"type": "test", "name": "test name", "foo": "a", "bar": "b"}
+        config = test_data_source.DATA_SOURCE_CONFIGURATION_CLS(**params)
+        sqlite_store.add_datasource(config)
+        assert sqlite_store.datasources(name="test name")[0].dict() == params
+
+        with pytest.raises(DuplicateEntry):
+            sqlite_store.add_datasource(config)
+
+        sqlite_store.rm_datasource("test name")
+        assert len(sqlite_store.datasources()) == 2
+        with pytest.raises(NotFound):
+            sqlite_store.rm_datasource("test name")
+
+    def test_default_backend(self, sqlite_store, test_data_source):
+        # once the SQLite file exists it is used by default
+        sqlite_store.rm_datasource("datasource one")
+        store = Store(path=sqlite_store.path)
+        assert store.backend.NAME == SQLiteBackend.NAME
+        assert [d.name for d in store.datasources()] == ["datasource two"]
+
+    def test_import_skips_saved(self, sqlite_store, test_data_source):
+        ini = INIBackend(sqlite_store.datasources_filepath)
+        ini.add_datasource({"type": "test", "name": "new", "foo": "a", "bar": "b"})
+        assert sqlite_store.backend.import_from(ini) == ["new"]
+        assert len(sqlite_store.datasources()) == 3
+
+    def test_invalid_backend(self, nonedefault_store):
+        with pytest.raises(ValueError):
+            Store(path=nonedefault_store.path, backend="foo")
@@ -0,0 +1,142 @@
+import pytest
+
+from mock import Mock
+
+from gramola.transforms import (
+    Series,
+    Pipeline,
+    InvalidTransform,
+    parse,
+    percentile_of
+)
+
+
+def series(name, values, step=60):
+    return Series.from_datapoints(name, [(v, (idx + 1) * step) for idx, v in enumerate(values)])
+
+
+def values(result):
+    return [[v for v, ts in s.datapoints()] for s in result]
+
+
+class TestSeries(object):
+    def test_datapoints(self):
+        s = Series.from_datapoints('foo', [(1, 60), (None, 120)])
+        assert s.datapoints() == [(1.0, 60), (None, 120)]
+        assert s == Series.from_datapoints('foo', [(1, 60), (None, 120)])
+        assert s != Series.from_datapoints('bar', [(1, 60), (None, 120)])
+
+
+class TestParse(object):
+    def test_parse(self):
+        chain = parse("sumSeries | movingAverage(5)|scale(0.5)")
+        assert [args for _, args in chain] == [[], [5.0], [0.5]]
+
+    def test_invalid(self):
+        with pytest.raises(InvalidTransform):
+            parse("foo")
+        with pytest.raises(InvalidTransform):
+            parse("movingAverage")
+        with pytest.raises(InvalidTransform):
+            parse("movingAverage(a)")
+        with pytest.raises(InvalidTransform):
+            parse("derivative(1)")
+        with pytest.raises(InvalidTransform):
+            parse("sumSeries|")
+
+
+class TestTransforms(object):
+    def apply(self, expression, *series):
+        return Pipeline(expression).apply(list(series))
+
+    def test_empty_pipeline(self):
+        s = series('foo', [1, 2])
+        assert Pipeline().apply([s]) == [s]
+
+    def test_derivative(self):
+        assert values(self.apply("derivative", series('foo', [1, 3, None, 10]))) == [
+            [None, 2.0, None, None]]
+
+    def test_rate(self):
+        # counter resets are dropped
+        assert values(self.apply("rate", series('foo', [0, 60, 180, 10]))) == [
+            [None, 1.0, 2.0, None]]
+
+    def test_integral(self):
+        assert values(self.apply("integral", series('foo', [1, None, 2]))) == [[1.0, 1.0, 3.0]]
+
+    def test_moving_average(self):
+        assert values(self.apply("movingAverage(2)", series('foo', [2, 4, None, 8]))) == [
+            [2.0, 3.0, 4.0, 8.0]]
+        with pytest.raises(InvalidTransform):
+            self.apply("movingAverage(0)", series('foo', [1]))
+
+    def test_percentile(self):
+        result = self.apply("percentile(50)", series('foo', [5, 1, None, 3, 4]))
+        assert result[0].name == "percentile(foo, 50)"
+        assert values(result) == [[3.0] * 5]
+        assert percentile_of([1, 2, 3, 4], 100) == 4
+        assert percentile_of([1, 2, 3, 4], 0) == 1
+
+    def test_scale_absolute(self):
+        assert values(self.apply("scale(-2)|absolute", series('foo', [1, 2]))) == [[2.0, 4.0]]
+
+    def test_combine(self):
+        a = series('a', [1, 2, None])
+        b = Series.from_datapoints('b', [(10, 120), (20, 180), (30, 240)])
+        result = self.apply("sumSeries", a, b)
+        assert result[0].name == "sumSeries(a,b)"
+        assert result[0].datapoints() == [(1.0, 60), (12.0, 120), (20.0, 180), (30.0, 240)]
+        assert values(self.apply("averageSeries", a, b)) == [[1.0, 6.0, 20.0, 30.0]]
+        assert values(self.apply("maxSeries", a, b)) == [[1.0, 10.0, 20.0, 30.0]]
+        assert values(self.apply("minSeries", a, b)) == [[1.0, 2.0, 20.0, 30.0]]
+        assert self.apply("sumSeries") == []
+
+    def test_chain(self):
+        result = self.apply("sumSeries|derivative", series('a', [1, 2, 4]), series('b', [1, 2, 4]))
+        assert values(result) == [[None, 2.0, 4.0]]
+
+    def test_selectors(self):
+        a = series('a', [1, 9, 2])
+        b = series('b', [5, 5, 5])
+        c = series('c', [8, 1, None])
+        d = series('d', [None, None])
+        assert [s.name for s in self.apply("highestCurrent(2)", a, b, c, d)] == ['b', 'a']
+        assert [s.name for s in self.apply("highestMax(1)", a, b, c, d)] == ['a']
+        assert [s.name for s in self.apply("highestAverage(1)", a, b, c, d)] == ['b']
+        assert [s.name for s in self.apply("lowestCurrent(2)", a, b, c, d)] == ['c', 'a']
+        assert [s.name for s in self.apply("lowestMax(1)", a, b, c, d)] == ['b']
+        assert [s.name for s in self.apply("lowestAverage(1)", a, b, c, d)] == ['a']
+        # series without values are the last ones
+        assert [s.name for s in self.apply("lowestMax(4)", a, b, c, d)] == ['b', 'c', 'a', 'd']
+        assert self.apply("highestMax(10)") == []
+        with pytest.raises(InvalidTransform):
+            self.apply("highestMax(0)", a)
+
+    def test_selectors_stream(self):
+        assert Pipeline("highestMax(1)|derivative").streams is True
+        assert Pipeline("derivative|highestMax(1)").streams is False
+        assert Pipeline().streams is False
+
+        # any iterable can be given, the ties go to the first series
+        streamed = (series(name, [1]) for name in 'abc')
+        assert [s.name for s in Pipeline("highestMax(2)").apply(streamed)] == ['a', 'b']
+
+
+class TestPushDown(object):
+    def test_push_down(self):
+        datasource = Mock()
+        datasource.push_down.side_effect = lambda query, transform, args:\
+            query + [transform] if transform == 'highestMax' else None
+
+        pipeline = Pipeline("highestMax(2)|highestMax(1)|derivative|highestMax(1)")
+        assert pipeline.push_down(datasource, []) == ['highestMax', 'highestMax']
+        assert [func.transform for func, _ in pipeline.chain] == ['derivative', 'highestMax']
+        datasource.push_down.assert_any_call([], 'highestMax', [2.0])
+
+    def test_not_supported(self):
+        datasource = Mock()
+        datasource.push_down.return_value = None
+        pipeline = Pipeline("highestMax(2)")
+        assert pipeline.push_down(datasource, 'query') == 'query'
+        assert len(pipeline.chain) == 1
@@ -6,6 +6,8 @@ from datetime import datetime
 from datetime import timedelta
 
 from gramola.utils import (
+    TimeRange,
+    RingBuffer,
     parse_date,
     DateTimeInvalidValue,
     GramolaDictionary,
@@ -56,6 +58,34 @@ class TestGramolaDictionary(object):
         with pytest.raises(InvalidGramolaDictionary):
             TestConfig(**{'bar': None})
 
+    def test_slots(self):
+        class ParentConfig(GramolaDictionary):
+            REQUIRED_KEYS = ('foo',)
+            OPTIONAL_KEYS = ('bar',)
+
+        class ChildConfig(ParentConfig):
+            pass
+
+        conf = ChildConfig(foo=1)
+        assert not hasattr(conf, '__dict__')
+        with pytest.raises(AttributeError):
+            conf.whatever = 1
+
+        # keys inherited are not repeated
+        assert ChildConfig.required_keys() == ('foo',)
+        assert ChildConfig.optional_keys() == ('bar',)
+
+    def test_none_not_given(self):
+        class TestConfig(GramolaDictionary):
+            REQUIRED_KEYS = ('foo',)
+            OPTIONAL_KEYS = ('bar',)
+
+        conf = TestConfig(foo=1, bar=None)
+        assert conf.dict() == {'foo': 1}
+        assert conf.dumps() == '{"foo": 1}'
+        assert conf == TestConfig(foo=1)
+        assert conf != TestConfig(foo=1, bar=2)
+
 
 class TestParseDate(object):
     def test_now(self):
@@ -92,3 +122,42 @@ class TestParseDate(object):
     def test_invalid(self):
         with pytest.raises(DateTimeInvalidValue):
             parse_date("asdfasdfasdf")
+
+    def test_now_given(self):
+        now = datetime(2016, 2, 6, 20, 37, 47)
+        assert parse_date('now', now=now) == now
+        assert parse_date('-1h', now=now) == datetime(2016, 2, 6, 19, 37, 47)
+
+
+class TestTimeRange(object):
+    def test_interface(self):
+        time_range = TimeRange(1000, 4600)
+        assert time_range.seconds == 3600
+        assert time_range.datetimes() == (datetime.fromtimestamp(1000),
+                                          datetime.fromtimestamp(4600))
+
+    def test_align(self):
+        assert TimeRange(1010, 4659).align(60) == TimeRange(960, 4620)
+        assert TimeRange(960, 4620).align(60) == TimeRange(960, 4620)
+
+
+class TestRingBuffer(object):
+    def test_interface(self):
+        buffer_ = RingBuffer(3)
+        assert len(buffer_) == 0
+        assert buffer_.datapoints() == []
+        buffer_.append(1, 60)
+        buffer_.append(2, 120)
+        assert len(buffer_) == 2
+        assert buffer_.datapoints() == [(1, 60), (2, 120)]
+
+    def test_overwrite_oldest(self):
+        buffer_ = RingBuffer(3)
+        for i in range(1, 6):
+            buffer_.append(i, i * 60)
+        assert len(buffer_) == 3
+        assert buffer_.datapoints() == [(3, 180), (4, 240), (5, 300)]
+
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            RingBuffer(0)